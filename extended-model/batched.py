@@ -0,0 +1,137 @@
+import argparse
+import csv
+import os
+from random import Random
+from typing import List, Optional
+
+from analytics import StreamingAnalyzer
+from dynamic_params import DynamicParamReader, DynamicParams, FixedParamReader, parse_changes
+from models import World
+from output import OutputWriter, open_output
+from static_params import SimulationConfig
+from vectorized import VectorizedEngine
+
+# Author: Dafu Ai
+# Batched replicates: many worlds of the same size and parameters are held by one set of
+# NumPy arrays (with a leading world dimension) and advanced by one set of array operations
+# per tick, instead of one interpreter loop per world. Every world writes the same rows as
+# World.update would to its own output, e.g.
+# python3 batched.py --replicates 200 --frames 1000 --set government_legitimacy=0.7
+# The worlds share one random stream seeded from the seed of the batch, so a replicate is
+# reproduced by running the same batch again, not by a single world with some seed.
+
+
+class WorldBatch:
+    """
+    Simulates several independent worlds of the same static and dynamic parameters
+    on the numpy engine, one output per world.
+    """
+    config: SimulationConfig            # Static parameters of every world
+    random: Random                      # Random generator seeding the engine
+    params_reader: DynamicParamReader   # Reader for dynamic parameters (shared by all worlds)
+    params: DynamicParams               # Snapshot of dynamic parameters for the current frame
+    engine: VectorizedEngine            # Arrays of all worlds
+    outputs: List[OutputWriter]         # Writer of every world
+    analyzers: Optional[List[StreamingAnalyzer]]  # Analysis of every world (None if off)
+    frame: int                          # Last frame which has been updated (0 before the first)
+
+    def __init__(self, dynamic_params_reader: DynamicParamReader, output_filenames: List[str],
+                 config: SimulationConfig = SimulationConfig(),
+                 analyzers: Optional[List[StreamingAnalyzer]] = None) -> None:
+        """Create one world per output file."""
+        if analyzers is not None and len(analyzers) != len(output_filenames):
+            raise ValueError('A batch needs one analyzer per world')
+
+        self.config = config
+        self.random = Random(config.seed)
+        self.params_reader = dynamic_params_reader
+        self.params = dynamic_params_reader.refresh()
+        self.analyzers = analyzers
+        self.frame = 0
+        self.engine = VectorizedEngine(self, len(output_filenames))
+        self.outputs = [open_output(path, World.output_columns(), config.output_format,
+                                    config.flush_interval, World.output_types())
+                        for path in output_filenames]
+
+    def __enter__(self) -> 'WorldBatch':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Flush and close the outputs."""
+        for output in self.outputs:
+            output.close()
+
+    def update(self, frame: int) -> None:
+        """Advance every world by one tick and write its counts."""
+        self.frame = frame
+        self.refresh_params()
+        self.engine.step()
+
+        for i, counts in enumerate(self.engine.replicate_counts()):
+            self.outputs[i].write_row(World.output_row(frame, counts, self.params))
+
+            if self.analyzers is not None:
+                self.analyzers[i].observe(frame, counts[2], counts[0],
+                                          World.burst_threshold(self.config, self.params))
+
+    def refresh_params(self) -> None:
+        """Pick up changes to the dynamic parameters (once per frame)."""
+        self.params = self.params_reader.refresh(self.frame)
+
+    def get_dynamic_param(self, key):
+        """Get the value of dynamic parameters (from the snapshot of the current frame)"""
+        return getattr(self.params, key)
+
+
+def write_statistics(analyzers: List[StreamingAnalyzer], output_path: str) -> None:
+    """Write the statistics of every world, one row per world."""
+    with open(output_path, 'w', newline='') as output_file:
+        csv_writer = csv.writer(output_file)
+        csv_writer.writerow(['replicate'] + list(analyzers[0].scalars()))
+
+        for replicate, analyzer in enumerate(analyzers):
+            csv_writer.writerow([replicate] + list(analyzer.scalars().values()))
+
+
+def main(args=None):
+    """The entry point for batched replicates."""
+    parser = argparse.ArgumentParser(
+        description='Run replicates of the Rebellion model as one batch.')
+    parser.add_argument('--replicates', type=int, default=100,
+                        help='number of worlds (default: %(default)s)')
+    parser.add_argument('--frames', type=int, required=True,
+                        help='number of frames to simulate')
+    parser.add_argument('--set', dest='changes', metavar='NAME=VALUE', action='append', default=[],
+                        help='dynamic parameter changed from its default (can be repeated)')
+    parser.add_argument('--seed', type=int, default=None,
+                        help='seed of the batch (default: random)')
+    parser.add_argument('--analysis', action='store_true',
+                        help='also write the burst statistics of every world to analysis.csv')
+    parser.add_argument('--output-dir', default='batch',
+                        help='directory of the outputs (default: %(default)s)')
+    options = parser.parse_args(args)
+
+    params = DynamicParams()._replace(**parse_changes(options.changes))
+    os.makedirs(options.output_dir, exist_ok=True)
+    paths = [os.path.join(options.output_dir, 'replicate_{:05d}.csv'.format(replicate))
+             for replicate in range(options.replicates)]
+    config = SimulationConfig(seed=options.seed)
+    analyzers = [StreamingAnalyzer(config.burst_exit_fraction) for _ in paths] \
+        if options.analysis else None
+
+    with WorldBatch(FixedParamReader(params), paths, config=config,
+                    analyzers=analyzers) as batch:
+        for frame in range(1, options.frames + 1):
+            batch.update(frame)
+
+    if analyzers is not None:
+        write_statistics(analyzers, os.path.join(options.output_dir, 'analysis.csv'))
+
+    print('{} replicate(s) written to {}'.format(len(paths), options.output_dir))
+
+
+if __name__ == '__main__':
+    main()
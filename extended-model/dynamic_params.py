@@ -1,5 +1,7 @@
 import json
+import os
 from pathlib import Path
+from typing import NamedTuple, Optional, Tuple, List, Dict, Any
 
 # Author: Dafu Ai
 
@@ -22,8 +24,45 @@ DYNAMIC_PARAMETERS = [
 ]
 
 
+class DynamicParams(NamedTuple):
+    """Immutable, typed snapshot of the dynamic parameters"""
+    max_jailed_term: int = MAX_JAILED_TERM[1]
+    government_legitimacy: float = GOVERNMENT_LEGITIMACY[1]
+    movement: bool = MOVEMENT[1]
+    frame_interval: float = FRAME_INTERVAL[1]
+    rebellion_threshold: float = REBELLION_THRESHOLD[1]
+
+    @classmethod
+    def from_dict(cls, params: dict) -> 'DynamicParams':
+        """Build a snapshot from a params dict, missing keys fall back to the defaults.
+        Values are converted to the types of their fields (ValueError if they cannot be)"""
+        return cls(**{key: cls.convert(key, params[key]) for key in cls._fields if key in params})
+
+    @classmethod
+    def convert(cls, key: str, value: Any) -> Any:
+        """Convert a value (e.g. read from json) to the type of a field, so that 1 is 1.0
+        for a float field. Raise ValueError if the value does not fit the field"""
+        field_type = cls.__annotations__[key]
+
+        if field_type is bool:
+            if not isinstance(value, bool):
+                raise ValueError('{} must be true or false, got {!r}'.format(key, value))
+            return value
+
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise ValueError('{} must be a number, got {!r}'.format(key, value))
+        if field_type is int and value != int(value):
+            raise ValueError('{} must be an integer, got {!r}'.format(key, value))
+
+        return field_type(value)
+
+
 class DynamicParamReader:
     """Reader for dynamic parameters"""
+    file_path: str                          # Path of the json file
+    params: DynamicParams                   # Last successfully loaded snapshot
+    _stamp: Optional[Tuple[int, int, int]]  # (mtime, inode, size) of the last load
+
     def __init__(self, file_path) -> None:
         self.file_path = file_path
 
@@ -37,8 +76,169 @@ class DynamicParamReader:
             with open(file_path, 'w') as outfile:
                 json.dump(params, outfile)
 
+        self.params = DynamicParams()
+        self._stamp = None
+        self.refresh()
+
+    def refresh(self, frame: int = 0) -> DynamicParams:
+        """
+        Return the current snapshot, reloading it only if the file has changed
+        since the last load (polled by mtime, inode and size). The frame is not used.
+        """
+        try:
+            stat = os.stat(self.file_path)
+        except FileNotFoundError:
+            return self.params
+
+        stamp = (stat.st_mtime_ns, stat.st_ino, stat.st_size)
+        if stamp != self._stamp:
+            self._stamp = stamp
+            try:
+                self.params = DynamicParams.from_dict(self.read_params())
+            except ValueError:
+                # The file is empty or half-written, keep the last good snapshot
+                pass
+
+        return self.params
+
     def read_params(self) -> dict:
         """Read and return the params dict from the file path"""
         with open(self.file_path, 'r') as file:
             params = json.load(file)
             return params
+
+
+class FixedParamReader:
+    """Reader returning a fixed snapshot, for runs which are not adjusted on the fly"""
+    params: DynamicParams   # The snapshot returned on every refresh
+
+    def __init__(self, params: DynamicParams = DynamicParams()) -> None:
+        self.params = params
+
+    def refresh(self, frame: int = 0) -> DynamicParams:
+        """Return the fixed snapshot"""
+        return self.params
+
+
+def parse_changes(assignments: List[str]) -> Dict[str, Any]:
+    """Parse name=value assignments of dynamic parameters (values are json, e.g. 0.3 or true),
+    converted to the types of their fields (ValueError if they cannot be)."""
+    changes = {}
+
+    for assignment in assignments:
+        name, _, value = assignment.partition('=')
+        if name not in DynamicParams._fields:
+            raise ValueError('Unknown dynamic parameter: ' + name)
+        changes[name] = DynamicParams.convert(name, json.loads(value))
+
+    return changes
+
+
+class ParamSchedule:
+    """
+    Timeline of changes to the dynamic parameters, loaded from json, e.g.
+    {
+        "base": {"government_legitimacy": 0.8},
+        "events": [
+            {"frame": 500, "set": {"government_legitimacy": 0.3}},
+            {"frame": 600, "until": 700, "ramp": {"government_legitimacy": 0.8}}
+        ]
+    }
+    A set takes effect from its frame on. A ramp moves linearly from the value at its frame
+    to its target at the until frame (integer parameters are rounded, boolean parameters cannot
+    be ramped). Every parameter is compiled into segments (start frame, end frame, start value,
+    end value), sorted by frame and not overlapping, whose values have the type of the parameter.
+    """
+    base: DynamicParams                                 # Values before the first event
+    segments: Dict[str, List[Tuple[int, int, Any, Any]]]  # Segments of each scheduled parameter
+
+    def __init__(self, events: List[dict], base: DynamicParams = DynamicParams()) -> None:
+        self.base = base
+        self.segments = {}
+        values = base._asdict()
+
+        for event in sorted(events, key=lambda e: e['frame']):
+            start = event['frame']
+            end = event.get('until', start)
+
+            changes = [(name, value, start) for name, value in event.get('set', {}).items()]
+            if 'ramp' in event:
+                if end <= start:
+                    raise ValueError('A ramp must end after its frame: {}'.format(event))
+                changes += [(name, value, end) for name, value in event['ramp'].items()]
+
+            for name, value, until in changes:
+                if name not in DynamicParams._fields:
+                    raise ValueError('Unknown dynamic parameter: ' + name)
+                if until > start and DynamicParams.__annotations__[name] is bool:
+                    raise ValueError('A boolean parameter cannot be ramped: ' + name)
+                value = DynamicParams.convert(name, value)
+
+                segments = self.segments.setdefault(name, [])
+                if segments and segments[-1][1] > start:
+                    raise ValueError('Overlapping changes of {} at frame {}'.format(name, start))
+
+                start_value = DynamicParams.convert(name, values[name])
+                segments.append((start, until, start_value, value))
+                values[name] = value
+
+    @classmethod
+    def from_file(cls, file_path: str) -> 'ParamSchedule':
+        """Load a schedule from a json file."""
+        with open(file_path, 'r') as file:
+            schedule = json.load(file)
+
+        return cls(schedule.get('events', []), DynamicParams.from_dict(schedule.get('base', {})))
+
+    @staticmethod
+    def value_at(name: str, segment: Tuple[int, int, Any, Any], frame: int) -> Any:
+        """Value of a parameter at a frame, from the last segment starting at or before it."""
+        start, end, start_value, end_value = segment
+        if frame >= end:
+            return end_value
+
+        value = start_value + (end_value - start_value) * (frame - start) / (end - start)
+        return round(value) if DynamicParams.__annotations__[name] is int else value
+
+
+class ScheduledParamReader:
+    """
+    Reader resolving the dynamic parameters of every frame from a schedule, so that runs with
+    changes are deterministic and need no file. Frames are expected to mostly move forward:
+    a cursor per parameter makes every refresh O(1) (amortised over the events).
+    """
+    schedule: ParamSchedule     # The schedule to follow
+    params: DynamicParams       # Snapshot of the last refreshed frame
+    frame: int                  # Last refreshed frame
+    cursors: Dict[str, int]     # Index of the current segment of each parameter (-1 if none yet)
+
+    def __init__(self, schedule: ParamSchedule) -> None:
+        self.schedule = schedule
+        self.params = schedule.base
+        self.frame = 0
+        self.cursors = dict.fromkeys(schedule.segments, -1)
+
+    def refresh(self, frame: int = 0) -> DynamicParams:
+        """Return the snapshot of a frame (the same object as long as nothing changes)."""
+        if frame < self.frame:
+            # Going back (e.g. a resumed run) starts over from the first segments
+            self.cursors = dict.fromkeys(self.schedule.segments, -1)
+            self.params = self.schedule.base
+        self.frame = frame
+
+        changes = {}
+        for name, segments in self.schedule.segments.items():
+            cursor = self.cursors[name]
+            while cursor + 1 < len(segments) and segments[cursor + 1][0] <= frame:
+                cursor += 1
+            self.cursors[name] = cursor
+
+            if cursor >= 0:
+                value = ParamSchedule.value_at(name, segments[cursor], frame)
+                if value != getattr(self.params, name):
+                    changes[name] = value
+
+        if changes:
+            self.params = self.params._replace(**changes)
+
+        return self.params
@@ -0,0 +1,146 @@
+import os
+from time import perf_counter
+from typing import Callable, Dict, List, Optional, Tuple
+
+from models import World, Turtle, Agent, Cop, PatchMap
+from output import OutputWriter, open_output, FORMAT_CSV
+from static_params import FLUSH_INTERVAL
+
+# Author: Dafu Ai
+# Opt-in instrumentation of the hot paths of a frame.
+# The methods are wrapped on their classes only while an Instrumentation is installed,
+# so an uninstrumented run calls the plain methods and pays nothing.
+# Times are inclusive: a phase also counts the time of the phases it calls
+# (e.g. Cop.enforce includes its PatchMap.filter_neighbour_turtles).
+
+# Phases which are timed (name, class, method name), World.update comes first as it ends a frame
+INSTRUMENTED_METHODS: List[Tuple[str, type, str]] = [
+    ('World.update', World, 'update'),
+    ('World.refresh_params', World, 'refresh_params'),
+    ('World.update_turtles', World, 'update_turtles'),
+    ('World.count_agents', World, 'count_agents'),
+    ('World.write_output', World, 'write_output'),
+    ('Turtle.move', Turtle, 'move'),
+    ('Agent.determine_behaviour', Agent, 'determine_behaviour'),
+    ('Cop.enforce', Cop, 'enforce'),
+    ('PatchMap.filter_neighbour_turtles', PatchMap, 'filter_neighbour_turtles'),
+]
+
+
+def timing_path(output_path: str) -> str:
+    """Get the path of the timing table written next to an output file
+    (out.csv -> out_timing.csv)."""
+    root, _ = os.path.splitext(output_path)
+    return root + '_timing.csv'
+
+
+class Instrumentation:
+    """
+    Records the wall time and the number of calls of every phase, and writes one row per frame
+    (frame, then the seconds and calls of each phase) to a timing table.
+    To be used as a context manager around the run.
+    """
+    phases: List[str]                   # Names of the timed phases
+    times: Dict[str, float]             # Seconds spent in each phase during the current frame
+    calls: Dict[str, int]               # Calls of each phase during the current frame
+    total_times: Dict[str, float]       # Seconds spent in each phase during the whole run
+    total_calls: Dict[str, int]         # Calls of each phase during the whole run
+    originals: List[Tuple[type, str, Callable]]  # Methods replaced while installed
+    output: Optional[OutputWriter]      # Writer of the timing table (None to keep no table)
+
+    def __init__(self, output_path: Optional[str], flush_interval: int = FLUSH_INTERVAL) -> None:
+        self.phases = [name for name, _, _ in INSTRUMENTED_METHODS]
+        self.times = dict.fromkeys(self.phases, 0.0)
+        self.calls = dict.fromkeys(self.phases, 0)
+        self.total_times = dict.fromkeys(self.phases, 0.0)
+        self.total_calls = dict.fromkeys(self.phases, 0)
+        self.originals = []
+        self.output = None
+
+        if output_path is not None:
+            columns = ['frame']
+            for phase in self.phases:
+                columns += [phase + '_seconds', phase + '_calls']
+            self.output = open_output(output_path, columns, FORMAT_CSV, flush_interval)
+
+    def __enter__(self) -> 'Instrumentation':
+        self.install()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.uninstall()
+
+    def install(self) -> None:
+        """Wrap the instrumented methods (for every world of this process)."""
+        if self.originals:
+            return
+
+        for phase, cls, name in INSTRUMENTED_METHODS:
+            method = cls.__dict__[name]
+            self.originals.append((cls, name, method))
+            setattr(cls, name, self.end_frame_after(method) if phase == 'World.update'
+                    else self.timed(phase, method))
+
+    def uninstall(self) -> None:
+        """Restore the plain methods and close the timing table."""
+        for cls, name, method in self.originals:
+            setattr(cls, name, method)
+        self.originals = []
+
+        if self.output is not None:
+            self.output.close()
+
+    def timed(self, phase: str, method: Callable) -> Callable:
+        """Wrap a method so that its calls are timed and counted as the specified phase."""
+        times = self.times
+        calls = self.calls
+
+        def timed_method(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                times[phase] += perf_counter() - start
+                calls[phase] += 1
+
+        timed_method.__name__ = method.__name__
+        timed_method.__doc__ = method.__doc__
+        return timed_method
+
+    def end_frame_after(self, update: Callable) -> Callable:
+        """Wrap World.update so that it is timed and the frame is recorded once it returns."""
+        timed_update = self.timed('World.update', update)
+
+        def update_and_record(world: World, frame: int) -> None:
+            timed_update(world, frame)
+            self.end_frame(frame)
+
+        update_and_record.__name__ = update.__name__
+        update_and_record.__doc__ = update.__doc__
+        return update_and_record
+
+    def end_frame(self, frame: int) -> None:
+        """Write the row of a frame and start over for the next one."""
+        if self.output is not None:
+            row = [frame]
+            for phase in self.phases:
+                row += [self.times[phase], self.calls[phase]]
+            self.output.write_row(row)
+
+        for phase in self.phases:
+            self.total_times[phase] += self.times[phase]
+            self.total_calls[phase] += self.calls[phase]
+            self.times[phase] = 0.0
+            self.calls[phase] = 0
+
+    def summary(self) -> str:
+        """Get a table of the time and calls of every phase over the whole run."""
+        lines = ['{:<36} {:>12} {:>12} {:>14}'.format('phase', 'seconds', 'calls', 'us per call')]
+
+        for phase in self.phases:
+            calls = self.total_calls[phase]
+            lines.append('{:<36} {:>12.3f} {:>12} {:>14.2f}'.format(
+                phase, self.total_times[phase], calls,
+                self.total_times[phase] / calls * 1e6 if calls else 0.0))
+
+        return '\n'.join(lines)
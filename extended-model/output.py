@@ -0,0 +1,219 @@
+import csv
+import json
+import struct
+import sys
+from array import array
+from typing import List, Dict, IO, Optional
+
+# Author: Dafu Ai
+# Output writers which are kept open for the whole run.
+# Rows are buffered and only pushed to the file every `flush_interval` rows.
+
+FORMAT_CSV = 'csv'          # Comma separated values (can be opened in Excel)
+FORMAT_JSONL = 'jsonl'      # One json object per row
+FORMAT_BINARY = 'binary'    # Compact columnar blocks (see BinaryOutputWriter)
+
+BINARY_MAGIC = b'RBLN'      # First bytes of a binary output file
+BINARY_VERSION = 1
+BINARY_DEFAULT_TYPE = 'd'   # Type code of the columns of a file closed before knowing their types
+
+
+class OutputWriter:
+    """
+    Base class of output writers, to be used as a context manager.
+    """
+    file_path: str          # Path of the output file
+    columns: List[str]      # Names of the columns
+    types: Optional[List[type]]  # Declared type of each column (None if not declared)
+    flush_interval: int     # Number of rows between two flushes
+    pending: int            # Number of rows written since the last flush
+    file: IO                # The open output file
+
+    def __init__(self, file_path: str, columns: List[str], flush_interval: int,
+                 types: Optional[List[type]] = None) -> None:
+        self.file_path = file_path
+        self.columns = columns
+        self.types = types
+        self.flush_interval = max(1, flush_interval)
+        self.pending = 0
+        self.file = self.open()
+
+    def __enter__(self) -> 'OutputWriter':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def open(self) -> IO:
+        """Open the output file (truncating it)."""
+        return open(self.file_path, 'w', newline='')
+
+    def write_row(self, row: list) -> None:
+        """Write a row, flushing if enough rows have been written since the last flush."""
+        self.write(row)
+        self.pending += 1
+
+        if self.pending >= self.flush_interval:
+            self.flush()
+
+    def write(self, row: list) -> None:
+        """Write a row to the buffer of the format."""
+        raise NotImplementedError
+
+    def flush(self) -> None:
+        """Push all buffered rows to the file."""
+        self.file.flush()
+        self.pending = 0
+
+    def close(self) -> None:
+        """Flush and close the file."""
+        if not self.file.closed:
+            self.flush()
+            self.file.close()
+
+
+class CsvOutputWriter(OutputWriter):
+    """
+    Writes rows as csv, starting with a header row.
+    """
+    def __init__(self, file_path: str, columns: List[str], flush_interval: int,
+                 types: Optional[List[type]] = None) -> None:
+        super().__init__(file_path, columns, flush_interval, types)
+        self.csv_writer = csv.writer(self.file)
+        self.csv_writer.writerow(columns)
+
+    def write(self, row: list) -> None:
+        self.csv_writer.writerow(row)
+
+
+class JsonLinesOutputWriter(OutputWriter):
+    """
+    Writes every row as a json object keyed by column names.
+    """
+    def write(self, row: list) -> None:
+        self.file.write(json.dumps(dict(zip(self.columns, row))) + '\n')
+
+
+class BinaryOutputWriter(OutputWriter):
+    """
+    Writes rows into columnar blocks.
+    The file starts with the magic bytes, the version and a length-prefixed json header
+    holding the column names, their array type codes and the byte order.
+    Each block is the number of rows (uint32) followed by the values of every column.
+    The type codes come from the declared types of the columns, or else from the first row.
+    A value which does not fit the type code of its column raises ValueError.
+    """
+    type_codes: List[str]   # Array type code of each column (empty until known)
+    buffers: List[array]    # Values of each column waiting to be written
+
+    TYPE_CODES = {bool: 'B', int: 'q', float: 'd'}  # Array type code of each supported type
+
+    def __init__(self, file_path: str, columns: List[str], flush_interval: int,
+                 types: Optional[List[type]] = None) -> None:
+        super().__init__(file_path, columns, flush_interval, types)
+        self.type_codes = []
+        self.buffers = []
+
+        if types is not None:
+            if len(types) != len(columns):
+                raise ValueError('Expected {} column types, got {}'.format(len(columns),
+                                                                          len(types)))
+            self.write_header([BinaryOutputWriter.TYPE_CODES[t] for t in types])
+
+    def open(self) -> IO:
+        return open(self.file_path, 'wb')
+
+    @staticmethod
+    def type_code(value) -> str:
+        """Get the array type code for a value."""
+        code = BinaryOutputWriter.TYPE_CODES.get(type(value))
+        if code is None:
+            raise ValueError('Unsupported value in binary output: ' + repr(value))
+
+        return code
+
+    def write_header(self, type_codes: List[str]) -> None:
+        """Fix the type codes of the columns and write the header of the file."""
+        self.type_codes = type_codes
+        self.buffers = [array(code) for code in type_codes]
+        header = json.dumps({
+            'columns': self.columns,
+            'types': type_codes,
+            'byteorder': sys.byteorder
+        }).encode()
+        self.file.write(BINARY_MAGIC + struct.pack('<HI', BINARY_VERSION, len(header)))
+        self.file.write(header)
+
+    def write(self, row: list) -> None:
+        if not self.type_codes:
+            self.write_header([BinaryOutputWriter.type_code(value) for value in row])
+
+        # Check the whole row first, so that a bad value leaves no partial row in the buffers
+        for name, code, value in zip(self.columns, self.type_codes, row):
+            value_code = BinaryOutputWriter.type_code(value)
+            # An int fits a float column, any other change of type would corrupt the value
+            if value_code != code and not (value_code == 'q' and code == 'd'):
+                raise ValueError('Column {} has type code {}, got {!r}'.format(name, code, value))
+
+        for buffer, value in zip(self.buffers, row):
+            buffer.append(value)
+
+    def flush(self) -> None:
+        if self.buffers and len(self.buffers[0]) > 0:
+            self.file.write(struct.pack('<I', len(self.buffers[0])))
+            for buffer in self.buffers:
+                buffer.tofile(self.file)
+                del buffer[:]
+
+        super().flush()
+
+    def close(self) -> None:
+        # A file without any row still gets its header, so that it can be read back
+        if not self.file.closed and not self.type_codes:
+            self.write_header([BINARY_DEFAULT_TYPE] * len(self.columns))
+
+        super().close()
+
+
+def read_binary(file_path: str) -> Dict[str, list]:
+    """Read a binary output file back into a dict of column name -> values."""
+    with open(file_path, 'rb') as file:
+        if file.read(len(BINARY_MAGIC)) != BINARY_MAGIC:
+            raise ValueError('Not a binary output file: ' + file_path)
+
+        _, header_length = struct.unpack('<HI', file.read(6))
+        header = json.loads(file.read(header_length).decode())
+        values = [array(code) for code in header['types']]
+
+        while True:
+            block = file.read(4)
+            if len(block) < 4:
+                break
+
+            rows = struct.unpack('<I', block)[0]
+            for column in values:
+                column.fromfile(file, rows)
+
+        for column in values:
+            if header['byteorder'] != sys.byteorder:
+                column.byteswap()
+
+        return {name: [bool(v) for v in column] if code == 'B' else column.tolist()
+                for name, code, column in zip(header['columns'], header['types'], values)}
+
+
+OUTPUT_WRITERS = {
+    FORMAT_CSV: CsvOutputWriter,
+    FORMAT_JSONL: JsonLinesOutputWriter,
+    FORMAT_BINARY: BinaryOutputWriter
+}
+
+
+def open_output(file_path: str, columns: List[str], output_format: str,
+                flush_interval: int, types: Optional[List[type]] = None) -> OutputWriter:
+    """Open an output writer of the specified format, optionally declaring
+    the type (bool, int or float) of every column."""
+    if output_format not in OUTPUT_WRITERS:
+        raise ValueError('Unknown output format: ' + output_format)
+
+    return OUTPUT_WRITERS[output_format](file_path, columns, flush_interval, types)
@@ -0,0 +1,54 @@
+import json
+import os
+import struct
+import sys
+from array import array
+from typing import Dict, Tuple
+
+# Author: Dafu Ai
+# Compact binary snapshots of a world (see World.save_snapshot and World.load_snapshot).
+# The file starts with the magic bytes, the version and a length-prefixed json header
+# (the static parameters, the frame, the scalar state of the random generator, the byte order
+# and the name, type code and length of every array), followed by the raw values of the arrays.
+
+SNAPSHOT_MAGIC = b'RBSN'    # First bytes of a snapshot file
+SNAPSHOT_VERSION = 2
+
+
+def write_snapshot(file_path: str, header: dict, arrays: Dict[str, array]) -> None:
+    """Write a snapshot, replacing the file only once it is complete."""
+    header = dict(header, byteorder=sys.byteorder,
+                  arrays=[[name, values.typecode, len(values)] for name, values in arrays.items()])
+    encoded = json.dumps(header).encode()
+    temp_path = file_path + '.tmp'
+
+    with open(temp_path, 'wb') as file:
+        file.write(SNAPSHOT_MAGIC + struct.pack('<HI', SNAPSHOT_VERSION, len(encoded)))
+        file.write(encoded)
+        for values in arrays.values():
+            values.tofile(file)
+
+    os.replace(temp_path, file_path)
+
+
+def read_snapshot(file_path: str) -> Tuple[dict, Dict[str, array]]:
+    """Read a snapshot back into its header and its arrays."""
+    with open(file_path, 'rb') as file:
+        if file.read(len(SNAPSHOT_MAGIC)) != SNAPSHOT_MAGIC:
+            raise ValueError('Not a snapshot file: ' + file_path)
+
+        version, header_length = struct.unpack('<HI', file.read(6))
+        if version != SNAPSHOT_VERSION:
+            raise ValueError('Unsupported snapshot version: {}'.format(version))
+
+        header = json.loads(file.read(header_length).decode())
+        arrays = {}
+
+        for name, code, length in header['arrays']:
+            values = array(code)
+            values.fromfile(file, length)
+            if header['byteorder'] != sys.byteorder:
+                values.byteswap()
+            arrays[name] = values
+
+    return header, arrays
@@ -1,5 +1,6 @@
 import json
 from pathlib import Path
+from typing import NamedTuple, Optional
 
 # Author: Dafu ai
 
@@ -15,8 +16,38 @@ INITIAL_COP_DENSITY: float = 0.04   # Percentage of cops
 INITIAL_AGENT_DENSITY: float = 0.7  # Percentage of agents
                                     # (in the total number of patches in the map).
 VISION: float = 7.0                 # Defines the radius of neighbourhood for any patch.
+PRECOMPUTE_NEIGHBOURS: bool = True  # Cache a neighbour list per patch (faster ticks), or generate
+                                    # neighbours on demand (less memory for large maps).
+SKIP_STABLE_AGENTS: bool = False    # Reuse the last decision of an agent while its inputs are
+                                    # unchanged (same results, see Agent.determine_behaviour).
+SYNCHRONOUS: bool = False           # Update all turtles from the same state in every phase of a
+                                    # frame, instead of one after another (see synchronous.py).
+WORKERS: int = 0                    # Processes deciding the agents in the synchronous mode
+                                    # (0 or 1 to decide them in the process of the world, as are
+                                    # frames too small for the pool, see synchronous.py), or owning
+                                    # the bands of the decomposed engine (0 for one per core).
+TILE_SIZE: int = 20                 # Side (in patches) of the tiles of the map handed to a worker.
+TOPOLOGY: str = 'bounded'           # Topology of the map ('bounded', or 'torus' to wrap around
+                                    # at the edges like NetLogo does).
+SEED: Optional[int] = None          # Seed of the random generator of a world (None for random)
 MAX_FRAMES = 1000                   # The number of frames to be ticked for the simulator
 FILE_PATH = 'dynamic_params.json'   # Path of the file that stores the parameters
+OUTPUT_FORMAT: str = 'csv'          # Format of the output ('csv', 'jsonl' or 'binary')
+FLUSH_INTERVAL: int = 50            # Number of frames buffered before the output is flushed
+DEBUG_COUNTERS: bool = False        # Cross-check the agent counters with a full recount every frame
+CHECKPOINT_INTERVAL: int = 0        # Frames between two snapshots of a run
+                                    # (0 to only save at the end)
+GRID_STRIDE: int = 1                # Frames between two dumps of the patch states (see grid.py)
+BURST_EXIT_FRACTION: float = 0.5    # A burst ends once the active ratio drops to this fraction
+                                    # of the threshold which started it
+INSTRUMENT: bool = False            # Record the time spent in the hot paths of every frame
+ENGINE: str = 'object'              # Engine running the world ('object', 'numpy' for large maps,
+                                    # or 'decomposed' for maps too large for one process)
+SUBSTEPS: int = 16                  # Random sub-steps of a tick on the array engines: every turtle
+                                    # acts in one of them and sees the moves, decisions and arrests
+                                    # of the earlier ones, which brings the series close to those of
+                                    # the object engine (1 to let all turtles act on the same state,
+                                    # like SYNCHRONOUS, see vectorized.py).
 MIN_DANGEROUS_PERCEIVED_HARDSHIP : float = 0.8  # The minimum value of perceived hardship for being
                                                 # a dangerous rebel.
 
@@ -33,3 +64,45 @@ def total_cops() -> int:
 def total_agents() -> int:
     """Total number of agents."""
     return int(total_patches() * INITIAL_AGENT_DENSITY)
+
+
+class SimulationConfig(NamedTuple):
+    """
+    Immutable set of static parameters for one world, defaulting to the constants above.
+    Field names are the lower case names of the constants.
+    Being a NamedTuple it has no per-instance __dict__ (__slots__ is empty), it cannot be
+    modified once created and it is hashable, so it can be shared by many worlds and used
+    as a cache key.
+    """
+    k: float = K
+    threshold: float = THRESHOLD
+    map_height: int = MAP_HEIGHT
+    map_width: int = MAP_WIDTH
+    initial_cop_density: float = INITIAL_COP_DENSITY
+    initial_agent_density: float = INITIAL_AGENT_DENSITY
+    vision: float = VISION
+    precompute_neighbours: bool = PRECOMPUTE_NEIGHBOURS
+    skip_stable_agents: bool = SKIP_STABLE_AGENTS
+    synchronous: bool = SYNCHRONOUS
+    topology: str = TOPOLOGY
+    seed: Optional[int] = SEED
+    min_dangerous_perceived_hardship: float = MIN_DANGEROUS_PERCEIVED_HARDSHIP
+    workers: int = WORKERS
+    output_format: str = OUTPUT_FORMAT
+    flush_interval: int = FLUSH_INTERVAL
+    debug_counters: bool = DEBUG_COUNTERS
+    grid_stride: int = GRID_STRIDE
+    substeps: int = SUBSTEPS
+    burst_exit_fraction: float = BURST_EXIT_FRACTION
+
+    def total_patches(self) -> int:
+        """Total number of patches."""
+        return self.map_height * self.map_width
+
+    def total_cops(self) -> int:
+        """Total number of cops."""
+        return int(self.total_patches() * self.initial_cop_density)
+
+    def total_agents(self) -> int:
+        """Total number of agents."""
+        return int(self.total_patches() * self.initial_agent_density)
@@ -0,0 +1,230 @@
+import json
+from math import sqrt
+from typing import Dict, List, Optional
+
+# Author: Dafu Ai
+# Streaming analysis of the rebellion time series, fed by World.update frame by frame.
+# Nothing is kept per frame, so the memory stays the same however long the run is:
+# running moments (Welford's algorithm) and log2 histograms with a fixed number of bins.
+#
+# A burst (outburst of rebellion) starts when the ratio of active agents to the agents which
+# are free (active + quiet) exceeds the threshold, and ends once the ratio drops to
+# the burst_exit_fraction of the threshold (BURST_EXIT_FRACTION unless the config of the world
+# sets it). The gap between the two (hysteresis) keeps a ratio hovering around the threshold
+# from being split into many short bursts.
+
+HISTOGRAM_BINS = 32     # Bins of a log2 histogram (bin k holds the values in [2^(k-1), 2^k))
+
+
+class RunningStats:
+    """
+    Running count, mean, variance, minimum and maximum of a series of values.
+    """
+    count: int          # Number of values
+    mean: float         # Mean of the values
+    m2: float           # Sum of the squared differences to the mean
+    minimum: float      # Smallest value (None before the first)
+    maximum: float      # Largest value (None before the first)
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.minimum = None
+        self.maximum = None
+
+    def add(self, value: float) -> None:
+        """Add a value to the series."""
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+
+        if self.minimum is None or value < self.minimum:
+            self.minimum = value
+        if self.maximum is None or value > self.maximum:
+            self.maximum = value
+
+    def variance(self) -> float:
+        """Sample variance of the values (0 for less than two values)."""
+        return self.m2 / (self.count - 1) if self.count > 1 else 0.0
+
+    def std(self) -> float:
+        """Sample standard deviation of the values."""
+        return sqrt(self.variance())
+
+    def as_dict(self) -> dict:
+        """The statistics by name."""
+        return {'count': self.count, 'mean': self.mean, 'variance': self.variance(),
+                'std': self.std(), 'min': self.minimum, 'max': self.maximum}
+
+
+class LogHistogram:
+    """
+    Histogram of non-negative integers in bins of doubling width (0, 1, 2-3, 4-7, ...).
+    Values beyond the last bin are counted in it.
+    """
+    bins: List[int]     # Number of values in every bin
+
+    def __init__(self) -> None:
+        self.bins = [0] * HISTOGRAM_BINS
+
+    def add(self, value: int) -> None:
+        """Count a value."""
+        self.bins[min(int(value).bit_length(), HISTOGRAM_BINS - 1)] += 1
+
+    @staticmethod
+    def bin_range(k: int) -> List[int]:
+        """The [low, high] values of a bin."""
+        return [0, 0] if k == 0 else [1 << (k - 1), (1 << k) - 1]
+
+    def as_dict(self) -> List[List[int]]:
+        """The [low, high, count] of every bin holding values."""
+        return [self.bin_range(k) + [count] for k, count in enumerate(self.bins) if count]
+
+
+class StreamingAnalyzer:
+    """
+    Analyses the counts of every frame as they are produced: the moments of the active counts,
+    and the number, duration (frames), size (peak active agents) and volume (active agents
+    summed over the frames) of the bursts, and the intervals (frames) between them.
+    """
+    exit_fraction: float            # Fraction of the threshold at which a burst ends
+    frames: int                     # Number of frames observed
+    active: RunningStats            # Active agents per frame
+    ratio: RunningStats             # Ratio of active to free agents per frame
+    bursts: int                     # Number of completed bursts
+    durations: RunningStats         # Durations of the completed bursts
+    sizes: RunningStats             # Peak active agents of the completed bursts
+    volumes: RunningStats           # Active agents summed over the frames of the completed bursts
+    intervals: RunningStats         # Frames from the end of a burst to the start of the next
+    duration_histogram: LogHistogram
+    size_histogram: LogHistogram
+    interval_histogram: LogHistogram
+    burst_start: Optional[int]      # First frame of the ongoing burst (None outside a burst)
+    burst_peak: int                 # Peak active agents of the ongoing burst
+    burst_volume: int               # Active agents summed over the ongoing burst
+    last_burst_end: Optional[int]   # Last frame of the previous burst (None before the first)
+
+    def __init__(self, exit_fraction: float) -> None:
+        self.exit_fraction = exit_fraction
+        self.frames = 0
+        self.active = RunningStats()
+        self.ratio = RunningStats()
+        self.bursts = 0
+        self.durations = RunningStats()
+        self.sizes = RunningStats()
+        self.volumes = RunningStats()
+        self.intervals = RunningStats()
+        self.duration_histogram = LogHistogram()
+        self.size_histogram = LogHistogram()
+        self.interval_histogram = LogHistogram()
+        self.burst_start = None
+        self.burst_peak = 0
+        self.burst_volume = 0
+        self.last_burst_end = None
+
+    def observe(self, frame: int, active: int, quiet: int, threshold: float) -> None:
+        """Add the active and quiet counts of a frame, with the threshold starting a burst."""
+        free = active + quiet
+        ratio = active / free if free > 0 else 0.0
+
+        self.frames += 1
+        self.active.add(active)
+        self.ratio.add(ratio)
+
+        if self.burst_start is None:
+            if ratio > threshold:
+                self.start_burst(frame)
+        elif ratio <= threshold * self.exit_fraction:
+            self.end_burst(frame - 1)
+
+        if self.burst_start is not None:
+            self.burst_peak = max(self.burst_peak, active)
+            self.burst_volume += active
+
+    def start_burst(self, frame: int) -> None:
+        """Start a burst at the specified frame."""
+        if self.last_burst_end is not None:
+            interval = frame - self.last_burst_end - 1
+            self.intervals.add(interval)
+            self.interval_histogram.add(interval)
+
+        self.burst_start = frame
+        self.burst_peak = 0
+        self.burst_volume = 0
+
+    def end_burst(self, frame: int) -> None:
+        """End the ongoing burst at the specified (last) frame."""
+        duration = frame - self.burst_start + 1
+
+        self.bursts += 1
+        self.durations.add(duration)
+        self.sizes.add(self.burst_peak)
+        self.volumes.add(self.burst_volume)
+        self.duration_histogram.add(duration)
+        self.size_histogram.add(self.burst_peak)
+
+        self.burst_start = None
+        self.last_burst_end = frame
+
+    def report(self) -> dict:
+        """All statistics so far. A burst still going on is reported apart, as its end is
+        unknown."""
+        ongoing = None
+        if self.burst_start is not None:
+            ongoing = {'start': self.burst_start, 'peak': self.burst_peak,
+                       'volume': self.burst_volume}
+
+        return {
+            'frames': self.frames,
+            'exit_fraction': self.exit_fraction,
+            'active': self.active.as_dict(),
+            'ratio': self.ratio.as_dict(),
+            'bursts': self.bursts,
+            'durations': self.durations.as_dict(),
+            'sizes': self.sizes.as_dict(),
+            'volumes': self.volumes.as_dict(),
+            'intervals': self.intervals.as_dict(),
+            'duration_histogram': self.duration_histogram.as_dict(),
+            'size_histogram': self.size_histogram.as_dict(),
+            'interval_histogram': self.interval_histogram.as_dict(),
+            'ongoing_burst': ongoing
+        }
+
+    def scalars(self) -> Dict[str, float]:
+        """The main statistics as a flat row, e.g. one row per run of a sweep."""
+        return {
+            'frames': self.frames,
+            'active_mean': self.active.mean,
+            'active_variance': self.active.variance(),
+            'bursts': self.bursts,
+            'duration_mean': self.durations.mean if self.durations.count else None,
+            'duration_max': self.durations.maximum,
+            'size_mean': self.sizes.mean if self.sizes.count else None,
+            'size_max': self.sizes.maximum,
+            'interval_mean': self.intervals.mean if self.intervals.count else None,
+            'ongoing_burst': self.burst_start is not None
+        }
+
+    def save(self, file_path: str) -> None:
+        """Write the report to a json file."""
+        with open(file_path, 'w') as file:
+            json.dump(self.report(), file, indent=2)
+
+    def summary(self) -> str:
+        """Get a short text summary of the run."""
+        lines = ['active agents: mean {:.2f}, std {:.2f} over {} frames'.format(
+            self.active.mean, self.active.std(), self.frames)]
+        lines.append('bursts: {}{}'.format(
+            self.bursts, ' (and one still going on)' if self.burst_start is not None else ''))
+
+        if self.bursts:
+            lines.append('burst duration: mean {:.1f}, max {} frames'.format(
+                self.durations.mean, self.durations.maximum))
+            lines.append('burst size: mean {:.1f}, max {} active agents'.format(
+                self.sizes.mean, self.sizes.maximum))
+        if self.intervals.count:
+            lines.append('interval between bursts: mean {:.1f} frames'.format(self.intervals.mean))
+
+        return '\n'.join(lines)
@@ -0,0 +1,364 @@
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from time import perf_counter
+from typing import Callable, Tuple, List, Dict, Any
+
+try:
+    import resource     # Peak memory of the suite cases (not available on Windows)
+except ImportError:
+    resource = None
+
+from dynamic_params import FixedParamReader
+from models import PatchMap, Patch, World
+from output import OUTPUT_WRITERS, open_output
+from static_params import SimulationConfig, INITIAL_COP_DENSITY, INITIAL_AGENT_DENSITY, VISION, \
+    FLUSH_INTERVAL
+
+# Author: Dafu Ai
+# Benchmarks of the model internals, run with: python3 benchmark.py
+# The scaling suite, run with: python3 benchmark.py --suite [--json results.json],
+# writes json results which can be compared over time (or between both models) with:
+# python3 benchmark.py --compare base.json new.json
+
+PATCH_MAP_SIDES = [40, 200, 1000]   # Map sides to benchmark the patch map build on
+LEGACY_MAX_PATCHES = 40 * 40        # The pairwise build is O(P^2), skip it on larger maps
+DENSE_SIDE = 100                    # Map side of the dense worlds
+DENSE_DENSITIES = [(0.04, 0.9), (0.04, 0.95), (0.3, 0.9), (0.5, 0.95)]  # (cop, agent) densities
+DENSE_DRAWS = 20000                 # Random unoccupied patches drawn per sampler
+MEMORY_SIDE = 200                   # Map side of the worlds measured for memory
+OUTPUT_PATH = os.devnull            # The output of benchmarked worlds is discarded
+
+SUITE_SEED = 0                      # Seed of every world of the suite
+SUITE_SIDES = [40, 100, 200, 500, 1000]     # Map sides swept at the default densities and vision
+SUITE_SIDE = 100                    # Map side of the density and vision sweeps
+SUITE_DENSITIES = [(0.02, 0.5), (INITIAL_COP_DENSITY, INITIAL_AGENT_DENSITY), (0.1, 0.85)]
+SUITE_VISIONS = [3.0, VISION, 10.0]
+SUITE_FRAMES = 50                   # Most frames ticked per case
+SUITE_AGENT_UPDATES = 500000        # Fewer frames are ticked on large maps to stay within this
+PRECOMPUTE_MAX_SIDE = 200           # Larger maps use shared neighbour offsets instead of lists
+OUTPUT_ROWS = 20000                 # Rows written per output format
+
+
+def legacy_patch_map(side: int) -> PatchMap:
+    """Build a patch map by comparing every pair of patches (as it was done before offsets)."""
+    config = SimulationConfig(map_width=side, map_height=side, precompute_neighbours=False)
+    patch_map = PatchMap(None, config)
+
+    for curr_patch in patch_map.patches:
+        curr_patch.neighbour_patches = []
+        for patch in patch_map.patches:
+            if patch == curr_patch:
+                continue
+            if patch.is_neighbour_with(curr_patch, config.vision):
+                curr_patch.neighbour_patches.append(patch)
+
+    return patch_map
+
+
+def cache_neighbours(patch_map: PatchMap) -> PatchMap:
+    """Fill the neighbour lists of all patches (they are otherwise cached on first use)."""
+    for patch in patch_map.patches:
+        patch_map.get_neighbours(patch)
+
+    return patch_map
+
+
+def scan_unoccupied_patch(patch_map: PatchMap, patch: Patch = None) -> Patch:
+    """Draw a random unoccupied patch by scanning every candidate (as it was done before the
+    occupancy index)."""
+    patches = patch_map.get_neighbours(patch) if patch is not None else patch_map.patches
+    unoccupied_patches = [p for p in patches if not p.is_occupied()]
+    return patch_map.world.random.choice(unoccupied_patches) if unoccupied_patches else None
+
+
+def clear_geometry_caches() -> None:
+    """Forget the neighbour offsets shared by the maps of a geometry, so that the next map pays
+    for building them."""
+    PatchMap.neighbour_spans.cache_clear()
+    PatchMap.neighbour_offset_table.cache_clear()
+
+
+def measure(build: Callable[[], object]) -> Tuple[float, int]:
+    """Return the wall time (in seconds) and the peak traced memory (in bytes) of a build.
+    Both are measured on separate runs as tracing slows the build down."""
+    clear_geometry_caches()
+    start = perf_counter()
+    build()
+    elapsed = perf_counter() - start
+
+    clear_geometry_caches()
+    tracemalloc.start()
+    build()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return elapsed, peak
+
+
+def benchmark_patch_map() -> None:
+    """Compare the startup time and memory of the patch map builds."""
+    builds = [
+        ('pairwise', lambda side: legacy_patch_map(side)),
+        ('lists', lambda side: cache_neighbours(PatchMap(None, SimulationConfig(
+            map_width=side, map_height=side, precompute_neighbours=True)))),
+        ('on demand', lambda side: PatchMap(None, SimulationConfig(
+            map_width=side, map_height=side, precompute_neighbours=False))),
+    ]
+
+    print('{:>6} {:>10} {:>12} {:>14}'.format('side', 'build', 'time (s)', 'peak (MiB)'))
+    for side in PATCH_MAP_SIDES:
+        for name, build in builds:
+            if name == 'pairwise' and side * side > LEGACY_MAX_PATCHES:
+                print('{:>6} {:>10} {:>12} {:>14}'.format(side, name, 'skipped', '-'))
+                continue
+
+            elapsed, peak = measure(lambda: build(side))
+            print('{:>6} {:>10} {:>12.3f} {:>14.1f}'.format(side, name, elapsed, peak / 2 ** 20))
+
+
+def benchmark_occupancy() -> None:
+    """Compare the scan and the occupancy index for drawing unoccupied patches in dense worlds."""
+    print('{:>6} {:>6} {:>10} {:>14} {:>14} {:>14}'.format(
+        'cops', 'agents', 'init (s)', 'draw', 'scan (us)', 'index (us)'))
+
+    for cop_density, agent_density in DENSE_DENSITIES:
+        config = SimulationConfig(map_width=DENSE_SIDE, map_height=DENSE_SIDE, seed=0,
+                                  initial_cop_density=cop_density,
+                                  initial_agent_density=agent_density)
+        start = perf_counter()
+        world = World(FixedParamReader(), OUTPUT_PATH, config=config)
+        init = perf_counter() - start
+        world.update(1)
+        world.close()
+
+        patch_map = world.patch_map
+        centres = [world.random.choice(patch_map.patches) for _ in range(DENSE_DRAWS)]
+
+        for draw, patches in [('placement', [None] * DENSE_DRAWS), ('move', centres)]:
+            timings = []
+            for sampler in [scan_unoccupied_patch, PatchMap.get_random_unoccupied_patch]:
+                start = perf_counter()
+                for patch in patches:
+                    sampler(patch_map, patch)
+                timings.append((perf_counter() - start) / DENSE_DRAWS * 1e6)
+
+            print('{:>6} {:>6} {:>10.3f} {:>14} {:>14.2f} {:>14.2f}'.format(
+                cop_density, agent_density, init, draw, timings[0], timings[1]))
+
+
+def traced_world_size(config: SimulationConfig) -> int:
+    """Return the traced memory (in bytes) held by a world right after its creation
+    (with all neighbour lists cached, if they are)."""
+    tracemalloc.start()
+    world = World(FixedParamReader(), OUTPUT_PATH, config=config)
+    cache_neighbours(world.patch_map)
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    world.close()
+
+    return size
+
+
+def benchmark_memory() -> None:
+    """Report the memory per patch and per turtle, with precomputed neighbour lists and with
+    shared neighbour offsets. Turtles are measured as the difference to an empty world."""
+    print('{:>6} {:>12} {:>16} {:>16}'.format(
+        'side', 'neighbours', 'per patch (B)', 'per turtle (B)'))
+
+    for precompute_neighbours in [True, False]:
+        config = SimulationConfig(map_width=MEMORY_SIDE, map_height=MEMORY_SIDE, seed=0,
+                                  precompute_neighbours=precompute_neighbours)
+        empty = traced_world_size(config._replace(initial_cop_density=0, initial_agent_density=0))
+        full = traced_world_size(config)
+        turtles = config.total_cops() + config.total_agents()
+
+        print('{:>6} {:>12} {:>16.1f} {:>16.1f}'.format(
+            MEMORY_SIDE, 'lists' if precompute_neighbours else 'offsets',
+            empty / config.total_patches(), (full - empty) / turtles))
+
+
+def suite_configs(sides: List[int]) -> List[SimulationConfig]:
+    """Configs of the suite: the map sides, then the densities and visions on one map side."""
+    configs = []
+
+    def add(side: int, cop_density: float, agent_density: float, vision: float) -> None:
+        config = SimulationConfig(map_width=side, map_height=side, seed=SUITE_SEED,
+                                  initial_cop_density=cop_density,
+                                  initial_agent_density=agent_density, vision=vision,
+                                  precompute_neighbours=side <= PRECOMPUTE_MAX_SIDE)
+        if config not in configs:
+            configs.append(config)
+
+    for side in sides:
+        add(side, INITIAL_COP_DENSITY, INITIAL_AGENT_DENSITY, VISION)
+    for cop_density, agent_density in SUITE_DENSITIES:
+        add(SUITE_SIDE, cop_density, agent_density, VISION)
+    for vision in SUITE_VISIONS:
+        add(SUITE_SIDE, INITIAL_COP_DENSITY, INITIAL_AGENT_DENSITY, vision)
+
+    return configs
+
+
+def case_name(config: SimulationConfig) -> str:
+    """Name of a suite case, the key when comparing results."""
+    return 'side={} cops={} agents={} vision={}'.format(
+        config.map_width, config.initial_cop_density, config.initial_agent_density, config.vision)
+
+
+def run_case(config: SimulationConfig) -> Dict[str, Any]:
+    """Measure one case of the suite (in a fresh worker process, so that the peak memory is
+    its own)."""
+    agents = config.total_agents()
+    frames = max(1, min(SUITE_FRAMES, SUITE_AGENT_UPDATES // max(1, agents)))
+
+    start = perf_counter()
+    PatchMap(None, config)
+    patch_map_seconds = perf_counter() - start
+
+    # The world builds its geometry again, and its neighbour lists are counted in its
+    # initialisation rather than in the first ticks which would otherwise build them
+    clear_geometry_caches()
+    start = perf_counter()
+    world = World(FixedParamReader(), OUTPUT_PATH, config=config)
+    if config.precompute_neighbours:
+        cache_neighbours(world.patch_map)
+    init_seconds = perf_counter() - start
+
+    start = perf_counter()
+    for frame in range(1, frames + 1):
+        world.update(frame)
+    tick_seconds = (perf_counter() - start) / frames
+    world.close()
+
+    peak_rss = None
+    if resource is not None:
+        # Kilobytes on Linux, bytes on macOS
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        peak_rss *= 1 if sys.platform == 'darwin' else 1024
+
+    return dict(config._asdict(), **{
+        'name': case_name(config),
+        'patches': config.total_patches(),
+        'turtles': config.total_cops() + agents,
+        'patch_map_seconds': patch_map_seconds,
+        'init_seconds': init_seconds,
+        'frames': frames,
+        'tick_seconds': tick_seconds,
+        'ticks_per_second': 1 / tick_seconds,
+        'agent_updates_per_second': agents / tick_seconds,
+        'peak_rss_bytes': peak_rss
+    })
+
+
+def benchmark_output() -> List[Dict[str, Any]]:
+    """Measure the cost of writing the rows of the default world (building them included)
+    in every output format."""
+    with World(FixedParamReader(), OUTPUT_PATH, config=SimulationConfig(seed=SUITE_SEED)) as world:
+        counts = world.update_turtles()
+        params = world.params
+
+    results = []
+
+    with tempfile.TemporaryDirectory() as directory:
+        for output_format in sorted(OUTPUT_WRITERS):
+            path = os.path.join(directory, 'out.' + output_format)
+
+            start = perf_counter()
+            with open_output(path, World.output_columns(), output_format, FLUSH_INTERVAL,
+                             World.output_types()) as output:
+                for frame in range(1, OUTPUT_ROWS + 1):
+                    output.write_row(World.output_row(frame, counts, params))
+            elapsed = perf_counter() - start
+
+            results.append({
+                'format': output_format,
+                'rows': OUTPUT_ROWS,
+                'seconds_per_row': elapsed / OUTPUT_ROWS,
+                'bytes_per_row': os.path.getsize(path) / OUTPUT_ROWS
+            })
+
+    return results
+
+
+def run_suite(sides: List[int], json_path: str) -> Dict[str, Any]:
+    """Run every case of the suite and write the results to a json file."""
+    cases = []
+
+    for config in suite_configs(sides):
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            case = executor.submit(run_case, config).result()
+
+        cases.append(case)
+        print('{:<44} init {:>8.3f}s {:>10.1f} ticks/sec {:>12.0f} agent-updates/sec'.format(
+            case['name'], case['init_seconds'], case['ticks_per_second'],
+            case['agent_updates_per_second']))
+
+    results = {
+        'model': os.path.basename(os.path.dirname(os.path.abspath(__file__))),
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'seed': SUITE_SEED,
+        'cases': cases,
+        'output': benchmark_output()
+    }
+
+    with open(json_path, 'w') as json_file:
+        json.dump(results, json_file, indent=2)
+
+    return results
+
+
+def compare(base_path: str, new_path: str) -> None:
+    """Print the speedup of the cases of new results against base results."""
+    with open(base_path) as base_file, open(new_path) as new_file:
+        base = {case['name']: case for case in json.load(base_file)['cases']}
+        new = json.load(new_file)['cases']
+
+    print('{:<44} {:>10} {:>10} {:>10}'.format('case', 'init', 'ticks', 'memory'))
+    for case in new:
+        if case['name'] not in base:
+            continue
+
+        old = base[case['name']]
+        memory = '-'
+        if case['peak_rss_bytes'] and old['peak_rss_bytes']:
+            memory = '{:.2f}x'.format(case['peak_rss_bytes'] / old['peak_rss_bytes'])
+
+        print('{:<44} {:>9.2f}x {:>9.2f}x {:>10}'.format(
+            case['name'], old['init_seconds'] / case['init_seconds'],
+            case['ticks_per_second'] / old['ticks_per_second'], memory))
+
+
+def main(args=None) -> None:
+    """Run the benchmarks of the model internals, the scaling suite or a comparison."""
+    parser = argparse.ArgumentParser(description='Benchmark the Rebellion model.')
+    parser.add_argument('--suite', action='store_true',
+                        help='run the scaling suite instead of the benchmarks of the internals')
+    parser.add_argument('--sides', type=int, nargs='+', default=SUITE_SIDES,
+                        help='map sides of the suite (default: %(default)s)')
+    parser.add_argument('--json', default='benchmark.json',
+                        help='path of the json results of the suite (default: %(default)s)')
+    parser.add_argument('--compare', nargs=2, metavar=('BASE', 'NEW'),
+                        help='compare two json results (speedups of NEW over BASE)')
+    options = parser.parse_args(args)
+
+    if options.compare:
+        compare(*options.compare)
+    elif options.suite:
+        run_suite(options.sides, options.json)
+    else:
+        benchmark_patch_map()
+        benchmark_occupancy()
+        benchmark_memory()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+import argparse
+import csv
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional
+
+from dynamic_params import DynamicParams, FixedParamReader, ParamSchedule, ScheduledParamReader, \
+    parse_changes
+from models import World, derive_seed
+from snapshot import read_snapshot
+from static_params import SimulationConfig
+
+# Author: Dafu Ai
+# Scenario branching: a world is warmed up once (or loaded from a checkpoint), then many
+# branches continue from its snapshot in a process pool, each with its own random stream
+# and optionally changed dynamic parameters (or a schedule of them), e.g.
+# python3 branch.py --warmup 500 --frames 1000 --branches 50 --set government_legitimacy=0.3
+
+
+def warm_up(frames: int, seed: int, output_dir: str) -> str:
+    """Simulate the common part of all branches and return the path of its snapshot."""
+    snapshot_path = os.path.join(output_dir, 'warmup.snap')
+
+    with World(FixedParamReader(), os.path.join(output_dir, 'warmup.csv'),
+               config=SimulationConfig(seed=seed)) as world:
+        for frame in range(1, frames + 1):
+            world.update(frame)
+        world.save_snapshot(snapshot_path)
+
+    return snapshot_path
+
+
+def run_branch(snapshot_path: str, seed: int, schedule: ParamSchedule, last_frame: int,
+               output_path: str) -> str:
+    """Continue a snapshot up to the last frame (in a worker process) and return its output path."""
+    with World.load_snapshot(snapshot_path, ScheduledParamReader(schedule), output_path,
+                             seed=seed) as world:
+        for frame in range(world.frame + 1, last_frame + 1):
+            world.update(frame)
+
+    return output_path
+
+
+def run_branches(snapshot_path: str, branches: int, last_frame: int, changes: Dict[str, Any],
+                 seed: int, output_dir: str, workers: Optional[int] = None,
+                 events: List[dict] = (), base: DynamicParams = DynamicParams()) -> List[str]:
+    """Fan the branches of a snapshot out across a pool of processes and return their outputs.
+    The branches start from the base parameters with the changes applied,
+    and follow the scheduled events."""
+    header, _ = read_snapshot(snapshot_path)
+    fork_frame = header['frame']
+    if header['config']['seed'] is not None:
+        seed = header['config']['seed']
+
+    schedule = ParamSchedule(list(events), base._replace(**changes))
+    # The same seeds as forking the saved world in memory with World.fork
+    seeds = [derive_seed(seed, fork_frame, branch) for branch in range(branches)]
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(run_branch, snapshot_path, branch_seed, schedule, last_frame,
+                            os.path.join(output_dir, 'branch_{:05d}.csv'.format(branch)))
+            for branch, branch_seed in enumerate(seeds)
+        ]
+        paths = [future.result() for future in futures]
+
+    # Keep an index mapping every output file to its branch
+    with open(os.path.join(output_dir, 'branches.csv'), 'w', newline='') as index_file:
+        csv_writer = csv.writer(index_file)
+        csv_writer.writerow(['branch', 'seed', 'fork_frame'] + sorted(changes) + ['output'])
+        for branch, (branch_seed, path) in enumerate(zip(seeds, paths)):
+            csv_writer.writerow([branch, branch_seed, fork_frame] +
+                                [changes[name] for name in sorted(changes)] +
+                                [os.path.basename(path)])
+
+    return paths
+
+
+def main(args=None):
+    """The entry point for branching."""
+    parser = argparse.ArgumentParser(
+        description='Run branches of the Rebellion model from one state.')
+    parser.add_argument('--snapshot', default=None,
+                        help='snapshot to branch from (default: warm up a new world)')
+    parser.add_argument('--warmup', type=int, default=100,
+                        help='frames simulated before branching, without --snapshot '
+                             '(default: %(default)s)')
+    parser.add_argument('--frames', type=int, required=True,
+                        help='last frame simulated by every branch')
+    parser.add_argument('--branches', type=int, default=10,
+                        help='number of branches (default: %(default)s)')
+    parser.add_argument('--set', dest='changes', metavar='NAME=VALUE', action='append', default=[],
+                        help='dynamic parameter changed in the branches (can be repeated)')
+    parser.add_argument('--schedule', metavar='PATH', default=None,
+                        help='json schedule whose base and events the branches follow, '
+                             '--set changes its base (see dynamic_params.ParamSchedule)')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='seed of the warm-up world (the branch seeds derive from the seed '
+                             'of the branched world) (default: %(default)s)')
+    parser.add_argument('--output-dir', default='branches',
+                        help='directory of the outputs (default: %(default)s)')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='number of worker processes (default: all cores)')
+    options = parser.parse_args(args)
+
+    changes = parse_changes(options.changes)
+    events = []
+    base = DynamicParams()
+    if options.schedule is not None:
+        with open(options.schedule) as schedule_file:
+            schedule = json.load(schedule_file)
+        events = schedule.get('events', [])
+        base = DynamicParams.from_dict(schedule.get('base', {}))
+    os.makedirs(options.output_dir, exist_ok=True)
+
+    snapshot_path = options.snapshot
+    if snapshot_path is None:
+        snapshot_path = warm_up(options.warmup, options.seed, options.output_dir)
+
+    paths = run_branches(snapshot_path, options.branches, options.frames, changes, options.seed,
+                         options.output_dir, options.workers, events, base)
+    print('{} branch(es) written to {}'.format(len(paths), options.output_dir))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,560 @@
+import os
+from contextlib import suppress
+from math import sqrt
+from multiprocessing import Pipe, Process
+from multiprocessing.connection import Connection
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, Dict, List, Optional, Tuple, TYPE_CHECKING
+
+import numpy as np
+
+from dynamic_params import MAX_JAILED_TERM, GOVERNMENT_LEGITIMACY, MOVEMENT
+from grid import GRID_COP, GRID_ACTIVE, GRID_JAILED, GRID_QUIET
+from vectorized import MOVE_ATTEMPTS, PICK_CHUNK, disc_offsets, disc_sum
+
+if TYPE_CHECKING:
+    from models import World
+    from static_params import SimulationConfig
+
+# Author: Dafu Ai
+# Decomposed engine: for maps too large for one process (e.g. 2000x2000 and millions of agents),
+# the map is split into bands of rows, each owned by a worker process which holds the cops and
+# agents standing on it as NumPy arrays (the same tick as vectorized.py).
+# The per-patch counts a band publishes (cops, jailed and active agents) live in shared memory
+# (multiprocessing.shared_memory), so every band reads the VISION rows of its neighbours (its
+# halo) from there, instead of receiving copies. Cops and agents moving to a patch of another
+# band migrate to it, and cops claiming a patch or a suspect of another band send the claim to
+# its owner, which resolves the conflicts.
+#
+# The parent process holds no turtle, it drives the bands through the phases of a tick in lock
+# step (a phase starts once every band has finished the previous one, so no band reads a grid
+# while another writes it) and forwards their messages. Every band draws from its own random
+# stream spawned from the seed of the world, so a run is reproduced by the same seed and number
+# of workers.
+#
+# The phases are run once per sub-step of a tick (see vectorized.py). The sub-step of a turtle is
+# hashed from its id and a salt drawn for every tick, so that all bands agree on it without
+# sending it along when the turtle migrates. The series drift from those of the object engine
+# as much as those of vectorized.py.
+
+# Shared grids of per-patch counts (and their types), written by the owner of the rows
+GRIDS = {'cops': np.int32, 'jailed': np.int32, 'active': np.int32}
+
+# Arrays of an agent which migrate with it
+AGENT_FIELDS = ['agent_id', 'pos', 'active', 'jail_term', 'risk_aversion', 'perceived_hardship']
+
+# Phases of a tick, run by every band in turn (each a method of Band)
+PHASES = ['propose_moves', 'resolve_moves', 'settle_moves', 'move_agents', 'settle_agents',
+          'determine_behaviour', 'publish_active', 'propose_arrests', 'resolve_arrests',
+          'settle_arrests']
+
+KEY_SHIFT = 32  # Claims are ranked by a random key, the low bits hold the id of the cop
+HASH_MULTIPLIER = 0x9E3779B97F4A7C15    # Spreads the salted ids over the sub-steps
+JOIN_TIMEOUT = 5    # Seconds a worker is given to stop before it is terminated
+
+# A message between bands: named arrays of the same length
+Message = Dict[str, np.ndarray]
+
+
+def join_messages(messages: List[Message], fields: List[str]) -> Message:
+    """Concatenate the arrays of several messages, field by field."""
+    return {field: np.concatenate([message[field] for message in messages])
+            if messages else np.zeros(0, dtype=np.int64) for field in fields}
+
+
+def split_message(message: Message, destinations: np.ndarray) -> Dict[int, Message]:
+    """Split a message by the destination band of every entry."""
+    return {int(band): {field: values[destinations == band] for field, values in message.items()}
+            for band in np.unique(destinations)}
+
+
+class Band:
+    """
+    Holds the turtles standing on a band of rows (in a worker process) and performs
+    its part of every phase of a tick.
+    Patches are addressed by their flat index y * width + x on the whole map.
+    """
+    index: int                      # Index of this band
+    config: 'SimulationConfig'      # Static parameters of the world
+    width: int                      # Number of patches in x direction (whole map)
+    height: int                     # Number of patches in y direction (whole map)
+    torus: bool                     # Whether the map wraps around at the edges
+    top: int                        # First row of this band
+    bottom: int                     # Row after the last one of this band
+    band_of_row: np.ndarray         # Band owning every row of the map
+    grids: Dict[str, np.ndarray]    # Shared (height, width) grids of counts
+    rng: np.random.Generator        # Random stream of this band
+    offsets: np.ndarray             # (dx, dy) offsets within the vision
+    half_widths: np.ndarray         # Half width of the vision disc for each dy in [-r, r]
+    r: int                          # Radius of the vision (rows of the halo on each side)
+    cop_id: np.ndarray              # Id of each cop (unique across bands)
+    cop_pos: np.ndarray             # Patch index of each cop
+    agent_id: np.ndarray            # Id of each agent (unique across bands)
+    pos: np.ndarray                 # Patch index of each agent
+    active: np.ndarray              # Whether each agent is open rebelling
+    jail_term: np.ndarray           # Remaining jailed term of each agent
+    risk_aversion: np.ndarray       # Risk aversion of each agent
+    perceived_hardship: np.ndarray  # Perceived hardship of each agent
+    claims: Message                 # Claims of the cops of this band in the current phase
+
+    def __init__(self, index: int, bounds: List[int], config: 'SimulationConfig',
+                 grids: Dict[str, np.ndarray], seed: np.random.SeedSequence,
+                 cops: Tuple[int, int], agents: Tuple[int, int]) -> None:
+        """Place the (count, first id) cops and agents of this band on its rows."""
+        self.index = index
+        self.config = config
+        self.width = config.map_width
+        self.height = config.map_height
+        self.torus = config.topology == 'torus'
+        self.top, self.bottom = bounds[index], bounds[index + 1]
+        self.band_of_row = np.repeat(np.arange(len(bounds) - 1), np.diff(bounds))
+        self.grids = grids
+        self.rng = np.random.default_rng(seed)
+
+        self.offsets = disc_offsets(config.vision)
+        self.r = int(config.vision)
+        self.half_widths = np.array([int(sqrt(int(config.vision * config.vision) - dy * dy))
+                                     for dy in range(-self.r, self.r + 1)])
+
+        # Cops never share a patch, agents can stand on any patch without a cop
+        first = self.top * self.width
+        patches = (self.bottom - self.top) * self.width
+        (n_cops, first_cop), (n_agents, first_agent) = cops, agents
+        self.cop_id = np.arange(first_cop, first_cop + n_cops)
+        self.cop_pos = first + self.rng.choice(patches, size=n_cops, replace=False)
+        free = np.ones(patches, dtype=bool)
+        free[self.cop_pos - first] = False
+        self.agent_id = np.arange(first_agent, first_agent + n_agents)
+        self.pos = first + self.rng.choice(np.flatnonzero(free), size=n_agents)
+
+        self.active = np.zeros(n_agents, dtype=bool)
+        self.jail_term = np.zeros(n_agents, dtype=np.int64)
+        self.risk_aversion = self.rng.uniform(0, 1, n_agents)
+        self.perceived_hardship = self.rng.uniform(0, 1, n_agents)
+        self.claims = {}
+
+        self.publish(GRIDS)
+
+    @staticmethod
+    def in_substep(ids: np.ndarray, params: tuple) -> np.ndarray:
+        """Whether the turtles of the given ids act in the current sub-step, the params end with
+        (sub-step, number of sub-steps, salt of the tick)."""
+        substep, substeps, salt = params[-3:]
+        hashed = (ids.astype(np.uint64) ^ np.uint64(salt)) * np.uint64(HASH_MULTIPLIER)
+        return (hashed >> np.uint64(32)) % np.uint64(substeps) == substep
+
+    def owner(self, positions: np.ndarray) -> np.ndarray:
+        """The band owning each patch."""
+        return self.band_of_row[positions // self.width]
+
+    def band_grid(self, positions: np.ndarray) -> np.ndarray:
+        """Per-patch totals of positions on this band, as a (rows, width) grid."""
+        first = self.top * self.width
+        return np.bincount(positions - first, minlength=(self.bottom - self.top) * self.width) \
+            .reshape(self.bottom - self.top, self.width)
+
+    def publish(self, names: List[str]) -> None:
+        """Write the counts of the rows of this band into the shared grids."""
+        for name in names:
+            if name == 'cops':
+                counts = self.band_grid(self.cop_pos)
+            elif name == 'jailed':
+                counts = self.band_grid(self.pos[self.jail_term > 0])
+            else:
+                counts = self.band_grid(self.pos[self.active])
+            self.grids[name][self.top:self.bottom] = counts
+
+    def halo(self, name: str) -> np.ndarray:
+        """The rows of this band in a shared grid, with the r rows before and after it."""
+        rows = np.arange(self.top - self.r, self.bottom + self.r)
+        grid = self.grids[name]
+        if self.torus:
+            return grid[rows % self.height]
+
+        inside = (rows >= 0) & (rows < self.height)
+        halo = np.zeros((len(rows), self.width), dtype=grid.dtype)
+        halo[inside] = grid[rows[inside]]
+        return halo
+
+    def vision_sum(self, halo: np.ndarray) -> np.ndarray:
+        """Sum a halo over the vision disc of every patch of this band (excluding the centre)."""
+        padded = np.pad(halo, [(0, 0), (self.r, self.r)], mode='wrap' if self.torus else 'constant')
+        return disc_sum(padded, self.half_widths) - halo[self.r:-self.r or None]
+
+    def locate(self, positions: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """The x of each patch, and its row in a halo of this band."""
+        return positions % self.width, positions // self.width - self.top + self.r
+
+    def shift(self, x: np.ndarray, row: np.ndarray,
+              dx: np.ndarray, dy: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Move halo coordinates by offsets and return the new x, the patch index on the map
+        and whether the patch is on the map."""
+        nx, ny = x + dx, row + dy
+        y = ny + self.top - self.r
+        if self.torus:
+            nx = nx % self.width
+            return nx, (y % self.height) * self.width + nx, np.ones(nx.shape, dtype=bool)
+
+        ok = (nx >= 0) & (nx < self.width) & (y >= 0) & (y < self.height)
+        return nx, np.where(ok, y * self.width + nx, 0), ok
+
+    def random_moves(self, positions: np.ndarray, occupied: np.ndarray) -> np.ndarray:
+        """Random unoccupied neighbour patch for each position (or the position itself),
+        looked up in the occupancy of the halo."""
+        x, row = self.locate(positions)
+        targets = positions.copy()
+        pending = np.arange(len(positions))
+
+        for _ in range(MOVE_ATTEMPTS):
+            if len(pending) == 0:
+                break
+            dx, dy = self.offsets[self.rng.integers(len(self.offsets), size=len(pending))].T
+            nx, patch, ok = self.shift(x[pending], row[pending], dx, dy)
+            free = np.zeros(len(pending), dtype=bool)
+            free[ok] = ~occupied[row[pending][ok] + dy[ok], nx[ok]]
+            targets[pending[free]] = patch[free]
+            pending = pending[~free]
+
+        return targets
+
+    def occupied(self) -> np.ndarray:
+        """Halo of the patches holding a cop and no jailed agent (same with Patch.is_occupied)."""
+        return (self.halo('cops') > 0) & (self.halo('jailed') == 0)
+
+    def claim(self, cops: np.ndarray, message: Message) -> Dict[int, Message]:
+        """Send claims of cops to the owners of their patches, ranked by random keys."""
+        keys = (self.rng.integers(1 << 30, size=len(cops)) << KEY_SHIFT) | self.cop_id[cops]
+        self.claims = dict(message, key=keys, cop=cops)
+
+        message = dict(message, key=keys, origin=np.full(len(cops), self.index))
+        return split_message(message, self.owner(message['patch']))
+
+    def adopt_cops(self, claims: Message, winners: np.ndarray) -> Dict[int, Message]:
+        """Take over the winning cops of other bands and tell every band which claims won."""
+        won = {field: values[winners] for field, values in claims.items()}
+        immigrants = won['origin'] != self.index
+        self.cop_id = np.concatenate([self.cop_id,
+                                      won['key'][immigrants] & ((1 << KEY_SHIFT) - 1)])
+        self.cop_pos = np.concatenate([self.cop_pos, won['patch'][immigrants]])
+
+        return split_message({'key': won['key']}, won['origin'])
+
+    def settle_cops(self, replies: List[Message]) -> None:
+        """Move the cops whose claims won, those moving to another band leave this one."""
+        keys = join_messages(replies, ['key'])['key']
+        won = np.isin(self.claims['key'], keys)
+        cops, patches = self.claims['cop'][won], self.claims['patch'][won]
+
+        self.cop_pos[cops] = patches
+        stay = np.ones(len(self.cop_pos), dtype=bool)
+        stay[cops[self.owner(patches) != self.index]] = False
+        self.cop_id, self.cop_pos = self.cop_id[stay], self.cop_pos[stay]
+        self.claims = {}
+
+    def propose_moves(self, inbox: List[Message], params: tuple) -> Tuple[Dict[int, Message], Any]:
+        """Every cop of the sub-step picks a random unoccupied patch and claims it."""
+        cops = np.flatnonzero(self.in_substep(self.cop_id, params))
+        targets = self.random_moves(self.cop_pos[cops], self.occupied())
+        moved = targets != self.cop_pos[cops]
+        return self.claim(cops[moved], {'patch': targets[moved]}), None
+
+    def resolve_moves(self, inbox: List[Message], params: tuple) -> Tuple[Dict[int, Message], Any]:
+        """The first (by key) claim of a patch of this band wins it."""
+        claims = join_messages(inbox, ['patch', 'key', 'origin'])
+        order = np.argsort(-claims['key'], kind='stable')
+        _, first = np.unique(claims['patch'][order], return_index=True)
+        return self.adopt_cops(claims, order[first]), None
+
+    def settle_moves(self, inbox: List[Message], params: tuple) -> Tuple[Dict[int, Message], Any]:
+        """Move the winning cops and publish the new cop counts."""
+        self.settle_cops(inbox)
+        self.publish(['cops'])
+        return {}, None
+
+    def move_agents(self, inbox: List[Message], params: tuple) -> Tuple[Dict[int, Message], Any]:
+        """Move every agent of the sub-step which is not jailed (if movement is enabled),
+        the agents moving to another band leave this one."""
+        if params[2] is not True:
+            return {}, None
+
+        movers = np.flatnonzero((self.jail_term == 0) & self.in_substep(self.agent_id, params))
+        self.pos[movers] = self.random_moves(self.pos[movers], self.occupied())
+
+        leaving = self.owner(self.pos) != self.index
+        emigrants = {field: getattr(self, field)[leaving] for field in AGENT_FIELDS}
+        for field in AGENT_FIELDS:
+            setattr(self, field, getattr(self, field)[~leaving])
+
+        return split_message(emigrants, self.owner(emigrants['pos'])), None
+
+    def settle_agents(self, inbox: List[Message], params: tuple) -> Tuple[Dict[int, Message], Any]:
+        """Take over the agents which moved to this band and publish the active counts."""
+        immigrants = join_messages(inbox, AGENT_FIELDS)
+        for field in AGENT_FIELDS:
+            values = getattr(self, field)
+            setattr(self, field, np.concatenate([values, immigrants[field].astype(values.dtype)]))
+
+        self.publish(['active'])
+        return {}, None
+
+    def determine_behaviour(self, inbox: List[Message],
+                            params: tuple) -> Tuple[Dict[int, Message], Any]:
+        """Flag the activeness of the free agents of the sub-step from the counts of the halo."""
+        x, row = self.locate(self.pos)
+        row -= self.r
+        c = self.vision_sum(self.halo('cops'))[row, x]
+        a = 1 + self.vision_sum(self.halo('active'))[row, x]
+
+        free = (self.jail_term == 0) & self.in_substep(self.agent_id, params)
+        arrest_probability = 1 - np.exp(-self.config.k * np.floor(c[free] / a[free]))
+        grievance = self.perceived_hardship[free] * (1 - params[0])
+        self.active[free] = (grievance - self.risk_aversion[free] * arrest_probability) > \
+            self.config.threshold
+        return {}, None
+
+    def publish_active(self, inbox: List[Message], params: tuple) -> Tuple[Dict[int, Message], Any]:
+        """Publish the active counts after the decisions."""
+        self.publish(['active'])
+        return {}, None
+
+    def pick_in_vision(self, centres: np.ndarray,
+                       counts: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        For each centre patch pick a uniformly random candidate within the vision, from the
+        halo of the candidates per patch. Returns the patch of each pick (or -1 if there is no
+        candidate) and the rank of the candidate among those on the patch.
+        """
+        x, row = self.locate(centres)
+        dx, dy = self.offsets.T
+        chosen = np.full(len(x), -1)
+        on_patch = np.zeros(len(x), dtype=counts.dtype)
+        target = self.rng.random(len(x))
+
+        for start in range(0, len(x), PICK_CHUNK):
+            chunk = slice(start, start + PICK_CHUNK)
+            rows = row[chunk, np.newaxis] + dy
+            nx, patches, ok = self.shift(x[chunk, np.newaxis], row[chunk, np.newaxis], dx, dy)
+            seen = np.where(ok, counts[rows, nx % self.width], 0)
+
+            # The first patch where the running count over the disc passes a random target
+            running = np.cumsum(seen, axis=1)
+            hits = running > (target[chunk] * running[:, -1])[:, np.newaxis]
+            found = np.flatnonzero(hits[:, -1])
+            first = hits[found].argmax(axis=1)
+            chosen[start + found] = patches[found, first]
+            on_patch[start + found] = seen[found, first]
+
+        ranks = (self.rng.random(len(x)) * on_patch).astype(np.int64)
+        return chosen, ranks
+
+    def find_ranked(self, candidates: np.ndarray, patches: np.ndarray,
+                    ranks: np.ndarray) -> np.ndarray:
+        """The candidate agents of the given ranks on the given patches (ranked by their ids)."""
+        by_patch = candidates[np.lexsort((self.agent_id[candidates], self.pos[candidates]))]
+        return by_patch[np.searchsorted(self.pos[by_patch], patches) + ranks]
+
+    def propose_arrests(self, inbox: List[Message],
+                        params: tuple) -> Tuple[Dict[int, Message], Any]:
+        """Every cop of the sub-step picks a random active agent in its neighbourhood
+        and claims it."""
+        cops = np.flatnonzero(self.in_substep(self.cop_id, params))
+        chosen, ranks = self.pick_in_vision(self.cop_pos[cops], self.halo('active'))
+        cops, chosen, ranks = cops[chosen >= 0], chosen[chosen >= 0], ranks[chosen >= 0]
+        return self.claim(cops, {'patch': chosen, 'rank': ranks}), None
+
+    def resolve_arrests(self, inbox: List[Message],
+                        params: tuple) -> Tuple[Dict[int, Message], Any]:
+        """Arrest the claimed agents of this band, a suspect claimed by several cops
+        is arrested by the first (by key), which moves onto its patch."""
+        claims = join_messages(inbox, ['patch', 'rank', 'key', 'origin'])
+        suspects = self.find_ranked(np.flatnonzero(self.active), claims['patch'], claims['rank'])
+
+        order = np.argsort(-claims['key'], kind='stable')
+        suspects, first = np.unique(suspects[order], return_index=True)
+        winners = order[first]
+
+        self.active[suspects] = False
+        if params[1] > 0:
+            self.jail_term[suspects] = self.rng.integers(1, params[1] + 1, size=len(suspects))
+
+        return self.adopt_cops(claims, winners), None
+
+    def settle_arrests(self, inbox: List[Message],
+                       params: tuple) -> Tuple[Dict[int, Message], Any]:
+        """Move the arresting cops, count down the terms after the last sub-step (as
+        vectorized.py does at the end of a tick), publish all counts and return the counts
+        of this band."""
+        self.settle_cops(inbox)
+        if params[-3] == params[-2] - 1:
+            self.jail_term[self.jail_term > 0] -= 1
+        self.publish(GRIDS)
+
+        jailed = int(np.count_nonzero(self.jail_term > 0))
+        active = int(np.count_nonzero(self.active))
+        return {}, (len(self.pos) - jailed - active, jailed, active)
+
+    def grid_codes(self, inbox: List[Message], params: tuple) -> Tuple[Dict[int, Message], Any]:
+        """State code of every patch of this band (see grid.py)."""
+        codes = np.zeros((self.bottom - self.top) * self.width, dtype=np.uint8)
+        first = self.top * self.width
+        jailed = self.jail_term > 0
+
+        # Lower codes are assigned first, so that higher codes overwrite them on shared patches
+        codes[self.pos[~self.active & ~jailed] - first] = GRID_QUIET
+        codes[self.pos[jailed] - first] = GRID_JAILED
+        codes[self.cop_pos - first] = GRID_COP
+        codes[self.pos[self.active] - first] = GRID_ACTIVE
+        return {}, codes.tobytes()
+
+
+def run_band(connection: Connection, index: int, bounds: List[int], config: 'SimulationConfig',
+             grid_names: Dict[str, str], seed: np.random.SeedSequence,
+             cops: Tuple[int, int], agents: Tuple[int, int]) -> None:
+    """
+    The loop of a worker process: perform the phases sent by the engine until it sends None.
+    Messages to this band itself are kept here rather than sent through the engine.
+    """
+    memories = {name: SharedMemory(shared) for name, shared in grid_names.items()}
+    grids = {name: np.ndarray((config.map_height, config.map_width), dtype=GRIDS[name],
+                              buffer=memory.buf) for name, memory in memories.items()}
+    band = Band(index, bounds, config, grids, seed, cops, agents)
+    connection.send(None)
+    local = []
+
+    while True:
+        message = connection.recv()
+        if message is None:
+            break
+
+        phase, inbox, params = message
+        outbox, result = getattr(band, phase)(inbox + local, params)
+        local = [outbox.pop(index)] if index in outbox else []
+        connection.send((outbox, result))
+
+    del band, grids
+    for memory in memories.values():
+        memory.close()
+
+
+def split_evenly(total: int, parts: List[int]) -> List[Tuple[int, int]]:
+    """Split a total in proportion to the parts, as the (count, first index) of every part."""
+    whole = sum(parts)
+    counts = [total * part // whole for part in parts]
+    for i in range(total - sum(counts)):
+        counts[i] += 1
+
+    firsts = np.cumsum([0] + counts[:-1]).tolist()
+    return list(zip(counts, firsts))
+
+
+class DecomposedEngine:
+    """
+    Runs the tick of vectorized.py on bands of the map owned by worker processes.
+    """
+    world: 'World'                      # The world this engine is in
+    bounds: List[int]                   # First row of every band, and the height of the map
+    memories: Dict[str, SharedMemory]   # Shared grids of counts
+    processes: List[Process]            # Worker process of every band
+    connections: List[Connection]       # Pipe to the worker of every band
+    inboxes: List[List[Message]]        # Messages waiting for every band
+
+    def __init__(self, world: 'World', workers: int = 0) -> None:
+        """Split the map into one band per worker (0 for one per core) and start the workers."""
+        config = world.config
+        self.world = world
+        bands = workers if workers > 0 else os.cpu_count()
+        r = int(config.vision)
+
+        if config.topology == 'torus' and min(config.map_width, config.map_height) <= 2 * r:
+            raise ValueError('The decomposed engine needs a torus larger than the vision disc')
+
+        # A band is at least as high as the vision, so its halo only reaches its neighbours
+        bands = max(1, min(bands, config.map_height // max(1, r)))
+        self.bounds = [config.map_height * band // bands for band in range(bands + 1)]
+        heights = np.diff(self.bounds).tolist()
+
+        self.memories = {name: SharedMemory(create=True, size=config.total_patches() *
+                                            np.dtype(dtype).itemsize)
+                         for name, dtype in GRIDS.items()}
+        grid_names = {name: memory.name for name, memory in self.memories.items()}
+        seeds = np.random.SeedSequence(world.random.getrandbits(64)).spawn(bands)
+        cops = split_evenly(config.total_cops(), heights)
+        agents = split_evenly(config.total_agents(), heights)
+
+        self.processes = []
+        self.connections = []
+        self.inboxes = [[] for _ in range(bands)]
+        try:
+            for band in range(bands):
+                connection, worker_connection = Pipe()
+                process = Process(target=run_band, daemon=True,
+                                  args=(worker_connection, band, self.bounds, config, grid_names,
+                                        seeds[band], cops[band], agents[band]))
+                process.start()
+                self.processes.append(process)
+                self.connections.append(connection)
+
+            # Wait until every band has placed its turtles and published its counts
+            for connection in self.connections:
+                connection.recv()
+        except BaseException:
+            self.close()
+            raise
+
+    def close(self) -> None:
+        """Stop the workers and release the shared grids, also if a worker died."""
+        try:
+            for connection in self.connections:
+                # The pipe of a dead worker is broken, it is terminated below
+                with suppress(OSError):
+                    connection.send(None)
+        finally:
+            for process in self.processes:
+                process.join(JOIN_TIMEOUT)
+                if process.is_alive():
+                    process.terminate()
+                    process.join()
+            for connection in self.connections:
+                connection.close()
+
+            for memory in self.memories.values():
+                memory.close()
+                memory.unlink()
+
+            self.connections = []
+            self.processes = []
+            self.memories = {}
+
+    def run_phase(self, phase: str, params: Optional[tuple] = None) -> List[Any]:
+        """Let every band perform a phase, forward their messages and return their results."""
+        for connection, inbox in zip(self.connections, self.inboxes):
+            connection.send((phase, inbox, params))
+
+        self.inboxes = [[] for _ in self.connections]
+        results = []
+        for connection in self.connections:
+            outbox, result = connection.recv()
+            for band, message in outbox.items():
+                self.inboxes[band].append(message)
+            results.append(result)
+
+        return results
+
+    def update(self) -> Tuple[int, int, int]:
+        """Advance one tick and return the (quiet, jailed, active) counts."""
+        params = (self.world.get_dynamic_param(GOVERNMENT_LEGITIMACY[0]),
+                  self.world.get_dynamic_param(MAX_JAILED_TERM[0]),
+                  self.world.get_dynamic_param(MOVEMENT[0]))
+        substeps = max(1, self.world.config.substeps)
+        salt = self.world.random.getrandbits(64)
+
+        # The counts of the bands after the last sub-step are those of the tick
+        for substep in range(substeps):
+            for phase in PHASES:
+                counts = self.run_phase(phase, params + (substep, substeps, salt))
+
+        return tuple(sum(band_counts) for band_counts in zip(*counts))
+
+    def grid_codes(self) -> bytes:
+        """State code of every patch (see grid.py), the bands follow each other."""
+        return b''.join(self.run_phase('grid_codes'))
@@ -0,0 +1,95 @@
+import ast
+import mmap
+import struct
+from typing import IO, Tuple
+
+# Author: Dafu Ai
+# Per-frame dumps of the state of every patch, one byte per patch in the order of
+# PatchMap.patches (y * width + x), so a frame costs width * height bytes.
+# The file is a .npy stack of shape (frames, height, width) and dtype uint8, which can be
+# memory-mapped with numpy.load(path, mmap_mode='r') or with read_grid (no NumPy needed).
+# Only the frames which are multiples of the stride are written.
+
+# State codes of a patch, a patch holding several turtles shows the one with the highest code
+GRID_EMPTY = 0      # No turtle
+GRID_DEAD = 1       # Killed agent (extended model only)
+GRID_QUIET = 2      # Quiet agent
+GRID_JAILED = 3     # Jailed agent
+GRID_COP = 4        # Cop
+GRID_ACTIVE = 5     # Active (rebelling) agent
+
+NPY_MAGIC = b'\x93NUMPY\x01\x00'   # Magic bytes and version (1.0) of the .npy format
+NPY_HEADER_SIZE = 128               # Bytes reserved for the header, so it can be rewritten
+
+
+def npy_header(frames: int, height: int, width: int) -> bytes:
+    """The .npy header of a stack of frames, padded to NPY_HEADER_SIZE bytes."""
+    header = "{{'descr': '|u1', 'fortran_order': False, 'shape': ({}, {}, {}), }}".format(
+        frames, height, width)
+    header = header.ljust(NPY_HEADER_SIZE - len(NPY_MAGIC) - 2 - 1) + '\n'
+    return NPY_MAGIC + struct.pack('<H', len(header)) + header.encode('latin1')
+
+
+class GridWriter:
+    """
+    Appends the state codes of every written frame to a .npy stack.
+    The number of frames in the header is updated when the writer is closed.
+    """
+    file_path: str      # Path of the .npy file
+    width: int          # Number of patches in x direction
+    height: int         # Number of patches in y direction
+    stride: int         # Only frames which are multiples of the stride are written
+    frames: int         # Number of frames written so far
+    file: IO            # The open file
+
+    def __init__(self, file_path: str, width: int, height: int, stride: int = 1) -> None:
+        self.file_path = file_path
+        self.width = width
+        self.height = height
+        self.stride = max(1, stride)
+        self.frames = 0
+        self.file = open(file_path, 'wb')
+        self.file.write(npy_header(0, height, width))
+
+    def __enter__(self) -> 'GridWriter':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def wants(self, frame: int) -> bool:
+        """Whether a frame is to be written."""
+        return frame % self.stride == 0
+
+    def write_frame(self, codes: bytes) -> None:
+        """Append the state codes of one frame."""
+        if len(codes) != self.width * self.height:
+            raise ValueError('A frame needs {} codes, got {}'.format(
+                self.width * self.height, len(codes)))
+
+        self.file.write(codes)
+        self.frames += 1
+
+    def close(self) -> None:
+        """Write the final number of frames into the header and close the file."""
+        if not self.file.closed:
+            self.file.seek(0)
+            self.file.write(npy_header(self.frames, self.height, self.width))
+            self.file.close()
+
+
+def read_grid(file_path: str) -> Tuple[Tuple[int, int, int], memoryview]:
+    """
+    Memory-map a grid stack and return its (frames, height, width) shape and its codes
+    (frame f, patch index i is at f * height * width + i).
+    """
+    with open(file_path, 'rb') as file:
+        if file.read(len(NPY_MAGIC)) != NPY_MAGIC:
+            raise ValueError('Not a grid file: ' + file_path)
+
+        header_length = struct.unpack('<H', file.read(2))[0]
+        shape = ast.literal_eval(file.read(header_length).decode('latin1'))['shape']
+        data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    offset = len(NPY_MAGIC) + 2 + header_length
+    return shape, memoryview(data)[offset:offset + shape[0] * shape[1] * shape[2]]
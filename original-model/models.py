@@ -1,101 +1,553 @@
-import csv
+from array import array
+from functools import lru_cache
 from math import sqrt, exp, floor
-from random import shuffle, choice, uniform, randint
-from typing import List, Optional, Union, Callable
-
-from dynamic_params import DynamicParamReader, DYNAMIC_PARAMETERS, MAX_JAILED_TERM, \
+from hashlib import sha256
+from random import Random
+from typing import List, Optional, Union, Callable, Tuple, Dict, Any, TYPE_CHECKING
+
+from grid import GridWriter, GRID_COP, GRID_ACTIVE, GRID_JAILED, GRID_QUIET
+from output import OutputWriter, open_output
+from snapshot import write_snapshot, read_snapshot
+from dynamic_params import DynamicParamReader, DynamicParams, DYNAMIC_PARAMETERS, MAX_JAILED_TERM, \
     GOVERNMENT_LEGITIMACY, MOVEMENT
-from static_params import total_cops, total_agents, VISION, MAP_WIDTH, MAP_HEIGHT, K, THRESHOLD
+from static_params import SimulationConfig
+
+if TYPE_CHECKING:
+    # Only needed by the annotations, these modules import this one (or NumPy)
+    from analytics import StreamingAnalyzer
+    from decomposed import DecomposedEngine
+    from synchronous import SynchronousScheduler
+    from vectorized import VectorizedEngine
 
 
 # Author: Dafu Ai
 # Please note, all models are interdependent so they are under the same file.
 
+# Engines that can run a world
+ENGINE_OBJECT = 'object'    # One Python object per turtle and patch
+ENGINE_NUMPY = 'numpy'      # Parallel NumPy arrays (see vectorized.py, requires NumPy)
+ENGINE_DECOMPOSED = 'decomposed'    # Bands of the map in worker processes (see decomposed.py)
+ENGINES = [ENGINE_OBJECT, ENGINE_NUMPY, ENGINE_DECOMPOSED]
+
+
+def derive_seed(seed: int, *keys: int) -> int:
+    """Derive the seed of an independent random stream (e.g. a sweep replicate) from a base seed."""
+    digest = sha256(repr((seed,) + keys).encode()).digest()
+    return int.from_bytes(digest[:8], 'little')
+
+# Topologies of a patch map
+TOPOLOGY_BOUNDED = 'bounded'    # Patches at the edges have smaller neighbourhoods
+TOPOLOGY_TORUS = 'torus'        # The map wraps around at the edges (same with NetLogo)
+TOPOLOGIES = [TOPOLOGY_BOUNDED, TOPOLOGY_TORUS]
+
+MOVE_ATTEMPTS = 8   # Random neighbour patches tried before falling back to a full scan
+
+# Kinds of turtles in a snapshot
+KIND_COP = 0
+KIND_AGENT = 1
+
+# Counters of a patch saved in a snapshot (attribute, array type code)
+PATCH_COUNTERS = [('cops', 'i'), ('jailed_agents', 'i'), ('cops_in_vision', 'i'),
+                  ('active_in_vision', 'i')]
+
 
 class World:
     """
     Simulates a world of agents, cops and patches.
     """
     patch_map: 'PatchMap'               # The patch map managing all patches
-    turtles: List                       # All turtles
+    turtles: List                       # Turtles which act (in the order of the last update),
+                                        # jailed agents are dropped
+    retired: int                        # Agents which stopped acting since turtles was last pruned
+    jail_wheel: 'JailWheel'             # Jailed agents by the frame of their release
+    registry: List['Turtle']            # All turtles, indexed by their id
     params_reader: DynamicParamReader   # Reader for dynamic parameters
+    params: DynamicParams               # Snapshot of dynamic parameters for the current frame
     output_filename: str                # Output file path
+    output: OutputWriter                # Writer kept open for the whole run
+    grid_output: Optional[GridWriter]   # Writer of the per-frame patch states (None if not dumped)
+    analyzer: Optional['StreamingAnalyzer']  # Analysis of the counts of every frame (None if off)
+    config: SimulationConfig            # Static parameters of this world
+    random: Random                      # Random generator owned by this world
+    counters: 'StatusCounters'          # Running totals of agents per status
+    engine: Optional[Union['VectorizedEngine', 'DecomposedEngine']]  # Array engine, None if
+                                        # running on objects
+    scheduler: Optional['SynchronousScheduler']  # Phases of a synchronous frame (None if the
+                                        # turtles are updated one after another)
+    frame: int                          # Last frame which has been updated (0 before the first)
+    forks: int                          # Number of branches forked from this world
+
+    def __init__(self, dynamic_params_reader: DynamicParamReader, output_filename: str,
+                 engine: str = ENGINE_OBJECT,
+                 config: SimulationConfig = SimulationConfig(),
+                 populate: bool = True,
+                 grid_filename: Optional[str] = None,
+                 analyzer: Optional['StreamingAnalyzer'] = None) -> None:
+        """Create all components (the turtles are left out if not populated, e.g. to be
+        restored from a snapshot). The patch states are dumped if a grid file is specified,
+        and the counts of every frame are fed to the analyzer if one is specified.
+        In the synchronous mode, the agents of large frames are decided by a pool of worker
+        processes (if there are several workers), the decomposed engine runs one band of the map
+        per worker (one per core if there are no workers)."""
+        if engine not in ENGINES:
+            raise ValueError('Unknown engine: ' + engine)
+
+        self.config = config
+        self.random = Random(config.seed)
+        self.counters = StatusCounters()
 
-    def __init__(self, dynamic_params_reader: DynamicParamReader, output_filename: str) -> None:
-        """Create all components."""
         self.params_reader = dynamic_params_reader
+        self.params = dynamic_params_reader.refresh()
         self.output_filename = output_filename
-        self.patch_map = PatchMap(self)
+        self.patch_map = None
         self.turtles = []
+        self.retired = 0
+        self.jail_wheel = JailWheel()
+        self.registry = []
+        self.engine = None
+        self.scheduler = None
+        self.frame = 0
+        self.forks = 0
+        self.analyzer = analyzer
+
+        # Open the output with its header columns (before starting any worker process)
+        self.output = open_output(output_filename, self.output_columns(), config.output_format,
+                                  config.flush_interval, self.output_types())
+        self.grid_output = None
+
+        # Close what has been opened or started if the setup fails
+        try:
+            if grid_filename is not None:
+                self.grid_output = GridWriter(grid_filename, config.map_width, config.map_height,
+                                              config.grid_stride)
+
+            if engine == ENGINE_NUMPY:
+                # Imported here so that the object engine does not require NumPy
+                from vectorized import VectorizedEngine
+                self.engine = VectorizedEngine(self)
+            elif engine == ENGINE_DECOMPOSED:
+                from decomposed import DecomposedEngine
+                self.engine = DecomposedEngine(self, config.workers)
+            else:
+                self.patch_map = PatchMap(self, config)
+
+                if config.synchronous:
+                    # Imported here as it depends on the turtles of this module
+                    from synchronous import SynchronousScheduler
+                    self.scheduler = SynchronousScheduler(self, config.workers)
+
+                for i in range(0, config.total_cops() if populate else 0):
+                    self.turtles.append(Cop(self))
+
+                for i in range(0, config.total_agents() if populate else 0):
+                    self.turtles.append(Agent(self))
+        except BaseException:
+            self.close()
+            raise
+
+    def __enter__(self) -> 'World':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Flush and close the outputs (and stop the worker processes, even if an output fails)."""
+        try:
+            self.output.close()
+        finally:
+            if self.engine is not None:
+                self.engine.close()
+
+            if self.scheduler is not None:
+                self.scheduler.close()
+
+            if self.grid_output is not None:
+                self.grid_output.close()
+
+    def update(self, frame: int) -> None:
+        """Let all components perform update."""
+        self.frame = frame
+        self.refresh_params()
 
-        for i in range(0, total_cops()):
-            self.turtles.append(Cop(self))
+        if self.engine is not None:
+            counts = self.engine.update()
+        else:
+            counts = self.update_turtles()
 
-        for i in range(0, total_agents()):
-            self.turtles.append(Agent(self))
+        self.write_output(frame, counts)
 
-        # Write header row for output csv
-        with open(output_filename, 'w') as output_file:
-            csv_writer = csv.writer(output_file)
-            header_columns = ['frame', 'quiet', 'jailed', 'active']
+        if self.analyzer is not None:
+            self.analyzer.observe(frame, counts[2], counts[0],
+                                  self.burst_threshold(self.config, self.params))
 
-            for p in DYNAMIC_PARAMETERS:
-                header_columns.append(p[0])
+        if self.grid_output is not None and self.grid_output.wants(frame):
+            self.grid_output.write_frame(self.grid_codes())
 
-            csv_writer.writerow(header_columns)
+    def refresh_params(self) -> None:
+        """Pick up changes to the dynamic parameters (once per frame)."""
+        self.params = self.params_reader.refresh(self.frame)
 
-    def update(self, frame: int) -> None:
-        """Let all components perform update."""
+    @staticmethod
+    def output_columns() -> List[str]:
+        """The header columns of the output."""
+        header_columns = ['frame', 'quiet', 'jailed', 'active']
+
+        for p in DYNAMIC_PARAMETERS:
+            header_columns.append(p[0])
+
+        return header_columns
+
+    @staticmethod
+    def output_types() -> List[type]:
+        """The types of the output columns (matching output_columns)."""
+        return [int, int, int, int] + \
+            [DynamicParams.__annotations__[p[0]] for p in DYNAMIC_PARAMETERS]
+
+    @staticmethod
+    def burst_threshold(config: SimulationConfig, params: DynamicParams) -> float:
+        """The ratio of active agents from which a burst of rebellion starts (see analytics.py)."""
+        return config.burst_threshold
+
+    def write_output(self, frame: int, counts: Tuple[int, int, int]) -> None:
+        """Append the (quiet, jailed, active) counts of a frame to the output."""
+        self.output.write_row(self.output_row(frame, counts, self.params))
+
+    @staticmethod
+    def output_row(frame: int, counts: Tuple[int, int, int], params: DynamicParams) -> list:
+        """The row of the output holding the counts of a frame, under the given parameters."""
+        quiet, jailed, active = counts
+
+        # Append current state to the output
+        columns = [frame, quiet, jailed, active]
+
+        params = params._asdict()
+
+        for p in DYNAMIC_PARAMETERS:
+            columns.append(params[p[0]])
+
+        return columns
+
+    def update_turtles(self) -> Tuple[int, int, int]:
+        """Let every turtle perform update and return the (quiet, jailed, active) counts."""
         self.patch_map.update()
 
         # Shuffle all turtles so they perform action in a random sequence
-        shuffle(self.turtles)
+        self.random.shuffle(self.turtles)
 
-        for turtle in self.turtles:
-            turtle.update()
+        if self.scheduler is not None:
+            self.scheduler.update(self.turtles)
+        else:
+            for turtle in self.turtles:
+                turtle.update()
 
-        # First filter out non-agent turtles
-        agents: List[Agent] = list(filter(lambda t: isinstance(t, Agent), self.turtles))
+        self.release_agents()
+
+        return self.count_agents()
+
+    def release_agents(self) -> None:
+        """
+        At the end of a frame, release the agents whose term ends with it (same with NetLogo,
+        which counts down the terms after all turtles have acted).
+        Jailed agents do nothing, so they are left out of the shuffle and the updates,
+        and released agents are added back.
+        """
+        if self.retired > 0:
+            self.turtles = [turtle for turtle in self.turtles if turtle.acts()]
+            self.retired = 0
+
+        for agent in self.jail_wheel.pop(self.frame + 1):
+            agent.jail_term = 0
+            self.turtles.append(agent)
+
+    def count_agents(self) -> Tuple[int, int, int]:
+        """Get the (quiet, jailed, active) counts of the current frame."""
+        counts = self.counters.totals()
+
+        if self.config.debug_counters and counts != self.recount_agents():
+            raise RuntimeError('Agent counters {} differ from a full recount {}'.format(
+                counts, self.recount_agents()))
+
+        return counts
+
+    def recount_agents(self) -> Tuple[int, int, int]:
+        """Count the agents per status (quiet, jailed, active) with a full pass over the turtles."""
+        # First filter out non-agent turtles (including those which do not act)
+        agents: List[Agent] = list(filter(lambda t: isinstance(t, Agent), self.registry))
 
         # Get stats for each agent status
         quiet = list(filter(lambda t: t.is_quiet(), agents))
         jailed = list(filter(lambda t: t.is_jailed(), agents))
         active = list(filter(lambda t: t.active, agents))
 
-        # Append current state to the output csv
-        with open(self.output_filename, 'a') as output_file:
-            csv_writer = csv.writer(output_file)
-            columns = [frame, len(quiet), len(jailed), len(active)]
+        return len(quiet), len(jailed), len(active)
+
+    def grid_codes(self) -> bytes:
+        """Get the state code of every patch (see grid.py), in the order of PatchMap.patches."""
+        if self.engine is not None:
+            return self.engine.grid_codes()
+
+        codes = bytearray(self.config.total_patches())
+
+        for turtle in self.registry:
+            if turtle.patch is not None:
+                code = turtle.grid_code()
+                if code > codes[turtle.patch.index]:
+                    codes[turtle.patch.index] = code
 
-            params = self.params_reader.read_params()
+        return codes
 
-            for p in DYNAMIC_PARAMETERS:
-                columns.append(params[p[0]])
+    def save_snapshot(self, file_path: str) -> None:
+        """
+        Save the state of the world (turtles, their patches and attributes, the update order,
+        the random generator and the frame) to a compact binary file, from which the run can be
+        resumed or forked with load_snapshot.
+        """
+        write_snapshot(file_path, *self.snapshot())
+
+    def snapshot(self) -> Tuple[dict, Dict[str, array]]:
+        """Capture the state of the world as the header and the arrays of a snapshot."""
+        if self.engine is not None:
+            raise ValueError('Snapshots are only supported by the object engine')
+
+        agents = [turtle for turtle in self.registry if isinstance(turtle, Agent)]
+        random_version, random_state, gauss_next = self.random.getstate()
+
+        header = {
+            'config': self.config._asdict(),
+            'frame': self.frame,
+            'random_version': random_version,
+            'gauss_next': gauss_next
+        }
+        arrays = {
+            'kinds': array('B', (KIND_AGENT if isinstance(turtle, Agent) else KIND_COP
+                                 for turtle in self.registry)),
+            'patches': array('q', (-1 if turtle.patch is None else turtle.patch.index
+                                   for turtle in self.registry)),
+            # Turtles in the order they stand on their patches, which filters depend on
+            'placement': array('q', (turtle.id for patch in self.patch_map.patches
+                                     for turtle in patch.turtles)),
+            'order': array('q', (turtle.id for turtle in self.turtles)),
+            'free_patches': array('q', self.patch_map.free_patches),
+            'active': array('B', (agent.active for agent in agents)),
+            'jail_term': array('q', (agent.jail_term for agent in agents)),
+            'risk_aversion': array('d', (agent.risk_aversion for agent in agents)),
+            'perceived_hardship': array('d', (agent.perceived_hardship for agent in agents)),
+            'random_state': array('q', random_state)
+        }
+
+        for name, code in PATCH_COUNTERS:
+            arrays['patch_' + name] = array(code, (getattr(patch, name)
+                                                   for patch in self.patch_map.patches))
+
+        return header, arrays
+
+    @classmethod
+    def load_snapshot(cls, file_path: str, dynamic_params_reader: DynamicParamReader,
+                      output_filename: str, **kwargs) -> 'World':
+        """
+        Create a world from a snapshot, which continues exactly as the saved world would have.
+        The output only holds the frames after the snapshot.
+        """
+        return cls.from_snapshot(*read_snapshot(file_path), dynamic_params_reader, output_filename,
+                                 **kwargs)
+
+    @classmethod
+    def from_snapshot(cls, header: dict, arrays: Dict[str, array],
+                      dynamic_params_reader: DynamicParamReader, output_filename: str,
+                      seed: Optional[int] = None, settings: Optional[Dict[str, Any]] = None,
+                      **kwargs) -> 'World':
+        """
+        Create a world from the header and the arrays of a snapshot.
+        If a seed is specified, the world continues with a new random stream from that seed
+        instead of the saved one. The settings replace fields of the saved config
+        (e.g. the output format of the new run).
+        """
+        config = SimulationConfig(**header['config'])._replace(**(settings or {}))
+        if seed is not None:
+            config = config._replace(seed=seed)
+
+        world = cls(dynamic_params_reader, output_filename, config=config, populate=False, **kwargs)
+
+        if world.engine is not None:
+            raise ValueError('Snapshots are only supported by the object engine')
+
+        world.restore_snapshot(header, arrays)
+
+        if seed is not None:
+            world.random.seed(seed)
+
+        return world
 
-            csv_writer.writerow(columns)
+    def fork(self, output_filename: str,
+             dynamic_params_reader: Optional[DynamicParamReader] = None,
+             seed: Optional[int] = None, **kwargs) -> 'World':
+        """
+        Duplicate this world into an independent branch (e.g. to try an intervention),
+        which continues from the current frame with its own output and its own random stream.
+        Unless specified, the seed of the branch is derived from the seed of this world,
+        the frame and the number of branches forked so far.
+        """
+        if seed is None:
+            seed = Random().getrandbits(64) if self.config.seed is None else \
+                derive_seed(self.config.seed, self.frame, self.forks)
+        self.forks += 1
+
+        return World.from_snapshot(*self.snapshot(), dynamic_params_reader or self.params_reader,
+                                   output_filename, seed=seed, **kwargs)
+
+    def restore_snapshot(self, header: dict, arrays: Dict[str, array]) -> None:
+        """Restore the state read from a snapshot into an unpopulated world."""
+        # Jail terms count from the frame
+        self.frame = header['frame']
+
+        for kind in arrays['kinds']:
+            if kind == KIND_AGENT:
+                Agent(self, place=False)
+            else:
+                Cop(self, place=False)
+
+        # The flags are set before placing the agents (so only the status counters change)
+        agents = [turtle for turtle in self.registry if isinstance(turtle, Agent)]
+        for agent, active, jail_term, risk_aversion, perceived_hardship in zip(
+                agents, arrays['active'], arrays['jail_term'], arrays['risk_aversion'],
+                arrays['perceived_hardship']):
+            agent.risk_aversion = risk_aversion
+            agent.perceived_hardship = perceived_hardship
+            agent.active = bool(active)
+            agent.jail_term = jail_term
+
+        patches = self.patch_map.patches
+        patch_indices = arrays['patches']
+        for turtle_id in arrays['placement']:
+            turtle = self.registry[turtle_id]
+            turtle.patch = patches[patch_indices[turtle_id]]
+            turtle.patch.turtles.append(turtle)
+
+        # The counters of the patches are copied rather than counted again,
+        # which is faster and keeps sums of floats exactly as they were
+        for name, _ in PATCH_COUNTERS:
+            for patch, value in zip(patches, arrays['patch_' + name]):
+                setattr(patch, name, value)
+
+        for patch in patches:
+            self.patch_map.update_occupancy(patch)
+
+        self.turtles = [self.registry[turtle_id] for turtle_id in arrays['order']]
+        self.patch_map.restore_free_patches(arrays['free_patches'])
+        self.random.setstate((header['random_version'], tuple(arrays['random_state']),
+                              header['gauss_next']))
+
+    def register(self, turtle: 'Turtle') -> int:
+        """Add a turtle to the registry and return its integer id."""
+        self.registry.append(turtle)
+        return len(self.registry) - 1
+
+    def get_turtle(self, turtle_id: int) -> 'Turtle':
+        """Get a turtle by its id."""
+        return self.registry[turtle_id]
 
     def get_dynamic_param(self, key):
-        """Get the value of dynamic parameters"""
-        return self.params_reader.read_params()[key]
+        """Get the value of dynamic parameters (from the snapshot of the current frame)"""
+        return getattr(self.params, key)
+
+
+class StatusCounters:
+    """
+    Running totals of agents per status, kept up to date on every state transition
+    (activation, arrest, release) so that the stats of a frame need no pass
+    over all turtles.
+    """
+    quiet: int      # Number of quiet agents
+    jailed: int     # Number of jailed agents
+    active: int     # Number of active agents
+
+    def __init__(self) -> None:
+        self.quiet = 0
+        self.jailed = 0
+        self.active = 0
+
+    def count(self, agent: 'Agent', sign: int) -> None:
+        """Add (sign = 1) or remove (sign = -1) an agent from the totals of its statuses."""
+        if agent.is_jailed():
+            self.jailed += sign
+        if agent.active:
+            self.active += sign
+        if agent.is_quiet():
+            self.quiet += sign
+
+    def totals(self) -> Tuple[int, int, int]:
+        """Get the (quiet, jailed, active) totals."""
+        return self.quiet, self.jailed, self.active
+
+
+class JailWheel:
+    """
+    Jailed agents bucketed by the frame of their release, so that a frame only touches the
+    agents it releases instead of counting down the term of every jailed agent.
+    """
+    buckets: Dict[int, List['Agent']]   # Agents by release frame (an agent whose term has
+                                        # changed since is skipped when its old bucket is popped)
+
+    def __init__(self) -> None:
+        self.buckets = {}
+
+    def add(self, agent: 'Agent', release_frame: int) -> None:
+        """Add an agent released at the specified frame."""
+        self.buckets.setdefault(release_frame, []).append(agent)
+
+    def pop(self, release_frame: int) -> List['Agent']:
+        """Remove and return the agents released at the specified frame, ordered by their ids
+        (so that a world restored from a snapshot releases them in the same order)."""
+        agents = [agent for agent in self.buckets.pop(release_frame, ())
+                  if agent.release_frame == release_frame]
+        agents.sort(key=lambda agent: agent.id)
+        return agents
 
 
 class Turtle:
     """
     Simulates a turtle object, in which the behaviours are shared by both Cop and Turtle.
     """
+    __slots__ = ('id', 'world', 'config', 'patch')
+
+    id: int         # Index of this turtle in the registry of the world.
     world: World    # The world this turtle is in.
+    config: SimulationConfig    # Static parameters of the world.
     patch: 'Patch'    # The patch this turtle is currently at.
 
-    def __init__(self, world: World) -> None:
-        """Place itself to a patch."""
+    def __init__(self, world: World, place: bool = True) -> None:
+        """Place itself to a patch (unless it is placed later, e.g. from a snapshot)."""
         self.world = world
+        self.config = world.config
         self.patch = None
-        self.move(True)
+        self.id = world.register(self)
+
+        if place:
+            self.move(True)
 
     def can_move(self) -> bool:
         """Determines whether this turtle can move. By default it can always move."""
         return True
 
+    def acts(self) -> bool:
+        """Determines whether this turtle acts when updated. By default it always does."""
+        return True
+
+    def count_in_vision(self, patch: 'Patch', sign: int) -> None:
+        """Add (sign = 1) or remove (sign = -1) this turtle from the vision counters of all
+        patches which can see the specified patch. By default a turtle is not counted."""
+        pass
+
+    def count_on_patch(self, patch: 'Patch', sign: int) -> None:
+        """Add (sign = 1) or remove (sign = -1) this turtle from the occupancy counters of
+        the specified patch. By default a turtle does not occupy a patch."""
+        pass
+
+    def grid_code(self) -> int:
+        """Get the state code of this turtle in a grid dump (see grid.py)."""
+        raise NotImplementedError
+
     def move_to_patch(self, new_patch: 'Patch') -> None:
         """Move to a specified patch."""
 
@@ -126,6 +578,8 @@ class Cop(Turtle):
     """
     Simulates a Cop.
     """
+    __slots__ = ()
+
     def update(self) -> None:
         """Perform relevant action as a Cop."""
         super().update()
@@ -137,21 +591,46 @@ class Cop(Turtle):
         """Cops can always move if parent class allows movement."""
         return super().can_move()
 
+    def grid_code(self) -> int:
+        """Cops have their own state code."""
+        return GRID_COP
+
+    def count_in_vision(self, patch: 'Patch', sign: int) -> None:
+        """Cops are counted by every patch which can see them."""
+        for neighbour in self.world.patch_map.get_neighbours(patch):
+            neighbour.cops_in_vision += sign
+
+    def count_on_patch(self, patch: 'Patch', sign: int) -> None:
+        """Cops occupy their patch."""
+        patch.cops += sign
+        self.world.patch_map.update_occupancy(patch)
+
     def enforce(self) -> None:
         """Find and arrest a random active agent in the neighbourhood."""
+        suspect = self.find_suspect()
+
+        # Don't continue if there is no matched agent
+        if suspect is not None:
+            self.arrest(suspect)
+
+    def find_suspect(self) -> Optional['Agent']:
+        """Pick a random active agent in the neighbourhood (None if there is none)."""
 
         # Find all active agents in the neighbourhood
-        agents = PatchMap.filter_neighbour_turtles(
+        agents = self.world.patch_map.filter_neighbour_turtles(
             self.patch,
             lambda t: isinstance(t, Agent) and t.active
         )
 
-        # Don't continue if there is no matched agent
         if len(agents) == 0:
-            return
+            return None
+
+        return self.world.random.choice(agents)
+
+    def arrest(self, suspect: 'Agent') -> None:
+        """Arrest a suspect and jail it."""
 
         # Move to the patch of the (about-to-be) jailed agent
-        suspect = choice(agents)
         self.move_to_patch(suspect.patch)
 
         # Arrest suspect
@@ -159,25 +638,35 @@ class Cop(Turtle):
         if self.world.get_dynamic_param(MAX_JAILED_TERM[0]) == 0:
             suspect.jail_term = 0
         else:
-            suspect.jail_term = randint(1, self.world.get_dynamic_param(MAX_JAILED_TERM[0]))
+            suspect.jail_term = self.world.random.randint(
+                1, self.world.get_dynamic_param(MAX_JAILED_TERM[0]))
 
 
 class Agent(Turtle):
     """
     Simulates an Agent object.
     """
+    __slots__ = ('_active', 'release_frame', 'risk_aversion', 'perceived_hardship', '_inputs',
+                 '_decision')
+
     jail_term: int              # Remaining time length for jailing
+    release_frame: int          # Frame from which the agent is free again (0 if free)
     active: bool                # Indicates whether the turtle is open rebelling
     risk_aversion: float        # The degree of reluctance to take risks
     perceived_hardship: float   # Perceived hardship of rebelling
+    _inputs: Optional[tuple]    # Inputs of the last decision (None before the first)
+    _decision: bool             # Activeness decided from those inputs
 
-    def __init__(self, world: World) -> None:
+    def __init__(self, world: World, place: bool = True) -> None:
         """ Initialise the agent """
-        super().__init__(world)
-        self.jail_term = 0
-        self.active = False
-        self.risk_aversion = uniform(0, 1)
-        self.perceived_hardship = uniform(0, 1)
+        self._active = False
+        self.release_frame = 0
+        self._inputs = None
+        self._decision = False
+        super().__init__(world, place)
+        self.risk_aversion = world.random.uniform(0, 1)
+        self.perceived_hardship = world.random.uniform(0, 1)
+        world.counters.count(self, 1)
 
     def update(self) -> None:
         """Determines whether to open rebel."""
@@ -187,17 +676,101 @@ class Agent(Turtle):
         if self.patch is not None and not self.is_jailed():
             self.determine_behaviour()
 
-        # Reduce jail term
-        self.decrement_jail_term()
+    @property
+    def active(self) -> bool:
+        """Whether the agent is open rebelling."""
+        return self._active
+
+    @active.setter
+    def active(self, active: bool) -> None:
+        """Flag the activeness, keeping the vision counters of the neighbourhood
+        and the status counters up to date."""
+        if active == self._active:
+            return
+
+        self.world.counters.count(self, -1)
+        if self.patch is not None:
+            self.count_in_vision(self.patch, -1)
+        self._active = active
+        if self.patch is not None:
+            self.count_in_vision(self.patch, 1)
+        self.world.counters.count(self, 1)
+
+    def grid_code(self) -> int:
+        """The state code of an agent is its status."""
+        if self._active:
+            return GRID_ACTIVE
+        if self.is_jailed():
+            return GRID_JAILED
+
+        return GRID_QUIET
+
+    def count_in_vision(self, patch: 'Patch', sign: int) -> None:
+        """Only active agents are counted by the patches which can see them."""
+        if not self._active:
+            return
+
+        for neighbour in self.world.patch_map.get_neighbours(patch):
+            neighbour.active_in_vision += sign
+
+    def count_on_patch(self, patch: 'Patch', sign: int) -> None:
+        """Jailed agents make their patch unoccupied."""
+        if not self.is_jailed():
+            return
+
+        patch.jailed_agents += sign
+        self.world.patch_map.update_occupancy(patch)
+
+    @property
+    def jail_term(self) -> int:
+        """Remaining time length for jailing (frames until the release)."""
+        if self.release_frame == 0:
+            return 0
+
+        return self.release_frame - self.world.frame
+
+    @jail_term.setter
+    def jail_term(self, jail_term: int) -> None:
+        """Set the jailed term (in frames from the current one), which is kept as the frame of
+        the release. The occupancy of the patch and the status counters are kept up to date
+        (only needed when the agent is jailed or released)."""
+        release_frame = self.world.frame + jail_term if jail_term > 0 else 0
+        was_jailed = self.is_jailed()
+
+        if release_frame != 0:
+            self.world.jail_wheel.add(self, release_frame)
+            if not was_jailed:
+                self.world.retired += 1
+
+        if Agent.is_jail_term(jail_term) == was_jailed:
+            self.release_frame = release_frame
+            return
+
+        self.world.counters.count(self, -1)
+        if self.patch is not None:
+            self.count_on_patch(self.patch, -1)
+        self.release_frame = release_frame
+        if self.patch is not None:
+            self.count_on_patch(self.patch, 1)
+        self.world.counters.count(self, 1)
 
     def can_move(self) -> bool:
         """ If it is jailed or movement is manually disabled it cannot move """
         return super().can_move() and not self.is_jailed() and \
                self.world.get_dynamic_param(MOVEMENT[0]) is True
 
+    def acts(self) -> bool:
+        """Jailed agents do nothing when updated."""
+        return not self.is_jailed()
+
+    @staticmethod
+    def is_jail_term(jail_term: int) -> bool:
+        """Determine whether a jail term means being jailed."""
+        return jail_term > 0
+
     def is_jailed(self) -> bool:
         """Determine whether this agent is currently jailed."""
-        return hasattr(self, 'jail_term') and self.jail_term > 0
+        return self.release_frame > self.world.frame
 
     def is_quiet(self) -> bool:
         """Determine whether this patch is quiet (i.e. inactive & not jailed)."""
@@ -212,68 +785,86 @@ class Agent(Turtle):
         """Calculate and return the estimated arrest probability of the agent
         (based on the formula)."""
         # c = number of neighbour cops
-        c = len(PatchMap.filter_neighbour_turtles(self.patch, lambda t: isinstance(t, Cop)))
+        c = self.patch.cops_in_vision
 
         # a = 1 + number of neighbour turtles which are active
-        a = 1 + len(PatchMap.filter_neighbour_turtles(
-            self.patch,
-            lambda t: isinstance(t, Agent) and t.active
-        ))
+        a = 1 + self.patch.active_in_vision
 
-        return 1 - exp(-K * floor(c/a))
+        return 1 - exp(-self.config.k * floor(c/a))
 
     def determine_behaviour(self) -> None:
-        """Determine the behaviour of this agent by flagging its activeness."""
-        self.active = (self.get_grievance() - self.risk_aversion *
-                       self.get_estimated_arrest_probability()) > THRESHOLD
+        """Determine the behaviour of this agent by flagging its activeness.
+        The decision only depends on the ratio floor(c / a) of the arrest probability and
+        the dynamic parameters, so it is reused (if enabled) until one of them changes."""
+        if self.config.skip_stable_agents:
+            patch = self.patch
+            inputs = (patch.cops_in_vision // (1 + patch.active_in_vision), self.world.params)
+            if inputs != self._inputs:
+                self._inputs = inputs
+                self._decision = (self.get_grievance() - self.risk_aversion *
+                                  self.get_estimated_arrest_probability()) > self.config.threshold
+            self.active = self._decision
+            return
 
-    def decrement_jail_term(self) -> None:
-        """ Decrement the jail term by 1 if it is positive """
-        if self.jail_term > 0:
-            self.jail_term -= 1
+        self.active = (self.get_grievance() - self.risk_aversion *
+                       self.get_estimated_arrest_probability()) > self.config.threshold
 
 
 class Patch:
     """
     Simulates a Patch (of a map).
     """
+    __slots__ = ('x', 'y', 'index', 'turtles', 'neighbour_patches', 'neighbour_offsets',
+                 'cops_in_vision', 'active_in_vision', 'cops', 'jailed_agents')
+
     x: int                              # x coordinate of this patch.
     y: int                              # y coordinate of this patch.
+    index: int                          # Index of this patch in the map (y * width + x).
     turtles: List                       # All turtles in the patch.
-    neighbour_patches: List['Patch']    # All neighbour patches within the vision.
-
-    def __init__(self, x: int, y: int) -> None:
+    neighbour_patches: Optional[List['Patch']]  # All neighbour patches within the vision
+                                        # (None until first used, or if generated on demand).
+    neighbour_offsets: Tuple[int, ...]  # Index offsets of the neighbour patches (shared by
+                                        # all patches at the same distance from the edges).
+    cops_in_vision: int                 # Number of cops on the neighbour patches.
+    active_in_vision: int               # Number of active agents on the neighbour patches.
+    cops: int                           # Number of cops in the patch.
+    jailed_agents: int                  # Number of jailed agents in the patch.
+
+    def __init__(self, x: int, y: int, index: int) -> None:
         self.x = x
         self.y = y
+        self.index = index
         self.turtles = []
-        self.neighbour_patches = []
+        self.neighbour_patches = None
+        self.neighbour_offsets = ()
+        self.cops = 0
+        self.jailed_agents = 0
+        self.cops_in_vision = 0
+        self.active_in_vision = 0
 
     def add_turtle(self, turtle: Turtle) -> None:
         """Add a turtle."""
         self.turtles.append(turtle)
+        turtle.count_in_vision(self, 1)
+        turtle.count_on_patch(self, 1)
 
     def remove_turtle(self, turtle: Turtle) -> None:
         """Remove a turtle."""
         self.turtles.remove(turtle)
+        turtle.count_in_vision(self, -1)
+        turtle.count_on_patch(self, -1)
 
     def is_occupied(self) -> bool:
-        """Determine whether this patch is currently occupied."""
-        for turtle in self.turtles:
-            if isinstance(turtle, Cop):
-                return True
+        """Determine whether this patch is currently occupied (by a cop).
+        Jailed turtle considered as unoccupied."""
+        return self.cops > 0 and self.jailed_agents == 0
 
-            # Jailed turtle considered as unoccupied
-            if isinstance(turtle, Agent) and turtle.is_jailed():
-                return False
-
-        return False
-
-    def is_neighbour_with(self, patch: 'Patch') -> bool:
+    def is_neighbour_with(self, patch: 'Patch', vision: float) -> bool:
         """Determine whether the specified patch is a neighbour to this patch."""
         x_diff = patch.x - self.x
         y_diff = patch.y - self.y
 
-        return sqrt(x_diff*x_diff + y_diff*y_diff) <= VISION
+        return sqrt(x_diff*x_diff + y_diff*y_diff) <= vision
 
 
 class PatchMap:
@@ -282,28 +873,199 @@ class PatchMap:
     """
     patches: List[Patch]  # All patches stored
     world: World  # The world this map is in
-
-    def __init__(self, world: World) -> None:
+    config: SimulationConfig  # Static parameters of the map
+    width: int  # Number of patches in x direction
+    height: int  # Number of patches in y direction
+    topology: str  # Either bounded or torus
+    precompute_neighbours: bool  # Whether every patch stores its own neighbour list
+    occupied: bytearray  # Occupancy bitmap, indexed by y * width + x
+    free_patches: List[int]  # Indices of all unoccupied patches (in no particular order)
+    free_slots: List[int]  # Position of each patch in free_patches (-1 if occupied)
+
+    def __init__(self, world: World, config: SimulationConfig) -> None:
         """Create the required number of patches."""
+        if config.topology not in TOPOLOGIES:
+            raise ValueError('Unknown topology: ' + config.topology)
+
         self.patches = []
         self.world = world
+        self.config = config
+        self.width = config.map_width
+        self.height = config.map_height
+        self.topology = config.topology
+        self.precompute_neighbours = config.precompute_neighbours
+
+        for y in range(0, self.height):
+            for x in range(0, self.width):
+                self.patches.append(Patch(x, y, len(self.patches)))
+
+        # Every patch is unoccupied at first
+        self.occupied = bytearray(len(self.patches))
+        self.free_patches = list(range(len(self.patches)))
+        self.free_slots = list(range(len(self.patches)))
+
+        # The offset table is shared by all maps of the same geometry (e.g. forks of a world)
+        offset_table = PatchMap.neighbour_offset_table(
+            self.width, self.height, config.vision, self.topology)
+
+        for curr_patch, offsets in zip(self.patches, offset_table):
+            curr_patch.neighbour_offsets = offsets
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def neighbour_spans(vision: float, height: int, topology: str) -> Tuple[Tuple[int, int], ...]:
+        """Get the offset table of a map geometry, shared by all maps with that geometry."""
+        spans = PatchMap.vision_spans(vision)
 
-        for y in range(0, MAP_HEIGHT):
-            for x in range(0, MAP_WIDTH):
-                self.patches.append(Patch(x, y))
+        if topology == TOPOLOGY_TORUS:
+            spans = PatchMap.wrap_spans(spans, height)
 
-        # Pre-calculate all neighbour patches
-        for curr_patch in self.patches:
-            for patch in self.patches:
-                if patch == curr_patch:
-                    continue
-                if patch.is_neighbour_with(curr_patch):
-                    curr_patch.neighbour_patches.append(patch)
+        return tuple(spans)
 
     @staticmethod
-    def get_neighbours(patch: Patch) -> [Patch]:
+    @lru_cache(maxsize=4)
+    def neighbour_offset_table(width: int, height: int, vision: float,
+                               topology: str) -> Tuple[Tuple[int, ...], ...]:
+        """
+        Get the index offsets of the neighbours of every patch of a map geometry (by patch index).
+        Patches at the same distance from the edges share one tuple of offsets.
+        """
+        spans = PatchMap.neighbour_spans(vision, height, topology)
+        r = int(vision)
+        x_classes = [PatchMap.edge_class(x, width, r) for x in range(width)]
+        y_classes = [PatchMap.edge_class(y, height, r) for y in range(height)]
+        offset_tables: Dict[Tuple[int, int], Tuple[int, ...]] = {}
+        table = []
+
+        for y in range(height):
+            for x in range(width):
+                key = (x_classes[x], y_classes[y])
+                if key not in offset_tables:
+                    index = y * width + x
+                    offset_tables[key] = tuple(
+                        neighbour - index for neighbour in
+                        PatchMap.neighbour_indices(x, y, width, height, spans, topology))
+                table.append(offset_tables[key])
+
+        return tuple(table)
+
+    @staticmethod
+    def edge_class(v: int, size: int, r: int) -> int:
+        """
+        Classify a coordinate by its distance to the edges (of a map side of the given size),
+        patches with the same classes on both axes have the same neighbour offsets.
+        """
+        if v < r:
+            return v
+        if v >= size - r:
+            return v - size
+
+        return r
+
+    @staticmethod
+    def vision_spans(vision: float) -> List[Tuple[int, int]]:
+        """
+        Get the integer offsets within the vision, as one (dy, w) span per row
+        standing for the offsets (-w, dy) ... (w, dy).
+        """
+        r = int(vision)
+        spans = []
+
+        for dy in range(-r, r + 1):
+            w = 0
+            while sqrt((w + 1) * (w + 1) + dy * dy) <= vision:
+                w += 1
+            spans.append((dy, w))
+
+        return spans
+
+    @staticmethod
+    def wrap_spans(spans: List[Tuple[int, int]], height: int) -> List[Tuple[int, int]]:
+        """
+        Reduce the rows of offsets modulo the map height, so that each row appears once
+        (with its widest span) even if the vision is larger than the map.
+        """
+        widths = {}
+        for dy, w in spans:
+            widths[dy % height] = max(w, widths.get(dy % height, 0))
+
+        return sorted(widths.items())
+
+    @staticmethod
+    def neighbour_indices(x: int, y: int, width: int, height: int,
+                          spans: Tuple[Tuple[int, int], ...], topology: str) -> List[int]:
+        """Apply the vision spans to a patch and get the indices of its neighbours, leaving out
+        the patch itself and (unless on a torus) the offsets falling off the map."""
+        if topology == TOPOLOGY_TORUS:
+            return PatchMap.torus_neighbour_indices(x, y, width, height, spans)
+
+        neighbours = []
+
+        for dy, w in spans:
+            ny = y + dy
+            if ny < 0 or ny >= height:
+                continue
+
+            # Patches of a row are contiguous, so a row of offsets is a single range
+            row = ny * width
+            left = row + max(x - w, 0)
+            right = row + min(x + w, width - 1) + 1
+
+            if dy == 0:
+                neighbours += range(left, row + x)
+                neighbours += range(row + x + 1, right)
+            else:
+                neighbours += range(left, right)
+
+        return neighbours
+
+    @staticmethod
+    def torus_neighbour_indices(x: int, y: int, width: int, height: int,
+                                spans: Tuple[Tuple[int, int], ...]) -> List[int]:
+        """Apply the (wrapped) vision spans to a patch and get the indices of its neighbours,
+        leaving out the patch itself."""
+        neighbours = []
+
+        for dy, w in spans:
+            row = ((y + dy) % height) * width
+            left = x - w
+            right = x + w + 1
+
+            # A row of offsets is one range, or two if it wraps around an edge
+            if right - left >= width:
+                segment = list(range(row, row + width))
+            elif left < 0:
+                segment = list(range(row + left + width, row + width)) + \
+                          list(range(row, row + right))
+            elif right > width:
+                segment = list(range(row + left, row + width)) + \
+                          list(range(row, row + right - width))
+            else:
+                segment = list(range(row + left, row + right))
+
+            if dy == 0:
+                segment.remove(row + x)
+
+            neighbours += segment
+
+        return neighbours
+
+    def find_neighbours(self, patch: Patch) -> List[Patch]:
+        """Resolve the neighbour offsets of a patch into a new list of patches."""
+        patches = self.patches
+        index = patch.index
+        return [patches[index + offset] for offset in patch.neighbour_offsets]
+
+    def get_neighbours(self, patch: Patch) -> List[Patch]:
         """Ignore the patch to be compared."""
-        return patch.neighbour_patches
+        if self.precompute_neighbours:
+            neighbours = patch.neighbour_patches
+            if neighbours is None:
+                # Cached on first use, so that a new map (e.g. of a fork) costs nothing up front
+                neighbours = patch.neighbour_patches = self.find_neighbours(patch)
+            return neighbours
+
+        return self.find_neighbours(patch)
 
     def get_random_unoccupied_patch(self, patch: Patch = None) -> Union[Patch, None]:
         """
@@ -312,21 +1074,71 @@ class PatchMap:
         If there is no patch available, return None.
         """
 
-        patches = PatchMap.get_neighbours(patch) if patch is not None else self.patches
-        unoccupied_patches = list(filter(lambda p: not p.is_occupied(), patches))
+        random = self.world.random
+
+        if patch is None:
+            # Draw from the index of unoccupied patches
+            if len(self.free_patches) == 0:
+                return None
+
+            return self.patches[self.free_patches[random.randrange(len(self.free_patches))]]
+
+        # Rejection sampling is uniform over the unoccupied neighbours,
+        # only fall back to a full scan if the neighbourhood looks crowded
+        offsets = patch.neighbour_offsets
+        if len(offsets) == 0:
+            return None
+
+        for _ in range(MOVE_ATTEMPTS):
+            candidate = patch.index + offsets[random.randrange(len(offsets))]
+            if not self.occupied[candidate]:
+                return self.patches[candidate]
+
+        unoccupied_patches = list(filter(lambda p: not p.is_occupied(), self.get_neighbours(patch)))
 
         if len(unoccupied_patches) == 0:
             return None
 
-        return choice(unoccupied_patches)
+        return random.choice(unoccupied_patches)
+
+    def update_occupancy(self, patch: Patch) -> None:
+        """Bring the occupancy index up to date with the counters of a patch."""
+        index = patch.index
+        occupied = patch.is_occupied()
+
+        if occupied == self.occupied[index]:
+            return
+
+        self.occupied[index] = occupied
+        if occupied:
+            # Swap with the last free patch, so that the removal is O(1)
+            slot = self.free_slots[index]
+            last = self.free_patches.pop()
+            if last != index:
+                self.free_patches[slot] = last
+                self.free_slots[last] = slot
+            self.free_slots[index] = -1
+        else:
+            self.free_slots[index] = len(self.free_patches)
+            self.free_patches.append(index)
+
+    def restore_free_patches(self, free_patches: List[int]) -> None:
+        """Restore the order of the index of unoccupied patches (which random draws depend on)."""
+        if sorted(free_patches) != sorted(self.free_patches):
+            raise ValueError('The unoccupied patches do not match the occupancy of the map')
+
+        self.free_patches = list(free_patches)
+        self.free_slots = [-1] * len(self.patches)
+        for slot, index in enumerate(self.free_patches):
+            self.free_slots[index] = slot
 
-    @staticmethod
     def filter_neighbour_turtles(
+        self,
         patch: Patch,
         turtle_filter: Optional[Callable[[Union[Cop, Agent]], bool]]
     ):
         """Get the filtered list of neighbour turtle based on the filter function."""
-        neighbour_patches = PatchMap.get_neighbours(patch)
+        neighbour_patches = self.get_neighbours(patch)
         all_turtles = []
 
         # For each neighbour patch, find all matching turtles and add to the final list
@@ -1,30 +1,183 @@
-from time import sleep
+import argparse
+import cProfile
+import pstats
+from contextlib import ExitStack
+from time import sleep, perf_counter
 
-from dynamic_params import DynamicParamReader, FRAME_INTERVAL
-from models import World
-from static_params import MAX_FRAMES
+from analytics import StreamingAnalyzer
+from dynamic_params import DynamicParamReader, ParamSchedule, ScheduledParamReader, FRAME_INTERVAL
+from instrumentation import Instrumentation, timing_path
+from models import World, ENGINES, ENGINE_OBJECT
+from output import OUTPUT_WRITERS
+from static_params import MAX_FRAMES, ENGINE, OUTPUT_FORMAT, FILE_PATH, SEED, INSTRUMENT, \
+    CHECKPOINT_INTERVAL, DEBUG_COUNTERS, GRID_STRIDE, SUBSTEPS, SYNCHRONOUS, WORKERS, \
+    SimulationConfig
 
 # Author: Dafu Ai
 
+PROFILE_TOP = 20    # Number of functions printed from a profile
 
-def main():
+
+def parse_args(args=None) -> argparse.Namespace:
+    """Parse the command line arguments."""
+    parser = argparse.ArgumentParser(description='Simulate the Rebellion model.')
+    parser.add_argument('--headless', action='store_true',
+                        help='batch mode: do not print frames or wait between them')
+    parser.add_argument('--max-frames', type=int, default=MAX_FRAMES,
+                        help='number of frames to simulate, a resumed run also stops at this '
+                             'frame (default: %(default)s)')
+    parser.add_argument('--seed', type=int, default=SEED,
+                        help='seed of the random generator (default: random)')
+    parser.add_argument('--output', default='out.csv',
+                        help='path of the output file (default: %(default)s)')
+    parser.add_argument('--output-format', choices=sorted(OUTPUT_WRITERS), default=OUTPUT_FORMAT,
+                        help='format of the output file (default: %(default)s)')
+    parser.add_argument('--engine', choices=ENGINES, default=ENGINE,
+                        help='engine running the world (default: %(default)s)')
+    parser.add_argument('--synchronous', action='store_true', default=SYNCHRONOUS,
+                        help='update all turtles from the same state in every phase of a frame '
+                             '(see synchronous.py, the array engines do with --substeps 1)')
+    parser.add_argument('--substeps', type=int, default=SUBSTEPS,
+                        help='random sub-steps of a tick on the array engines, every turtle '
+                             'acting in one of them (default: %(default)s)')
+    parser.add_argument('--workers', type=int, default=WORKERS,
+                        help='worker processes deciding the agents in the synchronous mode '
+                             '(0 or 1 to decide them in this process, as are small frames), '
+                             'or owning a band of the map each on the decomposed engine '
+                             '(0 for one per core) '
+                             '(default: %(default)s)')
+    parser.add_argument('--grid', metavar='PATH', default=None,
+                        help='dump the state of every patch to a .npy stack (see grid.py)')
+    parser.add_argument('--grid-stride', type=int, default=GRID_STRIDE,
+                        help='frames between two grid dumps (default: %(default)s)')
+    parser.add_argument('--analysis', metavar='PATH', default=None,
+                        help='analyse the active counts and the bursts of rebellion while running, '
+                             'and write the report to the specified json file')
+    parser.add_argument('--debug-counters', action='store_true', default=DEBUG_COUNTERS,
+                        help='cross-check the agent counters with a full recount every frame')
+    parser.add_argument('--instrument', action='store_true', default=INSTRUMENT,
+                        help='time the hot paths of every frame and write the timings next to '
+                             'the output (e.g. out_timing.csv)')
+    parser.add_argument('--profile', metavar='PATH', default=None,
+                        help='run under cProfile and dump the pstats to the specified file')
+    parser.add_argument('--checkpoint', metavar='PATH', default=None,
+                        help='save a snapshot of the world to the specified file at the end '
+                             '(and every --checkpoint-interval frames)')
+    parser.add_argument('--checkpoint-interval', type=int, default=CHECKPOINT_INTERVAL,
+                        help='frames between two checkpoints, 0 to only save at the end '
+                             '(default: %(default)s)')
+    parser.add_argument('--resume', metavar='PATH', default=None,
+                        help='resume from a snapshot (its static parameters and seed are used, '
+                             'and the output only holds the frames after it)')
+    parser.add_argument('--params', default=FILE_PATH,
+                        help='path of the dynamic parameters file (default: %(default)s)')
+    parser.add_argument('--schedule', metavar='PATH', default=None,
+                        help='follow a json schedule of the dynamic parameters instead of '
+                             'polling the parameters file (see dynamic_params.ParamSchedule)')
+    options = parser.parse_args(args)
+
+    # Fail before running rather than when the first snapshot is saved
+    if options.engine != ENGINE_OBJECT:
+        for name, value in [('--checkpoint', options.checkpoint), ('--resume', options.resume)]:
+            if value is not None:
+                parser.error('{} is only supported by the {} engine'.format(name, ENGINE_OBJECT))
+
+    return options
+
+
+def main(args=None):
     """The entry point for simulation."""
-    frame = 1
+    options = parse_args(args)
+
+    # Read dynamic parameters from the specified file, or follow a schedule
+    if options.schedule is not None:
+        param_reader = ScheduledParamReader(ParamSchedule.from_file(options.schedule))
+    else:
+        param_reader = DynamicParamReader(options.params)
+
+    instrumentation = None
+    profiler = None
+    analyzer = None
+
+    # Settings of this run, a resumed run keeps the rest of the config of its snapshot
+    settings = {
+        'output_format': options.output_format,
+        'debug_counters': options.debug_counters,
+        'grid_stride': options.grid_stride,
+        'substeps': options.substeps,
+        'workers': options.workers
+    }
+
+    # Initialise the world (the output is closed once the run finishes)
+    with ExitStack() as stack:
+        if options.resume is not None:
+            world = stack.enter_context(World.load_snapshot(
+                options.resume, param_reader, options.output, engine=options.engine,
+                settings=settings, grid_filename=options.grid))
+        else:
+            world = stack.enter_context(World(
+                dynamic_params_reader=param_reader, output_filename=options.output,
+                engine=options.engine,
+                config=SimulationConfig(seed=options.seed, synchronous=options.synchronous,
+                                        **settings),
+                grid_filename=options.grid))
+
+        # A resumed run analyses its frames with the config of its snapshot
+        if options.analysis is not None:
+            analyzer = world.analyzer = StreamingAnalyzer(world.config.burst_exit_fraction)
+
+        first_frame = world.frame + 1
+        frame = first_frame
+
+        # Only the frames are instrumented or profiled, not the creation of the world
+        if options.instrument:
+            instrumentation = stack.enter_context(
+                Instrumentation(timing_path(options.output)))
+
+        if options.profile is not None:
+            profiler = cProfile.Profile()
+            profiler.enable()
+            stack.callback(profiler.disable)
+
+        start = perf_counter()
+
+        while frame <= options.max_frames:
+            if not options.headless:
+                print("Frame #" + str(frame))
+
+            world.update(frame)
+
+            if options.checkpoint is not None and options.checkpoint_interval > 0 and \
+                    frame % options.checkpoint_interval == 0:
+                world.save_snapshot(options.checkpoint)
+
+            # Speed will depend on the frame interval, which can be set dynamically
+            if not options.headless:
+                sleep(world.get_dynamic_param(FRAME_INTERVAL[0]))
+
+            frame += 1
+
+        elapsed = perf_counter() - start
+
+        if options.checkpoint is not None:
+            world.save_snapshot(options.checkpoint)
 
-    # Read dynamic parameters from the specified file
-    dynamic_params_filename = 'dynamic_params.json'
-    param_reader = DynamicParamReader(dynamic_params_filename)
+    # Report the throughput of a batch run (the frames of an interactive run include the waits)
+    ticks = frame - first_frame
+    if options.headless and elapsed > 0:
+        print('{} frames in {:.2f}s: {:.1f} ticks/sec, {:.0f} agent-updates/sec'.format(
+            ticks, elapsed, ticks / elapsed, ticks * world.config.total_agents() / elapsed))
 
-    # Initialise the world
-    world = World(dynamic_params_reader=param_reader, output_filename='out.csv')
+    if analyzer is not None:
+        analyzer.save(options.analysis)
+        print(analyzer.summary())
 
-    while frame <= MAX_FRAMES:
-        print("Frame #" + str(frame))
-        world.update(frame)
+    if instrumentation is not None:
+        print(instrumentation.summary())
 
-        # Speed will depend on the frame interval, which can be set dynamically
-        sleep(param_reader.read_params()[FRAME_INTERVAL[0]])
-        frame += 1
+    if profiler is not None:
+        profiler.dump_stats(options.profile)
+        pstats.Stats(profiler).sort_stats('cumulative').print_stats(PROFILE_TOP)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,270 @@
+import argparse
+import csv
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import product
+from random import Random
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from analytics import StreamingAnalyzer
+from dynamic_params import DynamicParams, FixedParamReader
+from models import World, ENGINE_OBJECT, derive_seed
+from output import FORMAT_CSV
+from static_params import SimulationConfig, MAX_FRAMES
+
+# Author: Dafu Ai
+# Parameter sweeps: every (parameters, seed) pair runs as an independent world in a process pool.
+#
+# A sweep is described by a json spec, e.g.
+# {
+#     "method": "grid",                       # "grid" or "lhs" (latin hypercube)
+#     "parameters": {                         # grid: values to combine, lhs: [low, high]
+#         "government_legitimacy": [0.6, 0.7, 0.8],
+#         "vision": [5.0, 7.0]
+#     },
+#     "samples": 20,                          # lhs only: number of points to sample
+#     "replicates": 5,                        # runs per point, each with its own seed
+#     "seed": 0,                              # base seed the seeds of all runs derive from
+#     "max_frames": 1000,
+#     "engine": "object",
+#     "output_dir": "sweep",
+#     "aggregate": true,                      # one sweep.csv instead of a file per run
+#     "analysis": true,                       # also write the burst statistics of every run
+#                                             # to analysis.csv (see analytics.py)
+#     "batched": true                         # run the replicates of a point as one batch on
+# }                                           # the numpy engine (see batched.py), which share
+#                                             # the seed of the batch
+# Parameters are the fields of SimulationConfig (static) or DynamicParams (dynamic).
+
+METHOD_GRID = 'grid'
+METHOD_LHS = 'lhs'
+
+
+class SweepRun(NamedTuple):
+    """One (parameters, seed) pair of a sweep"""
+    run: int                    # Index of the run in the sweep
+    replicate: int              # Index of the replicate for its parameter point
+    seed: int                   # Seed of the random generator
+    values: Dict[str, Any]      # Values of the swept parameters
+
+
+def field_type(name: str) -> type:
+    """The declared type of a static or dynamic parameter."""
+    if name in DynamicParams._fields:
+        return DynamicParams.__annotations__[name]
+    return SimulationConfig.__annotations__[name]
+
+
+def grid_points(parameters: Dict[str, list]) -> List[Dict[str, Any]]:
+    """All combinations of the parameter values."""
+    names = sorted(parameters)
+    return [dict(zip(names, values)) for values in product(*(parameters[n] for n in names))]
+
+
+def latin_hypercube_points(parameters: Dict[str, list], samples: int,
+                           rng: Random) -> List[Dict[str, Any]]:
+    """
+    Sample points so that every [low, high] range is split into `samples` strata
+    and each stratum is used exactly once. Integer parameters get integer values.
+    """
+    points = [{} for _ in range(samples)]
+
+    for name in sorted(parameters):
+        low, high = parameters[name]
+        strata = list(range(samples))
+        rng.shuffle(strata)
+
+        for point, stratum in zip(points, strata):
+            value = low + (stratum + rng.random()) / samples * (high - low)
+            point[name] = round(value) if field_type(name) is int else value
+
+    return points
+
+
+def split_values(values: Dict[str, Any]) -> Tuple[SimulationConfig, DynamicParams]:
+    """Apply swept values to the default static config and dynamic params (converted like
+    those of the dynamic parameters file, raise ValueError if a value does not fit)."""
+    static = {k: v for k, v in values.items() if k in SimulationConfig._fields}
+    dynamic = {k: DynamicParams.convert(k, v) for k, v in values.items()
+               if k in DynamicParams._fields}
+    return SimulationConfig()._replace(**static), DynamicParams()._replace(**dynamic)
+
+
+def plan_runs(spec: dict) -> List[SweepRun]:
+    """Expand a sweep spec into its list of runs."""
+    parameters = spec['parameters']
+    for name in parameters:
+        if name not in SimulationConfig._fields and name not in DynamicParams._fields:
+            raise ValueError('Unknown parameter: ' + name)
+
+    base_seed = spec.get('seed', 0)
+    rng = Random(base_seed)
+    method = spec.get('method', METHOD_GRID)
+
+    if method == METHOD_GRID:
+        points = grid_points(parameters)
+    elif method == METHOD_LHS:
+        points = latin_hypercube_points(parameters, spec['samples'], rng)
+    else:
+        raise ValueError('Unknown sweep method: ' + method)
+
+    runs = []
+    for values in points:
+        # Fail before any run starts
+        split_values(values)
+
+        first = len(runs)
+        for replicate in range(spec.get('replicates', 1)):
+            # Every run gets an independent stream derived from the base seed, except that the
+            # replicates of a batch share the stream of the batch (seeded by its first run)
+            seed = derive_seed(base_seed, first if spec.get('batched', False) else len(runs))
+            runs.append(SweepRun(len(runs), replicate, seed, values))
+
+    return runs
+
+
+def run_one(run: SweepRun, max_frames: int, engine: str, output_path: str,
+            analyze: bool = False) -> Tuple[str, Optional[Dict[str, Any]]]:
+    """Simulate a single run (in a worker process) and return its output path, and its
+    statistics if analysed."""
+    config, params = split_values(run.values)
+    # The outputs are always csv, as aggregate reads them back
+    config = config._replace(seed=run.seed, output_format=FORMAT_CSV)
+    analyzer = StreamingAnalyzer(config.burst_exit_fraction) if analyze else None
+
+    with World(FixedParamReader(params), output_path, engine=engine, config=config,
+               analyzer=analyzer) as world:
+        for frame in range(1, max_frames + 1):
+            world.update(frame)
+
+    return output_path, analyzer.scalars() if analyzer is not None else None
+
+
+def aggregate(runs: List[SweepRun], paths: List[str], names: List[str], output_path: str) -> None:
+    """Merge the outputs of all runs into one table, prefixed by the run and its parameters
+    (dynamic parameters are already part of the output)."""
+    with open(output_path, 'w', newline='') as output_file:
+        csv_writer = csv.writer(output_file)
+
+        for run, path in zip(runs, paths):
+            with open(path, newline='') as run_file:
+                rows = csv.reader(run_file)
+                header = next(rows)
+                swept = [n for n in names if n not in header]
+
+                if run.run == 0:
+                    csv_writer.writerow(['run', 'replicate', 'seed'] + swept + header)
+
+                prefix = [run.run, run.replicate, run.seed] + [run.values[n] for n in swept]
+                for row in rows:
+                    csv_writer.writerow(prefix + row)
+
+            os.remove(path)
+
+
+def run_batch(runs: List[SweepRun], max_frames: int, output_paths: List[str],
+              analyze: bool = False) -> List[Tuple[str, Optional[Dict[str, Any]]]]:
+    """Simulate the replicates of a point as one batch (in a worker process) and return the output
+    path of every run, and its statistics if analysed. The batch is seeded by the seed of its
+    runs."""
+    # Imported here so that sweeps on the object engine do not require NumPy
+    from batched import WorldBatch
+
+    config, params = split_values(runs[0].values)
+    config = config._replace(seed=runs[0].seed, output_format=FORMAT_CSV)
+    analyzers = [StreamingAnalyzer(config.burst_exit_fraction) for _ in runs] if analyze else None
+
+    with WorldBatch(FixedParamReader(params), output_paths, config=config,
+                    analyzers=analyzers) as batch:
+        for frame in range(1, max_frames + 1):
+            batch.update(frame)
+
+    if analyzers is None:
+        return [(path, None) for path in output_paths]
+
+    return [(path, analyzer.scalars()) for path, analyzer in zip(output_paths, analyzers)]
+
+
+def write_analysis(runs: List[SweepRun], statistics: List[Dict[str, Any]], names: List[str],
+                   output_path: str) -> None:
+    """Write the statistics of every run, prefixed by the run and its parameters."""
+    with open(output_path, 'w', newline='') as output_file:
+        csv_writer = csv.writer(output_file)
+        csv_writer.writerow(['run', 'replicate', 'seed'] + names + list(statistics[0]))
+
+        for run, row in zip(runs, statistics):
+            csv_writer.writerow([run.run, run.replicate, run.seed] +
+                                [run.values[n] for n in names] + list(row.values()))
+
+
+def run_sweep(spec: dict, workers: Optional[int] = None) -> List[str]:
+    """Run a whole sweep across a pool of processes and return the output paths."""
+    runs = plan_runs(spec)
+    names = sorted(spec['parameters'])
+    output_dir = spec.get('output_dir', 'sweep')
+    os.makedirs(output_dir, exist_ok=True)
+
+    run_paths = [os.path.join(output_dir, 'run_{:05d}.csv'.format(run.run)) for run in runs]
+    max_frames = spec.get('max_frames', MAX_FRAMES)
+
+    # A sweep without any run (e.g. no replicates) starts no pool, but still writes its index
+    results = []
+    if runs:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            if spec.get('batched', False):
+                # The replicates of a point are consecutive runs
+                replicates = spec.get('replicates', 1)
+                futures = [
+                    executor.submit(run_batch, runs[i:i + replicates], max_frames,
+                                    run_paths[i:i + replicates], spec.get('analysis', False))
+                    for i in range(0, len(runs), replicates)
+                ]
+                results = [result for future in futures for result in future.result()]
+            else:
+                futures = [
+                    executor.submit(run_one, run, max_frames, spec.get('engine', ENGINE_OBJECT),
+                                    path, spec.get('analysis', False))
+                    for run, path in zip(runs, run_paths)
+                ]
+                results = [future.result() for future in futures]
+
+    paths = [path for path, _ in results]
+    statistics = [scalars for _, scalars in results]
+
+    if spec.get('analysis', False) and runs:
+        write_analysis(runs, statistics, names, os.path.join(output_dir, 'analysis.csv'))
+
+    if spec.get('aggregate', False):
+        output_path = os.path.join(output_dir, 'sweep.csv')
+        aggregate(runs, paths, names, output_path)
+        return [output_path]
+
+    # Keep an index mapping every output file to its parameters
+    with open(os.path.join(output_dir, 'runs.csv'), 'w', newline='') as index_file:
+        csv_writer = csv.writer(index_file)
+        csv_writer.writerow(['run', 'replicate', 'seed'] + names + ['output'])
+        for run, path in zip(runs, paths):
+            csv_writer.writerow([run.run, run.replicate, run.seed] +
+                                [run.values[n] for n in names] + [os.path.basename(path)])
+
+    return paths
+
+
+def main(args=None):
+    """The entry point for sweeps."""
+    parser = argparse.ArgumentParser(description='Run a parameter sweep of the Rebellion model.')
+    parser.add_argument('spec', help='path of the json sweep spec')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='number of worker processes (default: all cores)')
+    options = parser.parse_args(args)
+
+    with open(options.spec) as spec_file:
+        spec = json.load(spec_file)
+
+    paths = run_sweep(spec, options.workers)
+    print('{} output file(s) written to {}'.format(len(paths), spec.get('output_dir', 'sweep')))
+
+
+if __name__ == '__main__':
+    main()
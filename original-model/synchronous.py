@@ -0,0 +1,256 @@
+import argparse
+import json
+import os
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from math import exp
+from time import perf_counter
+from typing import Dict, List, Optional, Tuple
+
+from analytics import RunningStats, StreamingAnalyzer
+from dynamic_params import FixedParamReader, GOVERNMENT_LEGITIMACY
+from models import World, Turtle, Cop, Agent
+from static_params import TILE_SIZE, WORKERS, SimulationConfig
+
+# Author: Dafu Ai
+# Synchronous updates (SYNCHRONOUS = True): instead of letting every turtle move and act on the
+# state left by the turtles before it, a frame runs in phases and every turtle of a phase sees
+# the same state, the one at the start of the phase:
+# 1. Movement: every turtle which can move picks a patch from the occupancy at the start of
+#    the frame. Agents never block each other, but several cops may pick the same free patch,
+#    which goes to the first of them in the shuffle (the others stay where they are).
+# 2. Decision: every free agent decides from the vision counters after the movement, so no
+#    agent sees the decisions of the others. The decision of an agent only depends on the
+#    counters of its own patch, so the agents are grouped by tiles of the map which are
+#    decided by a pool of worker processes (WORKERS) on large maps (POOL_AGENTS).
+# 3. Enforcement: every cop picks a suspect among the agents active after the decisions.
+#    A suspect picked by several cops is arrested by the first of them in the shuffle
+#    (the others do nothing this frame).
+# The agents are released at the end of the frame as before. All random draws happen in the
+# process of the world in the order of the shuffle, so a run only depends on its seed, not on
+# the number of workers or the size of the tiles. Compare the dynamics of both modes with
+# python3 synchronous.py --frames 1000 --seeds 10
+
+# Fewest free agents of a frame decided by the worker processes, smaller frames are decided in
+# this process: a frame sent to the pool costs about 2 ms plus 0.25 us per agent against 0.65 us
+# per agent decided here, so 2 workers only pay off from about 30000 agents (4 from 9000)
+POOL_AGENTS = 20000
+
+# Columns of the agents of a tile: risk aversion, perceived hardship,
+# cops and active agents in the vision of their patches
+TileColumns = Tuple[array, array, array, array]
+
+
+def decide_tile(params: Tuple[float, float, float], columns: TileColumns) -> bytes:
+    """
+    Decide the activeness of the agents of a tile (in a worker process), with the same formula
+    as Agent.determine_behaviour. The params are (k, threshold, government legitimacy).
+    """
+    k, threshold, legitimacy = params
+    decisions = bytearray(len(columns[0]))
+
+    for i, (risk_aversion, perceived_hardship, c, a) in enumerate(zip(*columns)):
+        grievance = perceived_hardship * (1 - legitimacy)
+        arrest_probability = 1 - exp(-k * (c // (1 + a)))
+        decisions[i] = (grievance - risk_aversion * arrest_probability) > threshold
+
+    return bytes(decisions)
+
+
+class SynchronousScheduler:
+    """
+    Runs the phases of a synchronous frame for a world on the object engine.
+    """
+    world: World                    # The world being updated
+    config: SimulationConfig        # Static parameters of the world
+    tile_size: int                  # Side of a tile in patches
+    tile_count: int                 # Number of tiles of the map
+    tile_of: array                  # Tile of every patch, indexed by the patch index
+    workers: int                    # Number of worker processes (0 or 1 to decide in this
+                                    # process)
+    executor: Optional[ProcessPoolExecutor]  # Pool of the workers (None until a frame is large
+                                    # enough for it)
+
+    def __init__(self, world: World, workers: int = WORKERS, tile_size: int = TILE_SIZE) -> None:
+        self.world = world
+        self.config = world.config
+        self.tile_size = max(1, tile_size)
+        self.workers = workers
+        self.executor = None
+
+        width, height = self.config.map_width, self.config.map_height
+        tiles_x = -(-width // self.tile_size)
+        self.tile_count = tiles_x * -(-height // self.tile_size)
+        self.tile_of = array('i', ((y // self.tile_size) * tiles_x + x // self.tile_size
+                                   for y in range(height) for x in range(width)))
+
+    def close(self) -> None:
+        """Stop the worker processes."""
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    def update(self, turtles: List[Turtle]) -> None:
+        """Perform the phases of a frame, the turtles taking turns in the given order."""
+        self.move(turtles)
+
+        agents = [turtle for turtle in turtles if isinstance(turtle, Agent) and
+                  turtle.patch is not None and not turtle.is_jailed()]
+        self.decide(agents)
+
+        self.enforce([turtle for turtle in turtles if isinstance(turtle, Cop) and
+                      turtle.patch is not None])
+
+    def move(self, turtles: List[Turtle]) -> None:
+        """Move every turtle which can move to a patch picked from the occupancy
+        at the start of the phase, cops picking the same patch go to it in turn."""
+        patch_map = self.world.patch_map
+        targets = [(turtle, patch_map.get_random_unoccupied_patch(turtle.patch))
+                   for turtle in turtles if turtle.can_move()]
+
+        claimed = set()
+        for turtle, target in targets:
+            if target is None:
+                continue
+
+            if isinstance(turtle, Cop):
+                if target.index in claimed:
+                    continue
+                claimed.add(target.index)
+
+            turtle.move_to_patch(target)
+
+    def decide(self, agents: List[Agent]) -> None:
+        """Decide every free agent from the counters at the start of the phase,
+        then flag their activeness in the given order."""
+        tiles = [[] for _ in range(self.tile_count)]
+        for agent in agents:
+            tiles[self.tile_of[agent.patch.index]].append(agent)
+        tiles = [tile for tile in tiles if tile]
+
+        params = (self.config.k, self.config.threshold,
+                  self.world.get_dynamic_param(GOVERNMENT_LEGITIMACY[0]))
+        columns = [self.tile_columns(tile) for tile in tiles]
+
+        if self.workers < 2 or len(agents) < POOL_AGENTS:
+            results = map(decide_tile, repeat(params), columns)
+        else:
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(max_workers=self.workers)
+            results = self.executor.map(decide_tile, repeat(params), columns,
+                                        chunksize=max(1, len(tiles) // (4 * self.workers)))
+
+        decisions = bytearray(len(self.world.registry))
+        for tile, result in zip(tiles, results):
+            for agent, decision in zip(tile, result):
+                decisions[agent.id] = decision
+
+        for agent in agents:
+            agent.active = bool(decisions[agent.id])
+
+    @staticmethod
+    def tile_columns(agents: List[Agent]) -> TileColumns:
+        """The inputs of the decisions of the agents of a tile."""
+        return (array('d', (agent.risk_aversion for agent in agents)),
+                array('d', (agent.perceived_hardship for agent in agents)),
+                array('i', (agent.patch.cops_in_vision for agent in agents)),
+                array('i', (agent.patch.active_in_vision for agent in agents)))
+
+    @staticmethod
+    def enforce(cops: List[Cop]) -> None:
+        """Let every cop pick a suspect among the agents active at the start of the phase,
+        then arrest them in turn (a suspect is only arrested once)."""
+        suspects = [(cop, cop.find_suspect()) for cop in cops]
+
+        arrested = set()
+        for cop, suspect in suspects:
+            if suspect is None or suspect.id in arrested:
+                continue
+
+            arrested.add(suspect.id)
+            cop.arrest(suspect)
+
+
+def run_mode(synchronous: bool, seed: int, frames: int, workers: int) -> Tuple[dict, float]:
+    """Run one world in a mode and return the scalars of its analysis (with the mean of
+    every count) and the seconds per frame."""
+    config = SimulationConfig(seed=seed, synchronous=synchronous, workers=workers)
+    analyzer = StreamingAnalyzer(config.burst_exit_fraction)
+    means = [RunningStats() for _ in World.output_columns()[1:4]]
+
+    with World(FixedParamReader(), os.devnull, config=config, analyzer=analyzer) as world:
+        start = perf_counter()
+        for frame in range(1, frames + 1):
+            world.update(frame)
+            for stats, count in zip(means, world.count_agents()):
+                stats.add(count)
+        elapsed = perf_counter() - start
+
+    scalars = analyzer.scalars()
+    for column, stats in zip(World.output_columns()[1:4], means):
+        scalars[column + '_mean'] = stats.mean
+
+    return scalars, elapsed / frames
+
+
+def compare_modes(seeds: int, frames: int, workers: int) -> Dict[str, dict]:
+    """Run the same seeds in both modes and average every statistic over the seeds."""
+    report = {}
+
+    for name, synchronous in [('asynchronous', False), ('synchronous', True)]:
+        stats = {}
+        for seed in range(seeds):
+            scalars, seconds = run_mode(synchronous, seed, frames, workers if synchronous else 0)
+            scalars['seconds_per_frame'] = seconds
+
+            for key, value in scalars.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    stats.setdefault(key, RunningStats()).add(value)
+
+        report[name] = {key: value.as_dict() for key, value in stats.items()}
+
+    return report
+
+
+def format_report(report: Dict[str, dict]) -> str:
+    """A table of the mean (and standard deviation over the seeds) of every statistic."""
+    asynchronous, synchronous = report['asynchronous'], report['synchronous']
+    lines = ['{:<20} {:>22} {:>22} {:>10}'.format('statistic', 'asynchronous', 'synchronous',
+                                                  'change')]
+
+    for key in asynchronous:
+        if key not in synchronous:
+            continue
+        a, s = asynchronous[key], synchronous[key]
+        change = '{:+.1%}'.format(s['mean'] / a['mean'] - 1) if a['mean'] else '-'
+        lines.append('{:<20} {:>14.4g} ±{:<7.3g} {:>14.4g} ±{:<7.3g} {:>10}'.format(
+            key, a['mean'], a['std'], s['mean'], s['std'], change))
+
+    return '\n'.join(lines)
+
+
+def main(args=None):
+    """The entry point for comparing the synchronous and the asynchronous mode."""
+    parser = argparse.ArgumentParser(
+        description='Compare the dynamics of the synchronous and the asynchronous mode.')
+    parser.add_argument('--frames', type=int, default=1000,
+                        help='number of frames of every run (default: %(default)s)')
+    parser.add_argument('--seeds', type=int, default=10,
+                        help='number of seeds run in both modes (default: %(default)s)')
+    parser.add_argument('--workers', type=int, default=WORKERS,
+                        help='worker processes of the synchronous mode (default: %(default)s)')
+    parser.add_argument('--output', metavar='PATH', default=None,
+                        help='also write the report to a json file')
+    options = parser.parse_args(args)
+
+    report = compare_modes(options.seeds, options.frames, options.workers)
+    print(format_report(report))
+
+    if options.output is not None:
+        with open(options.output, 'w') as output_file:
+            json.dump(report, output_file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
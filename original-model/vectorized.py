@@ -0,0 +1,377 @@
+from functools import lru_cache
+from math import sqrt
+from typing import Callable, Dict, Iterator, List, Set, Tuple, TYPE_CHECKING
+
+import numpy as np
+
+from dynamic_params import MAX_JAILED_TERM, GOVERNMENT_LEGITIMACY, MOVEMENT
+from grid import GRID_COP, GRID_ACTIVE, GRID_JAILED, GRID_QUIET
+
+if TYPE_CHECKING:
+    from models import World
+    from static_params import SimulationConfig
+
+# Author: Dafu Ai
+# Vectorized engine: agents and cops are stored as parallel NumPy arrays (struct-of-arrays)
+# and every phase of a tick is computed for all turtles at once.
+# A tick runs in random sub-steps (SUBSTEPS): every turtle acts in one of them, and sees the moves,
+# decisions and arrests of the turtles of the earlier sub-steps, as it would see those of the
+# turtles before it in the object engine. The series are not step-by-step equivalent to those of
+# the object engine. With 16 sub-steps on the default map (seeds 3-6, frames 100-1000) the mean
+# active count is about 3% higher (95 against 93 active agents) and the mean jailed count about
+# 2% lower. With a single sub-step all turtles act on the same state, like the synchronous mode of
+# the object engine, and the mean active count is about 35% higher (124-130).
+
+MOVE_ATTEMPTS = 8   # Number of random neighbour patches tried before a turtle stays put
+PICK_CHUNK = 4096   # Centres whose vision disc is gathered at once (bounds the memory)
+RECOUNT_COST = 8    # Cost of updating one patch of a vision count, against summing one span of
+                    # the convolution (see vision_sum)
+
+
+@lru_cache(maxsize=None)
+def disc_offsets(vision: float) -> np.ndarray:
+    """All (dx, dy) offsets within the vision, excluding the patch itself
+    (cached, so worlds with the same vision share one read-only table)."""
+    r = int(vision)
+    offsets = np.array([(dx, dy)
+                        for dy in range(-r, r + 1)
+                        for dx in range(-r, r + 1)
+                        if (dx, dy) != (0, 0) and dx * dx + dy * dy <= vision * vision])
+    offsets.flags.writeable = False
+    return offsets
+
+
+def disc_sum(padded: np.ndarray, half_widths: np.ndarray) -> np.ndarray:
+    """
+    Sum a grid over the vision disc around every patch (including the patch itself).
+    The last two (y, x) axes of the grid are padded by the radius r of the disc on both sides,
+    e.g. with the rows seen from another part of the map, and the result drops the padding.
+    """
+    r = len(half_widths) // 2
+    height, width = padded.shape[-2] - 2 * r, padded.shape[-1] - 2 * r
+    prefix = np.zeros(padded.shape[:-1] + (padded.shape[-1] + 1,), dtype=padded.dtype)
+    np.cumsum(padded, axis=-1, out=prefix[..., 1:])
+
+    total = np.zeros(padded.shape[:-2] + (height, width), dtype=padded.dtype)
+    for i, w in enumerate(half_widths):
+        rows = prefix[..., i:i + height, :]
+        total += rows[..., r + w + 1:r + w + 1 + width] - rows[..., r - w:r - w + width]
+
+    return total
+
+
+class VectorizedEngine:
+    """
+    Runs the Rebellion tick on arrays instead of Turtle/Patch objects.
+    Patches are addressed by their flat index y * width + x (same order as PatchMap.patches).
+    An engine can hold several worlds of the same size (see batched.py): the patches of world i
+    then follow those of world i - 1, i.e. index i * width * height + y * width + x, and the
+    turtles of every world are a contiguous block of the arrays.
+    """
+    world: 'World'                  # The world this engine is in
+    config: 'SimulationConfig'      # Static parameters of the world
+    width: int                      # Number of patches in x direction
+    height: int                     # Number of patches in y direction
+    torus: bool                     # Whether the map wraps around at the edges
+    replicates: int                 # Number of worlds held by the arrays
+    total_patches: int              # Number of patches of one world
+    shape: Tuple[int, ...]          # Shape of a grid of all patches (worlds, height, width)
+    rng: np.random.Generator        # Random source of this engine
+    offsets: np.ndarray             # (dx, dy) offsets within the vision
+    half_widths: np.ndarray         # Half width of the vision disc for each dy in [-r, r]
+    cop_pos: np.ndarray             # Patch index of each cop
+    pos: np.ndarray                 # Patch index of each agent
+    active: np.ndarray              # Whether each agent is open rebelling
+    jail_term: np.ndarray           # Remaining jailed term of each agent
+    risk_aversion: np.ndarray       # Risk aversion of each agent
+    perceived_hardship: np.ndarray  # Perceived hardship of each agent
+    seen: Dict[str, np.ndarray]     # Turtles of each kind within the vision of every patch
+    sources: Dict[str, Callable[[], np.ndarray]]  # Per-patch grid of the turtles of each kind
+    stale: Set[str]                 # Kinds whose vision count must be recounted from the map
+    updated: Dict[str, int]         # Patches updated in each vision count since its recount
+
+    def __init__(self, world: 'World', replicates: int = 1) -> None:
+        """Place all cops and agents on the map (of every world)."""
+        self.world = world
+        self.config = world.config
+        self.width = world.config.map_width
+        self.height = world.config.map_height
+        self.replicates = replicates
+        self.total_patches = self.width * self.height
+        self.shape = (self.height, self.width) if replicates == 1 else \
+            (replicates, self.height, self.width)
+        # Seeded from the generator of the world, so that its seed drives both engines
+        self.rng = np.random.default_rng(world.random.getrandbits(64))
+
+        vision = world.config.vision
+        self.offsets = disc_offsets(vision)
+        r = int(vision)
+
+        self.torus = world.config.topology == 'torus'
+        if self.torus and min(self.width, self.height) <= 2 * r:
+            raise ValueError('The numpy engine needs a torus larger than the vision disc')
+        self.half_widths = np.array([int(sqrt(int(vision * vision) - dy * dy))
+                                     for dy in range(-r, r + 1)])
+
+        total_patches = self.total_patches
+        n_cops = world.config.total_cops()
+        n_agents = world.config.total_agents()
+
+        # Cops never share a patch, agents can stand on any patch without a cop
+        if replicates == 1:
+            self.cop_pos = self.rng.choice(total_patches, size=n_cops, replace=False)
+            free = np.ones(total_patches, dtype=bool)
+            free[self.cop_pos] = False
+            self.pos = self.rng.choice(np.flatnonzero(free), size=n_agents)
+        else:
+            # A random order of the patches of every world, its first patches get the cops
+            order = np.argsort(self.rng.random((replicates, total_patches)), axis=1)
+            first = np.arange(replicates)[:, np.newaxis] * total_patches
+            self.cop_pos = (order[:, :n_cops] + first).ravel()
+            picks = self.rng.integers(total_patches - n_cops, size=(replicates, n_agents))
+            self.pos = (np.take_along_axis(order[:, n_cops:], picks, axis=1) + first).ravel()
+            n_agents *= replicates
+
+        self.active = np.zeros(n_agents, dtype=bool)
+        self.jail_term = np.zeros(n_agents, dtype=np.int64)
+        self.risk_aversion = self.rng.uniform(0, 1, n_agents)
+        self.perceived_hardship = self.rng.uniform(0, 1, n_agents)
+
+        # Kept up to date as turtles move and change, like the counters of the patches
+        self.sources = {
+            'cops': lambda: self.grid(self.cop_pos),
+            'active': lambda: self.grid(self.pos[self.active]),
+        }
+        self.seen = {}
+        self.stale = set(self.sources)
+        self.updated = {}
+
+    def close(self) -> None:
+        """Nothing to release, the arrays are owned by this process."""
+        pass
+
+    def update(self) -> Tuple[int, int, int]:
+        """Advance one tick and return the (quiet, jailed, active) counts."""
+        self.step()
+        return self.replicate_counts()[0]
+
+    def step(self) -> None:
+        """Advance one tick, every turtle acting in a random sub-step."""
+        substeps = max(1, self.config.substeps)
+        cop_steps = self.rng.integers(substeps, size=len(self.cop_pos))
+        agent_steps = self.rng.integers(substeps, size=len(self.pos))
+
+        for substep in range(substeps):
+            cops = np.flatnonzero(cop_steps == substep)
+            self.move_cops(cops)
+
+            # Agents arrested in an earlier sub-step do nothing
+            agents = np.flatnonzero((agent_steps == substep) & (self.jail_term == 0))
+            self.move_agents(agents)
+            self.determine_behaviour(agents)
+            self.enforce(cops)
+
+        # Count down every term once all turtles have acted (like the object engine), so an
+        # agent jailed for t frames is counted as jailed at the end of t - 1 of them
+        self.jail_term[self.jail_term > 0] -= 1
+
+    def replicate_counts(self) -> List[Tuple[int, int, int]]:
+        """The (quiet, jailed, active) counts of every world."""
+        agents = len(self.pos) // self.replicates
+        jailed = np.count_nonzero((self.jail_term > 0).reshape(self.replicates, -1), axis=1)
+        active = np.count_nonzero(self.active.reshape(self.replicates, -1), axis=1)
+        return [(agents - a - j, j, a) for j, a in zip(jailed.tolist(), active.tolist())]
+
+    def grid_codes(self) -> bytes:
+        """State code of every patch (see grid.py), the highest code wins on shared patches."""
+        codes = np.zeros(self.replicates * self.total_patches, dtype=np.uint8)
+        jailed = self.jail_term > 0
+
+        # Lower codes are assigned first, so that higher codes overwrite them on shared patches
+        codes[self.pos[~self.active & ~jailed]] = GRID_QUIET
+        codes[self.pos[jailed]] = GRID_JAILED
+        codes[self.cop_pos] = GRID_COP
+        codes[self.pos[self.active]] = GRID_ACTIVE
+        return codes.tobytes()
+
+    def grid(self, positions: np.ndarray, weights: np.ndarray = None) -> np.ndarray:
+        """Per-patch totals of the given positions as a ([worlds,] height, width) grid."""
+        return np.bincount(positions, weights=weights,
+                           minlength=self.replicates * self.total_patches).reshape(self.shape)
+
+    def locate(self, positions: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Split patch indices into the first index of their world, and their x and y."""
+        local = positions % self.total_patches
+        return positions - local, local % self.width, local // self.width
+
+    def vision_sum(self, grid: np.ndarray) -> np.ndarray:
+        """
+        Convolve a grid with the vision disc (excluding the centre patch).
+        The disc is split into horizontal spans which are summed with row prefix sums,
+        so the cost is O(W * H * VISION) rather than O(W * H * VISION^2).
+        """
+        r = len(self.half_widths) // 2
+        # Only the last two (y, x) axes are padded, worlds do not see each other
+        padded = np.pad(grid, [(0, 0)] * (grid.ndim - 2) + [(r, r), (r, r)],
+                        mode='wrap' if self.torus else 'constant')
+
+        return disc_sum(padded, self.half_widths) - grid
+
+    def discs(self, centres: np.ndarray) -> Iterator[Tuple[int, np.ndarray, np.ndarray]]:
+        """The patches of the vision disc of every centre patch, by chunks of centres (the first
+        centre of the chunk, the (centres, offsets) patches and whether they are on the map)."""
+        base, x, y = self.locate(centres)
+
+        for start in range(0, len(centres), PICK_CHUNK):
+            chunk = slice(start, start + PICK_CHUNK)
+            nx, ny, ok = self.wrap(x[chunk, np.newaxis] + self.offsets[:, 0],
+                                   y[chunk, np.newaxis] + self.offsets[:, 1])
+            yield start, np.where(ok, base[chunk, np.newaxis] + ny * self.width + nx, 0), ok
+
+    def seen_at(self, kind: str, patches: np.ndarray) -> np.ndarray:
+        """The number (or total weight) of turtles of a kind within the vision of each patch."""
+        if kind in self.stale:
+            self.seen[kind] = self.vision_sum(self.sources[kind]()).ravel()
+            self.stale.discard(kind)
+            self.updated[kind] = 0
+        return self.seen[kind][patches]
+
+    def count_in_vision(self, kind: str, positions: np.ndarray, weights: np.ndarray) -> None:
+        """Add the weight of a turtle at each position to the vision counts of the patches seeing
+        it, or leave the count to be recounted from the map once the updates since the last
+        recount cost more than a recount."""
+        if kind in self.stale:
+            return
+        self.updated[kind] += len(positions) * len(self.offsets)
+        if self.updated[kind] * RECOUNT_COST > self.seen[kind].size * len(self.half_widths):
+            self.stale.add(kind)
+            return
+
+        for start, patches, ok in self.discs(positions):
+            w = np.broadcast_to(weights[start:start + len(patches), np.newaxis], patches.shape)
+            np.add.at(self.seen[kind], patches[ok], w[ok])
+
+    def relocate(self, kind: str, old: np.ndarray, new: np.ndarray) -> None:
+        """Move turtles of a kind from their old to their new positions in the vision counts."""
+        moved = old != new
+        ones = np.ones(np.count_nonzero(moved), dtype=np.int64)
+        self.count_in_vision(kind, np.concatenate([old[moved], new[moved]]),
+                             np.concatenate([-ones, ones]))
+
+    def random_moves(self, positions: np.ndarray, occupied: np.ndarray) -> np.ndarray:
+        """Random unoccupied neighbour patch for each position (or the position itself)."""
+        base, x, y = self.locate(positions)
+        targets = positions.copy()
+
+        # All attempts are drawn at once, the first one landing on a free patch is taken
+        picks = self.rng.integers(len(self.offsets), size=(len(positions), MOVE_ATTEMPTS))
+        nx, ny, ok = self.wrap(x[:, np.newaxis] + self.offsets[picks, 0],
+                               y[:, np.newaxis] + self.offsets[picks, 1])
+        patches = np.where(ok, base[:, np.newaxis] + ny * self.width + nx, 0)
+        ok &= ~occupied.ravel()[patches]
+
+        moved = np.flatnonzero(ok.any(axis=1))
+        targets[moved] = patches[moved, ok[moved].argmax(axis=1)]
+        return targets
+
+    def wrap(self, x: np.ndarray, y: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Wrap coordinates around a torus, and flag those which are on the map."""
+        if self.torus:
+            return x % self.width, y % self.height, np.ones(x.shape, dtype=bool)
+
+        return x, y, (x >= 0) & (x < self.width) & (y >= 0) & (y < self.height)
+
+    def occupied_patches(self) -> np.ndarray:
+        """Patches holding a cop and no jailed agent (the same rule as Patch.is_occupied)."""
+        total_patches = self.replicates * self.total_patches
+        cops = np.bincount(self.cop_pos, minlength=total_patches) > 0
+        jailed = np.bincount(self.pos[self.jail_term > 0], minlength=total_patches) > 0
+        return cops & ~jailed
+
+    def move_cops(self, cops: np.ndarray) -> None:
+        """Move the given cops, the first (in random order) cop claiming a patch wins it."""
+        targets = self.random_moves(self.cop_pos[cops], self.occupied_patches())
+        order = self.rng.permutation(len(targets))
+        _, first = np.unique(targets[order], return_index=True)
+        winners = cops[order[first]]
+        targets = targets[order[first]]
+        self.relocate('cops', self.cop_pos[winners], targets)
+        self.cop_pos[winners] = targets
+
+    def move_agents(self, movers: np.ndarray) -> None:
+        """Move the given agents, which are not jailed (if movement is enabled)."""
+        if self.world.get_dynamic_param(MOVEMENT[0]) is not True:
+            return
+
+        targets = self.random_moves(self.pos[movers], self.occupied_patches())
+        active = self.active[movers]
+        self.relocate('active', self.pos[movers[active]], targets[active])
+        self.pos[movers] = targets
+
+    def determine_behaviour(self, free: np.ndarray) -> None:
+        """Flag the activeness of the given free agents from the current neighbour counts."""
+        at = self.pos[free]
+        c = self.seen_at('cops', at)
+        a = 1 + self.seen_at('active', at)
+
+        arrest_probability = 1 - np.exp(-self.config.k * np.floor(c / a))
+        grievance = self.perceived_hardship[free] * \
+            (1 - self.world.get_dynamic_param(GOVERNMENT_LEGITIMACY[0]))
+        decision = (grievance - self.risk_aversion[free] * arrest_probability) > \
+            self.config.threshold
+
+        changed = decision != self.active[free]
+        self.count_in_vision('active', at[changed], np.where(decision[changed], 1, -1))
+        self.active[free] = decision
+
+    def pick_in_vision(self, centres: np.ndarray, candidates: np.ndarray) -> np.ndarray:
+        """
+        For each centre patch pick a uniformly random candidate agent within the vision.
+        Returns the agent index for each centre, or -1 if there is no candidate.
+        """
+        counts = self.grid(self.pos[candidates]).ravel()
+        chosen = np.full(len(centres), -1)
+
+        for start, patches, ok in self.discs(centres):
+            # The running count of the candidates over the disc of every centre
+            running = np.cumsum(np.where(ok, counts[patches], 0), axis=1)
+
+            # The first patch where the running count passes a random target
+            target = self.rng.random(len(patches)) * running[:, -1]
+            hits = running > target[:, np.newaxis]
+            rows = np.flatnonzero(hits[:, -1])
+            chosen[start + rows] = patches[rows, hits[rows].argmax(axis=1)]
+
+        # Pick a random candidate standing on the chosen patch
+        result = np.full(len(centres), -1)
+        found = chosen >= 0
+        marked = np.zeros(counts.size, dtype=bool)
+        marked[chosen[found]] = True
+        near = candidates[marked[self.pos[candidates]]]
+        by_patch = near[np.argsort(self.pos[near], kind='stable')]
+        starts = np.searchsorted(self.pos[by_patch], chosen[found])
+        picks = starts + (self.rng.random(np.count_nonzero(found)) *
+                          counts[chosen[found]]).astype(np.int64)
+        result[found] = by_patch[picks]
+        return result
+
+    def enforce(self, cops: np.ndarray) -> None:
+        """Every given cop arrests a random active agent in its neighbourhood
+        and moves onto its patch."""
+        suspects = self.pick_in_vision(self.cop_pos[cops], np.flatnonzero(self.active))
+        cops, suspects = cops[suspects >= 0], suspects[suspects >= 0]
+        if len(cops) == 0:
+            return
+
+        # A suspect claimed by several cops is arrested by one of them
+        suspects, first = np.unique(suspects, return_index=True)
+        cops = cops[first]
+        self.relocate('cops', self.cop_pos[cops], self.pos[suspects])
+        self.cop_pos[cops] = self.pos[suspects]
+        self.count_in_vision('active', self.pos[suspects],
+                             np.full(len(suspects), -1, dtype=np.int64))
+        self.active[suspects] = False
+
+        max_jailed_term = self.world.get_dynamic_param(MAX_JAILED_TERM[0])
+        if max_jailed_term > 0:
+            self.jail_term[suspects] = self.rng.integers(1, max_jailed_term + 1, size=len(suspects))
@@ -0,0 +1,28 @@
+import importlib
+import os
+import sys
+
+import pytest
+
+# Author: Dafu Ai
+# Fixtures shared by the tests of both models. The modules of the models share their names,
+# so they are imported afresh from the directory of every model.
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODELS = ['original-model', 'extended-model']
+
+
+@pytest.fixture(params=MODELS)
+def modules(request):
+    """An importer of the modules of a model (by name), e.g. modules('models')."""
+    path = os.path.join(ROOT, request.param)
+    names = [name[:-3] for name in os.listdir(path) if name.endswith('.py')]
+    for name in names:
+        sys.modules.pop(name, None)
+    sys.path.insert(0, path)
+    try:
+        yield importlib.import_module
+    finally:
+        sys.path.remove(path)
+        for name in names:
+            sys.modules.pop(name, None)
@@ -0,0 +1,76 @@
+import pytest
+
+# Author: Dafu Ai
+# Conversion of the dynamic parameters and their resolution from a schedule.
+
+
+def test_convert_to_the_type_of_the_field(modules):
+    DynamicParams = modules('dynamic_params').DynamicParams
+    assert DynamicParams.convert('government_legitimacy', 1) == 1.0
+    assert isinstance(DynamicParams.convert('government_legitimacy', 1), float)
+    assert DynamicParams.convert('max_jailed_term', 20.0) == 20
+    assert isinstance(DynamicParams.convert('max_jailed_term', 20.0), int)
+    assert DynamicParams.convert('movement', False) is False
+
+
+@pytest.mark.parametrize('key, value', [
+    ('movement', 1),
+    ('max_jailed_term', 2.5),
+    ('max_jailed_term', True),
+    ('government_legitimacy', '0.5'),
+])
+def test_convert_rejects_values_which_do_not_fit(modules, key, value):
+    with pytest.raises(ValueError):
+        modules('dynamic_params').DynamicParams.convert(key, value)
+
+
+def test_schedule_sets_and_ramps(modules):
+    dynamic_params = modules('dynamic_params')
+    schedule = dynamic_params.ParamSchedule([
+        {'frame': 10, 'set': {'government_legitimacy': 0.3, 'movement': False}},
+        {'frame': 20, 'until': 30, 'ramp': {'government_legitimacy': 0.8, 'max_jailed_term': 10}},
+    ], dynamic_params.DynamicParams(government_legitimacy=0.9))
+    reader = dynamic_params.ScheduledParamReader(schedule)
+
+    assert reader.refresh(9).government_legitimacy == 0.9
+    assert reader.refresh(9).movement is True
+    assert reader.refresh(10).government_legitimacy == 0.3
+    assert reader.refresh(10).movement is False
+    assert reader.refresh(20).government_legitimacy == 0.3
+    assert reader.refresh(25).government_legitimacy == pytest.approx(0.55)
+    assert reader.refresh(30).government_legitimacy == 0.8
+    assert reader.refresh(100).government_legitimacy == 0.8
+
+    # Integer parameters are rounded along a ramp
+    assert reader.refresh(25).max_jailed_term == 20
+    assert isinstance(reader.refresh(27).max_jailed_term, int)
+
+
+def test_schedule_goes_back(modules):
+    dynamic_params = modules('dynamic_params')
+    reader = dynamic_params.ScheduledParamReader(dynamic_params.ParamSchedule(
+        [{'frame': 10, 'set': {'government_legitimacy': 0.3}}]))
+
+    assert reader.refresh(50).government_legitimacy == 0.3
+    assert reader.refresh(5).government_legitimacy == 0.5
+    assert reader.refresh(10).government_legitimacy == 0.3
+
+
+def test_scheduled_values_are_converted(modules):
+    dynamic_params = modules('dynamic_params')
+    schedule = dynamic_params.ParamSchedule([{'frame': 1, 'set': {'government_legitimacy': 1}}])
+    value = dynamic_params.ScheduledParamReader(schedule).refresh(1).government_legitimacy
+    assert value == 1.0 and isinstance(value, float)
+
+
+@pytest.mark.parametrize('events', [
+    [{'frame': 10, 'set': {'vision': 3.0}}],
+    [{'frame': 10, 'set': {'movement': 1}}],
+    [{'frame': 10, 'until': 20, 'ramp': {'movement': False}}],
+    [{'frame': 10, 'until': 10, 'ramp': {'government_legitimacy': 0.2}}],
+    [{'frame': 10, 'until': 20, 'ramp': {'government_legitimacy': 0.2}},
+     {'frame': 15, 'set': {'government_legitimacy': 0.4}}],
+])
+def test_invalid_schedules_are_rejected(modules, events):
+    with pytest.raises(ValueError):
+        modules('dynamic_params').ParamSchedule(events)
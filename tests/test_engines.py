@@ -0,0 +1,42 @@
+import csv
+from statistics import mean
+
+# Author: Dafu Ai
+# The array engines against the object engine. Their series are not step-by-step equivalent,
+# so the means of the counts are compared within a tolerance.
+
+SEEDS = [3, 4]
+FRAMES = 400
+WARM_UP = 100       # Frames left out of the means, while the counts settle
+TOLERANCE = 0.15    # Largest relative difference of the means
+SLACK = 5           # Largest absolute difference on top of it (for the small counts)
+
+
+def count_means(modules, tmp_path, engine, **config):
+    """The mean (quiet, jailed, active) counts over the seeds, after the warm-up frames."""
+    models = modules('models')
+    static_params = modules('static_params')
+    reader = modules('dynamic_params').DynamicParamReader(str(tmp_path / 'params.json'))
+    rows = []
+
+    for seed in SEEDS:
+        output = str(tmp_path / '{}-{}.csv'.format(engine, seed))
+        with models.World(reader, output, engine=engine, config=static_params.SimulationConfig(
+                seed=seed, output_format='csv', **config)) as world:
+            for frame in range(1, FRAMES + 1):
+                world.update(frame)
+        with open(output, newline='') as file:
+            rows += [row for row in csv.DictReader(file) if int(row['frame']) > WARM_UP]
+
+    return [mean(int(row[column]) for row in rows) for column in ('quiet', 'jailed', 'active')]
+
+
+def assert_close(means, expected):
+    for value, reference in zip(means, expected):
+        assert abs(value - reference) <= TOLERANCE * reference + SLACK
+
+
+def test_array_engines_match_the_object_engine(modules, tmp_path):
+    expected = count_means(modules, tmp_path, 'object')
+    assert_close(count_means(modules, tmp_path, 'numpy'), expected)
+    assert_close(count_means(modules, tmp_path, 'decomposed', workers=1), expected)
@@ -0,0 +1,81 @@
+import os
+from types import SimpleNamespace
+
+import pytest
+
+# Author: Dafu Ai
+# The agent counters and the release of jailed agents.
+
+SEED = 1
+FRAMES = 20
+
+
+def new_world(modules, **config):
+    return modules('models').World(
+        modules('dynamic_params').FixedParamReader(), os.devnull,
+        config=modules('static_params').SimulationConfig(seed=SEED, **config))
+
+
+def test_counters_match_a_full_recount(modules):
+    with new_world(modules, debug_counters=True) as world:
+        for frame in range(1, FRAMES + 1):
+            world.update(frame)
+            assert world.count_agents() == world.recount_agents()
+
+
+def test_debug_counters_catch_a_drift(modules):
+    with new_world(modules, debug_counters=True) as world:
+        world.update(1)
+        world.counters.quiet += 1
+        with pytest.raises(RuntimeError):
+            world.update(2)
+
+
+def test_counters_are_not_checked_by_default(modules):
+    with new_world(modules, debug_counters=False) as world:
+        world.update(1)
+        world.counters.quiet += 1
+        world.update(2)
+
+
+def test_jail_wheel_pops_in_id_order(modules):
+    wheel = modules('models').JailWheel()
+    agents = [SimpleNamespace(id=i, release_frame=5) for i in [3, 1, 2]]
+    for agent in agents:
+        wheel.add(agent, 5)
+
+    # A term which changed since is left out of its old bucket
+    agents[0].release_frame = 8
+    wheel.add(agents[0], 8)
+
+    assert [agent.id for agent in wheel.pop(5)] == [1, 2]
+    assert wheel.pop(5) == []
+    assert [agent.id for agent in wheel.pop(8)] == [3]
+
+
+@pytest.mark.parametrize('term', [1, 3])
+def test_jailed_agents_are_released_like_a_countdown(modules, term):
+    """A term set during a frame is counted down at the end of that frame and of every frame
+    after, and the agent is free again once it reaches 0 (same with NetLogo)."""
+    Agent = modules('models').Agent
+
+    with new_world(modules) as world:
+        for frame in range(1, 6):
+            world.update(frame)
+
+        agent = next(turtle for turtle in world.turtles
+                     if isinstance(turtle, Agent) and turtle.is_quiet())
+
+        # Jailed during the next frame, as an arrest would
+        world.frame = 6
+        agent.jail_term = term
+        countdown = term
+
+        for frame in range(6, 6 + term):
+            world.update(frame)
+            countdown -= 1
+            assert agent.is_jailed() == (countdown > 0)
+            assert (agent in world.turtles) == (countdown == 0)
+
+        assert agent.jail_term == 0
+        assert world.count_agents() == world.recount_agents()
@@ -0,0 +1,87 @@
+import csv
+import json
+
+import pytest
+
+# Author: Dafu Ai
+# Output writers of every format, read back.
+
+COLUMNS = ['frame', 'count', 'ratio', 'flag']
+TYPES = [int, int, float, bool]
+ROWS = [[frame, frame * 3, frame / 7, frame % 2 == 0] for frame in range(1, 121)]
+FLUSH_INTERVAL = 50     # Rows are flushed in blocks, the last one partial
+
+
+def write(modules, path, output_format, types=TYPES):
+    with modules('output').open_output(str(path), COLUMNS, output_format, FLUSH_INTERVAL,
+                                       types) as writer:
+        for row in ROWS:
+            writer.write_row(row)
+
+
+@pytest.mark.parametrize('types', [TYPES, None])
+def test_binary_round_trip(modules, tmp_path, types):
+    path = tmp_path / 'out.bin'
+    write(modules, path, 'binary', types)
+
+    columns = modules('output').read_binary(str(path))
+    assert list(columns) == COLUMNS
+    assert [list(row) for row in zip(*columns.values())] == ROWS
+    assert all(isinstance(value, bool) for value in columns['flag'])
+
+
+def test_binary_rejects_a_changed_type(modules, tmp_path):
+    with modules('output').open_output(str(tmp_path / 'out.bin'), COLUMNS, 'binary',
+                                       FLUSH_INTERVAL, TYPES) as writer:
+        with pytest.raises(ValueError):
+            writer.write_row([1, 2.5, 0.5, True])
+
+        # The bad row left nothing behind
+        writer.write_row(ROWS[0])
+
+    assert modules('output').read_binary(str(tmp_path / 'out.bin'))['count'] == [ROWS[0][1]]
+
+
+def test_empty_binary_output_can_be_read(modules, tmp_path):
+    path = tmp_path / 'out.bin'
+    modules('output').open_output(str(path), COLUMNS, 'binary', FLUSH_INTERVAL).close()
+    assert modules('output').read_binary(str(path)) == {column: [] for column in COLUMNS}
+
+
+def test_csv_output(modules, tmp_path):
+    path = tmp_path / 'out.csv'
+    write(modules, path, 'csv')
+
+    with open(path, newline='') as file:
+        rows = list(csv.reader(file))
+    assert rows[0] == COLUMNS
+    assert rows[1:] == [[str(value) for value in row] for row in ROWS]
+
+
+def test_jsonl_output(modules, tmp_path):
+    path = tmp_path / 'out.jsonl'
+    write(modules, path, 'jsonl')
+
+    with open(path) as file:
+        assert [json.loads(line) for line in file] == [dict(zip(COLUMNS, row)) for row in ROWS]
+
+
+def test_world_output_matches_in_every_format(modules, tmp_path):
+    """A world writes the same counts whatever the format of its output."""
+    models = modules('models')
+    SimulationConfig = modules('static_params').SimulationConfig
+    reader = modules('dynamic_params').FixedParamReader()
+
+    for output_format in ['csv', 'binary']:
+        config = SimulationConfig(seed=2, output_format=output_format)
+        with models.World(reader, str(tmp_path / output_format), config=config) as world:
+            for frame in range(1, 11):
+                world.update(frame)
+
+    with open(tmp_path / 'csv', newline='') as file:
+        expected = list(csv.DictReader(file))
+    columns = modules('output').read_binary(str(tmp_path / 'binary'))
+
+    assert list(columns) == models.World.output_columns()
+    for name in ['frame', 'quiet', 'jailed', 'active']:
+        assert columns[name] == [int(row[name]) for row in expected]
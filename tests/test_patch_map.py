@@ -0,0 +1,66 @@
+import importlib
+import os
+import sys
+
+import pytest
+
+# Author: Dafu Ai
+# Neighbourhoods of the patch map, checked for both models (whose modules share their names,
+# so they are imported afresh from the directory of every model).
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODELS = ['original-model', 'extended-model']
+MODULES = ['models', 'static_params', 'dynamic_params', 'grid', 'output', 'snapshot']
+
+
+@pytest.fixture(params=MODELS)
+def model(request):
+    """The models and static_params modules of a model."""
+    path = os.path.join(ROOT, request.param)
+    for name in MODULES:
+        sys.modules.pop(name, None)
+    sys.path.insert(0, path)
+    try:
+        yield importlib.import_module('models'), importlib.import_module('static_params')
+    finally:
+        sys.path.remove(path)
+        for name in MODULES:
+            sys.modules.pop(name, None)
+
+
+def neighbour_counts(model, **config):
+    """The number of neighbours of every patch, for cached and generated neighbours."""
+    models, static_params = model
+    counts = []
+
+    for precompute in [True, False]:
+        patch_map = models.PatchMap(None, static_params.SimulationConfig(
+            precompute_neighbours=precompute, **config))
+        for patch in patch_map.patches:
+            neighbours = patch_map.get_neighbours(patch)
+            assert patch not in neighbours
+            assert len({id(neighbour) for neighbour in neighbours}) == len(neighbours)
+            counts.append(len(neighbours))
+
+    return counts
+
+
+def test_torus_neighbourhoods_are_equal(model):
+    """Every patch of a torus sees the whole vision disc, even at the edges."""
+    counts = neighbour_counts(model, map_width=40, map_height=40, vision=7.0, topology='torus')
+    assert set(counts) == {148}
+
+
+def test_bounded_neighbourhoods_shrink_at_the_edges(model):
+    counts = neighbour_counts(model, map_width=40, map_height=40, vision=7.0, topology='bounded')
+    assert max(counts) == 148
+    assert min(counts) < 148
+
+
+@pytest.mark.parametrize('width, height', [(5, 5), (3, 6), (1, 1)])
+@pytest.mark.parametrize('topology', ['torus', 'bounded'])
+def test_map_smaller_than_the_vision(model, width, height, topology):
+    """A map smaller than the vision disc: every other patch is seen once."""
+    counts = neighbour_counts(model, map_width=width, map_height=height, vision=7.0,
+                              topology=topology)
+    assert set(counts) == {width * height - 1}
@@ -0,0 +1,80 @@
+import csv
+
+# Author: Dafu Ai
+# Snapshots of a world: a resumed run or a fork continues exactly as the saved world would have.
+
+SEED = 5
+FRAMES = 20
+SAVED_FRAME = 10
+
+
+def rows(path, first=1):
+    """The rows of a csv output, from a frame on."""
+    with open(path, newline='') as file:
+        return [row for row in csv.reader(file)][first:]
+
+
+def run(world, first, last):
+    with world:
+        for frame in range(first, last + 1):
+            world.update(frame)
+
+
+def new_world(modules, path):
+    config = modules('static_params').SimulationConfig(seed=SEED, output_format='csv')
+    return modules('models').World(modules('dynamic_params').FixedParamReader(), str(path),
+                                   config=config)
+
+
+def test_resumed_run_continues_exactly(modules, tmp_path):
+    models = modules('models')
+    snapshot = str(tmp_path / 'world.snap')
+
+    world = new_world(modules, tmp_path / 'full.csv')
+    with world:
+        for frame in range(1, FRAMES + 1):
+            world.update(frame)
+            if frame == SAVED_FRAME:
+                world.save_snapshot(snapshot)
+
+    resumed = models.World.load_snapshot(snapshot, modules('dynamic_params').FixedParamReader(),
+                                         str(tmp_path / 'resumed.csv'))
+    assert resumed.frame == SAVED_FRAME
+    run(resumed, SAVED_FRAME + 1, FRAMES)
+
+    assert rows(tmp_path / 'resumed.csv') == rows(tmp_path / 'full.csv', SAVED_FRAME + 1)
+
+
+def test_forks_with_the_same_seed_are_equal(modules, tmp_path):
+    world = new_world(modules, tmp_path / 'parent.csv')
+    with world:
+        for frame in range(1, SAVED_FRAME + 1):
+            world.update(frame)
+
+        branches = [world.fork(str(tmp_path / 'branch{}.csv'.format(i)), seed=1) for i in range(2)]
+        for branch in branches:
+            run(branch, SAVED_FRAME + 1, FRAMES)
+
+        for frame in range(SAVED_FRAME + 1, FRAMES + 1):
+            world.update(frame)
+
+    assert rows(tmp_path / 'branch0.csv') == rows(tmp_path / 'branch1.csv')
+
+    # Forking leaves the parent as it was
+    run(new_world(modules, tmp_path / 'unforked.csv'), 1, FRAMES)
+    assert rows(tmp_path / 'parent.csv') == rows(tmp_path / 'unforked.csv')
+
+
+def test_forks_derive_distinct_seeds(modules, tmp_path):
+    world = new_world(modules, tmp_path / 'parent.csv')
+    with world:
+        for frame in range(1, SAVED_FRAME + 1):
+            world.update(frame)
+
+        seeds = []
+        for i in range(2):
+            with world.fork(str(tmp_path / 'branch{}.csv'.format(i))) as branch:
+                seeds.append(branch.config.seed)
+
+    assert seeds[0] != seeds[1]
+    assert world.forks == 2
@@ -0,0 +1,99 @@
+import csv
+
+import pytest
+
+# Author: Dafu Ai
+# Planning of parameter sweeps, and a small sweep run end to end.
+
+SAMPLES = 8
+
+
+def test_grid_combines_every_value(modules):
+    runs = modules('sweep').plan_runs({
+        'parameters': {'government_legitimacy': [0.6, 0.8], 'vision': [5.0, 7.0, 9.0]},
+        'replicates': 2
+    })
+    assert len(runs) == 12
+    assert [run.run for run in runs] == list(range(12))
+    assert [run.replicate for run in runs] == [0, 1] * 6
+    assert len({(run.values['government_legitimacy'], run.values['vision']) for run in runs}) == 6
+
+
+def test_latin_hypercube_uses_every_stratum_once(modules):
+    runs = modules('sweep').plan_runs({
+        'method': 'lhs',
+        'parameters': {'government_legitimacy': [0.2, 1.0], 'max_jailed_term': [1, 50]},
+        'samples': SAMPLES
+    })
+    assert len(runs) == SAMPLES
+
+    legitimacy = [run.values['government_legitimacy'] for run in runs]
+    assert sorted(int((value - 0.2) / 0.8 * SAMPLES) for value in legitimacy) == \
+        list(range(SAMPLES))
+
+    # Integer parameters get integer values
+    terms = [run.values['max_jailed_term'] for run in runs]
+    assert all(isinstance(term, int) and 1 <= term <= 50 for term in terms)
+
+
+@pytest.mark.parametrize('parameters', [
+    {'movement': [1]},
+    {'max_jailed_term': [2.5]},
+    {'no_such_parameter': [1]},
+])
+def test_invalid_values_fail_before_any_run(modules, parameters):
+    with pytest.raises(ValueError):
+        modules('sweep').plan_runs({'parameters': parameters})
+
+
+def test_swept_values_are_converted(modules):
+    sweep = modules('sweep')
+    run = sweep.plan_runs({'parameters': {'government_legitimacy': [1], 'vision': [5.0]}})[0]
+    config, params = sweep.split_values(run.values)
+    assert config.vision == 5.0
+    assert params.government_legitimacy == 1.0 and isinstance(params.government_legitimacy, float)
+
+
+def test_seeds_of_runs(modules):
+    sweep = modules('sweep')
+    spec = {'parameters': {'government_legitimacy': [0.6, 0.8]}, 'replicates': 3, 'seed': 4}
+
+    seeds = [run.seed for run in sweep.plan_runs(spec)]
+    assert len(set(seeds)) == 6
+    assert seeds == [run.seed for run in sweep.plan_runs(spec)]
+
+    # The replicates of a batch share the seed of the batch
+    batched = [run.seed for run in sweep.plan_runs(dict(spec, batched=True))]
+    assert batched == [seeds[0]] * 3 + [seeds[3]] * 3
+
+
+def test_sweep_without_replicates_writes_an_empty_index(modules, tmp_path):
+    paths = modules('sweep').run_sweep({
+        'parameters': {'government_legitimacy': [0.6, 0.8]},
+        'replicates': 0,
+        'output_dir': str(tmp_path)
+    })
+    assert paths == []
+
+    with open(tmp_path / 'runs.csv', newline='') as file:
+        assert list(csv.reader(file)) == [['run', 'replicate', 'seed', 'government_legitimacy',
+                                           'output']]
+
+
+def test_small_sweep(modules, tmp_path):
+    paths = modules('sweep').run_sweep({
+        'parameters': {'government_legitimacy': [0.6, 0.8]},
+        'max_frames': 3,
+        'output_dir': str(tmp_path),
+        'analysis': True
+    }, workers=1)
+    assert len(paths) == 2
+
+    for path in paths:
+        with open(path, newline='') as file:
+            assert [row['frame'] for row in csv.DictReader(file)] == ['1', '2', '3']
+
+    with open(tmp_path / 'runs.csv', newline='') as file:
+        index = list(csv.DictReader(file))
+    assert [row['government_legitimacy'] for row in index] == ['0.6', '0.8']
+    assert (tmp_path / 'analysis.csv').exists()